@@ -0,0 +1,123 @@
+import React, { useEffect, useRef, useState } from 'react';
+
+// Pan/zoom viewer for a DeepZoom pyramid from /api/scans/<id>/tiles/.
+// Only the tiles that intersect the viewport at the current zoom level are
+// requested; tile URLs are immutable, so the browser cache does the rest.
+function DeepZoomViewer({ tiles, width = 1000, height = 700 }) {
+  const { width: imageWidth, height: imageHeight, max_level: maxLevel, tile_size: tileSize, overlap } = tiles;
+  const fitScale = Math.min(width / imageWidth, height / imageHeight, 1);
+  const [view, setView] = useState({
+    scale: fitScale,
+    x: (width - imageWidth * fitScale) / 2,
+    y: (height - imageHeight * fitScale) / 2,
+  });
+  const drag = useRef(null);
+  const container = useRef(null);
+
+  const zoomAt = (factor, cx, cy) => {
+    setView((v) => {
+      const scale = Math.min(Math.max(v.scale * factor, fitScale / 2), 4);
+      const applied = scale / v.scale;
+      return { scale, x: cx - (cx - v.x) * applied, y: cy - (cy - v.y) * applied };
+    });
+  };
+
+  useEffect(() => {
+    // Non-passive so the page does not scroll while zooming.
+    const node = container.current;
+    const onWheel = (e) => {
+      e.preventDefault();
+      const rect = node.getBoundingClientRect();
+      zoomAt(e.deltaY < 0 ? 1.25 : 0.8, e.clientX - rect.left, e.clientY - rect.top);
+    };
+    node.addEventListener('wheel', onWheel, { passive: false });
+    return () => node.removeEventListener('wheel', onWheel);
+  });
+
+  const onPointerDown = (e) => {
+    drag.current = { x: e.clientX, y: e.clientY };
+    e.currentTarget.setPointerCapture(e.pointerId);
+  };
+  const onPointerMove = (e) => {
+    if (!drag.current) return;
+    const dx = e.clientX - drag.current.x;
+    const dy = e.clientY - drag.current.y;
+    drag.current = { x: e.clientX, y: e.clientY };
+    setView((v) => ({ ...v, x: v.x + dx, y: v.y + dy }));
+  };
+  const onPointerUp = () => {
+    drag.current = null;
+  };
+
+  // Lowest level with at least one image pixel per screen pixel.
+  const level = Math.min(maxLevel, Math.max(0, maxLevel - Math.floor(Math.log2(1 / view.scale))));
+  const levelFactor = 2 ** (maxLevel - level);
+  const levelWidth = Math.ceil(imageWidth / levelFactor);
+  const levelHeight = Math.ceil(imageHeight / levelFactor);
+  const levelScale = view.scale * levelFactor;
+
+  const firstCol = Math.max(0, Math.floor(-view.x / levelScale / tileSize));
+  const lastCol = Math.min(Math.ceil(levelWidth / tileSize) - 1, Math.floor((width - view.x) / levelScale / tileSize));
+  const firstRow = Math.max(0, Math.floor(-view.y / levelScale / tileSize));
+  const lastRow = Math.min(Math.ceil(levelHeight / tileSize) - 1, Math.floor((height - view.y) / levelScale / tileSize));
+
+  const visible = [];
+  for (let col = firstCol; col <= lastCol; col++) {
+    for (let row = firstRow; row <= lastRow; row++) {
+      const left = Math.max(col * tileSize - overlap, 0);
+      const top = Math.max(row * tileSize - overlap, 0);
+      const right = Math.min((col + 1) * tileSize + overlap, levelWidth);
+      const bottom = Math.min((row + 1) * tileSize + overlap, levelHeight);
+      visible.push(
+        <img
+          key={`${level}/${col}_${row}`}
+          src={tiles.url.replace('{level}', level).replace('{col}', col).replace('{row}', row)}
+          alt=""
+          draggable={false}
+          style={{
+            position: 'absolute',
+            left: view.x + left * levelScale,
+            top: view.y + top * levelScale,
+            width: (right - left) * levelScale,
+            height: (bottom - top) * levelScale,
+          }}
+        />
+      );
+    }
+  }
+
+  return (
+    <div style={{ margin: '0 auto 20px', maxWidth: `${width}px` }}>
+      <div
+        ref={container}
+        onPointerDown={onPointerDown}
+        onPointerMove={onPointerMove}
+        onPointerUp={onPointerUp}
+        style={{
+          position: 'relative',
+          overflow: 'hidden',
+          width: `${width}px`,
+          height: `${height}px`,
+          background: '#000',
+          borderRadius: '8px',
+          boxShadow: '0 0 15px rgba(0, 188, 212, 0.6)',
+          cursor: 'grab',
+          touchAction: 'none',
+        }}
+      >
+        {visible}
+      </div>
+      <div style={{ textAlign: 'center', marginTop: '8px' }}>
+        <button onClick={() => zoomAt(1.5, width / 2, height / 2)}>＋</button>
+        <button onClick={() => zoomAt(1 / 1.5, width / 2, height / 2)}>－</button>
+        <button onClick={() => setView({
+          scale: fitScale,
+          x: (width - imageWidth * fitScale) / 2,
+          y: (height - imageHeight * fitScale) / 2,
+        })}>Fit</button>
+      </div>
+    </div>
+  );
+}
+
+export default DeepZoomViewer;
@@ -1,12 +1,17 @@
 import React, { useEffect, useState } from 'react';
-import { useParams } from 'react-router-dom';
+import { Link, useParams } from 'react-router-dom';
 import axios from 'axios';
+import DeepZoomViewer from './DeepZoomViewer';
 
 function ScanDetail() {
   const { id } = useParams();
   const [scan, setScan] = useState(null);
   const [imageError, setImageError] = useState(false);
   const [imageLoading, setImageLoading] = useState(true);
+  const [tiles, setTiles] = useState(null);
+  const [zoomMode, setZoomMode] = useState(false);
+  const [nearDuplicates, setNearDuplicates] = useState([]);
+  const [similar, setSimilar] = useState([]);
 
   useEffect(() => {
     //axios.get(`https://xray-backend-391z.onrender.com/api/scans/${id}/`)
@@ -21,6 +26,24 @@ function ScanDetail() {
       .catch((err) => {
         console.error(" Failed to fetch scan detail:", err);
       });
+
+    // 404 until the tile pyramid is built; the preview is shown meanwhile.
+    setTiles(null);
+    setZoomMode(false);
+    axios.get(`${apiUrl}/scans/${id}/tiles/`)
+      .then((res) => setTiles(res.data))
+      .catch(() => setTiles(null));
+
+    // 404 until the perceptual hash is computed.
+    setNearDuplicates([]);
+    axios.get(`${apiUrl}/scans/${id}/near-duplicates/?fields=id,patient_id,body_part,scan_date`)
+      .then((res) => setNearDuplicates(res.data.results))
+      .catch(() => setNearDuplicates([]));
+
+    setSimilar([]);
+    axios.get(`${apiUrl}/scans/${id}/similar/?k=8&fields=id,patient_id,diagnosis,thumbnail_url,thumbnail_webp_url`)
+      .then((res) => setSimilar(res.data.results))
+      .catch(() => setSimilar([]));
   }, [id]);
 
   const handleImageLoad = () => {
@@ -41,7 +64,17 @@ function ScanDetail() {
     <div className="container fade-up">
       <h1 className="page-title">Scan Detail</h1>
       
-      {scan.image && !imageError && (
+      {tiles && (
+        <div style={{ textAlign: 'center', marginBottom: '10px' }}>
+          <button onClick={() => setZoomMode((z) => !z)}>
+            {zoomMode ? 'Show preview' : '🔍 Deep zoom'}
+          </button>
+        </div>
+      )}
+
+      {zoomMode && tiles && <DeepZoomViewer tiles={tiles} />}
+
+      {!zoomMode && scan.image && !imageError && (
         <div className="image-container">
           {imageLoading && (
             <div style={{ 
@@ -54,7 +87,7 @@ function ScanDetail() {
           )}
           <div className="image-container" style={{ textAlign: 'center', maxWidth: '1000px', margin: '0 auto' }}>
           <img
-            src={scan.image}
+            src={scan.preview_webp_url || scan.preview_url || scan.image}
             alt="Full X-ray"
             className="detail-image"
             onLoad={handleImageLoad}
@@ -100,6 +133,39 @@ function ScanDetail() {
           <span key={index} className="tag">{tag}</span>
         ))}</p>
       </div>
+
+      {nearDuplicates.length > 0 && (
+        <div className="card">
+          <p><strong>Near-duplicate scans:</strong></p>
+          <ul>
+            {nearDuplicates.map((match) => (
+              <li key={match.id}>
+                <Link to={`/scan/${match.id}`}>{match.patient_id}</Link>
+                {' '}– {match.body_part}, {match.scan_date} ({match.distance} bits apart)
+              </li>
+            ))}
+          </ul>
+        </div>
+      )}
+
+      {similar.length > 0 && (
+        <div className="card">
+          <p><strong>Similar-looking scans:</strong></p>
+          <div style={{ display: 'flex', flexWrap: 'wrap', gap: '10px' }}>
+            {similar.map((match) => (
+              <Link key={match.id} to={`/scan/${match.id}`} style={{ textAlign: 'center' }}>
+                <img
+                  src={match.thumbnail_webp_url || match.thumbnail_url}
+                  alt={match.patient_id}
+                  loading="lazy"
+                  style={{ width: '120px', height: '120px', objectFit: 'cover', borderRadius: '4px' }}
+                />
+                <div>{match.patient_id} – {match.diagnosis}</div>
+              </Link>
+            ))}
+          </div>
+        </div>
+      )}
     </div>
   );
 }
@@ -7,6 +7,7 @@ import skeletonImage from './assets/skeleton.png'; // ✅ Make sure this is insi
 function ScanList() {
   const [scans, setScans] = useState([]);
   const [search, setSearch] = useState('');
+  const [debouncedSearch, setDebouncedSearch] = useState('');
   const [filters, setFilters] = useState({
     body_part: null,
     diagnosis: null,
@@ -19,29 +20,30 @@ function ScanList() {
   });
 
   useEffect(() => {
-    axios.get(`${process.env.REACT_APP_API_URL}/scans/`)
+    axios.get(`${process.env.REACT_APP_API_URL}/scans/facets/`)
 .then((res) => {
-      const data = Array.isArray(res.data) ? res.data : res.data.results || [];
-      console.log('📊 Scans data received:', data);
-      setScans(data);
-
-      const bodyParts = [...new Set(data.map((s) => s.body_part))];
-      const diagnoses = [...new Set(data.map((s) => s.diagnosis))];
-      const institutions = [...new Set(data.map((s) => s.institution))];
+      const toOptions = (facet) =>
+        (res.data[facet] || []).map(({ value, count }) => ({ value, label: `${value} (${count})` }));
 
       setOptions({
-        body_parts: bodyParts.map((bp) => ({ value: bp, label: bp })),
-        diagnoses: diagnoses.map((d) => ({ value: d, label: d })),
-        institutions: institutions.map((i) => ({ value: i, label: i })),
+        body_parts: toOptions('body_part'),
+        diagnoses: toOptions('diagnosis'),
+        institutions: toOptions('institution'),
       });
     });
   }, []);
 
+  // Wait for a pause in typing instead of querying on every keystroke.
+  useEffect(() => {
+    const timer = setTimeout(() => setDebouncedSearch(search.trim()), 300);
+    return () => clearTimeout(timer);
+  }, [search]);
+
   useEffect(() => {
    let url = `${process.env.REACT_APP_API_URL}/scans/`;
 
     const query = [];
-    if (search) query.push(`search=${search}`);
+    if (debouncedSearch) query.push(`search=${encodeURIComponent(debouncedSearch)}`);
     if (filters.body_part) query.push(`body_part=${filters.body_part.value}`);
     if (filters.diagnosis) query.push(`diagnosis=${filters.diagnosis.value}`);
     if (filters.institution) query.push(`institution=${filters.institution.value}`);
@@ -51,7 +53,7 @@ function ScanList() {
       const data = Array.isArray(res.data) ? res.data : res.data.results || [];
       setScans(data);
     });
-  }, [search, filters]);
+  }, [debouncedSearch, filters]);
 
   const SkeletonImage = () => (
     <div className="skeleton-right">
@@ -149,7 +151,7 @@ function ScanList() {
                 {scan.image ? (
                   <>
                     <img
-                      src={scan.image}
+                      src={scan.thumbnail_webp_url || scan.thumbnail_url || scan.image}
                       alt="X-ray"
                       className="scan-image"
                       onLoad={handleImageLoad}
@@ -95,8 +95,9 @@ function UploadScan() {
         timeout: 30000, // 30 second timeout
       });
 
-      console.log('✅ Upload successful:', response.data);
-      alert('Upload successful!');
+      console.log('✅ Upload accepted:', response.data);
+      // The image is transferred in the background; the scan shows up now.
+      alert('Upload received! The image will appear once processing finishes.');
     //  navigate('/');
       window.location.href='/';
     } catch (error) {
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import XRayScan
+from .models import UploadJob, XRayScan
 
 
 admin.site.register(XRayScan)
+admin.site.register(UploadJob)
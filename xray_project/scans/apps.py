@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ScansConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'scans'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals
+        post_migrate.connect(signals.ensure_fulltext, sender=self)
+        post_migrate.connect(signals.ensure_tag_sync, sender=self)
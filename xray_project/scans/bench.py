@@ -0,0 +1,285 @@
+"""Helpers shared by the benchmark management commands."""
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest import mock
+from wsgiref.simple_server import WSGIRequestHandler
+
+import cloudinary
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.db import connection
+from django.test import override_settings
+
+from . import search, synthetic
+from .models import XRayScan
+
+
+@contextmanager
+def scratch_database():
+    """
+    Run the block against a freshly migrated, file-backed copy of the
+    default database, deleted afterwards. Benchmarks never touch real data.
+    """
+    handle, path = tempfile.mkstemp(suffix='.sqlite3', prefix='xray-bench-')
+    os.close(handle)
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    previous_name = test_settings.get('NAME')
+    test_settings['NAME'] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield path
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings['NAME'] = previous_name
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def insert_synthetic_scans(count, batch_size=10000, seed=0, images=0):
+    """
+    Bulk insert `count` scans built by `synthetic.generate`. With `images`,
+    each scan references one of that many Cloudinary public ids (nothing
+    is stored behind them).
+    """
+    sample_images = None
+    if images:
+        sample_images = {'': [{'image': f'xray_images/scan_{index:06d}'} for index in range(images)]}
+    return synthetic.generate(count, batch_size=batch_size, seed=seed, sample_images=sample_images)
+
+
+def time_call(func, repeat=5):
+    """Run `func` `repeat` times; return the median wall time in ms."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def percentiles(timings):
+    """p50/p95/p99 of `timings`, interpolated between samples."""
+    if len(timings) < 2:
+        value = timings[0] if timings else 0.0
+        return {'p50': value, 'p95': value, 'p99': value}
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98]}
+
+
+@contextmanager
+def local_image_storage():
+    """
+    Keep uploads, renditions, tiles and features in a temporary directory
+    instead of Cloudinary, and give the Cloudinary URL builder a cloud name
+    (nothing is sent anywhere).
+    """
+    root = tempfile.mkdtemp(prefix='xray-bench-media-')
+    if not cloudinary.config().cloud_name:
+        cloudinary.config(cloud_name='benchmark')
+    try:
+        with override_settings(
+            MEDIA_ROOT=root,
+            SCANS_IMAGE_STORAGE='scans.storage.LocalImageStorage',
+            SCANS_UPLOAD_STAGING_DIR=os.path.join(root, 'staging'),
+            SCANS_TILES_ROOT=os.path.join(root, 'tiles'),
+            SCANS_FEATURES_DIR=os.path.join(root, 'features'),
+        ):
+            yield root
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class StubElasticsearch:
+    """
+    Stand-in for the cluster, installed in place of `search.execute`.
+
+    Every query gets the same ranking, newest scan first, paged by the
+    `from` / `search_after` / `size` of the real request body, so timings
+    cover everything Django does around Elasticsearch (building the query,
+    hydrating and serializing the page) plus `latency` seconds for the
+    round trip. With `available=False` every search fails over to the
+    database fallback, as when the breaker is open.
+    """
+
+    def __init__(self, available=True, latency=0.0, hits=10000):
+        self.available = available
+        self.latency = latency
+        self.hits = hits
+        self.ranked = self.position = None
+
+    @contextmanager
+    def installed(self):
+        with mock.patch.object(search, 'execute', self.execute):
+            yield self
+
+    def execute(self, build):
+        if not self.available:
+            return None
+        body = build().to_dict()
+        if self.ranked is None:
+            self.ranked = list(
+                XRayScan.objects.order_by('-scan_date', '-id').values_list('id', flat=True)[:self.hits]
+            )
+            self.position = {pk: index for index, pk in enumerate(self.ranked)}
+        if self.latency:
+            time.sleep(self.latency)
+        start = body.get('from', 0)
+        if 'search_after' in body:
+            start = self.position.get(body['search_after'][-1], len(self.ranked)) + 1
+        hits = [
+            SimpleNamespace(meta=SimpleNamespace(id=str(pk), sort=[1.0, 0, pk]))
+            for pk in self.ranked[start:start + body.get('size', 10)]
+        ]
+        buckets = SimpleNamespace(buckets=[])
+        return SimpleNamespace(
+            hits=_Hits(hits, len(self.ranked)),
+            aggregations=SimpleNamespace(body_part=buckets, diagnosis=buckets, institution=buckets),
+        )
+
+
+class _Hits(list):
+    def __init__(self, hits, total):
+        super().__init__(hits)
+        self.total = SimpleNamespace(value=total)
+
+
+class StubCluster:
+    """
+    In-memory stand-in for the Elasticsearch client used by index
+    maintenance (`index_scans`, `search_sync.drain`): the `indices` calls
+    they make plus bulk writes, with `bulk` / `parallel_bulk` installed
+    over elasticsearch.helpers. As in Elasticsearch, a write to an alias
+    lands in the one index it points at. `on_bulk`, when set, is called
+    after each bulk request, e.g. to change scans mid-rebuild.
+    """
+
+    def __init__(self):
+        self.indices = _StubIndices(self)
+        self.documents = {}  # index -> {id: source}
+        self.meta = {}
+        self.aliases = {}  # alias -> set of indexes
+        self.on_bulk = None
+
+    def options(self, **kwargs):
+        return self
+
+    @contextmanager
+    def installed(self):
+        from .documents import XRayScanDocument
+
+        with mock.patch('elasticsearch.helpers.bulk', self.bulk), \
+                mock.patch('elasticsearch.helpers.parallel_bulk', self.parallel_bulk), \
+                mock.patch.object(XRayScanDocument, '_get_connection', return_value=self):
+            yield self
+
+    def resolve(self, name):
+        indexes = self.aliases.get(name)
+        if indexes is None:
+            return name if name in self.documents else None
+        return next(iter(indexes)) if len(indexes) == 1 else None
+
+    def source(self, name, doc_id):
+        """The document `doc_id` in index or alias `name`, or None."""
+        return self.documents.get(self.resolve(name), {}).get(int(doc_id))
+
+    def results(self, actions):
+        for action in actions:
+            op = action.get('_op_type', 'index')
+            index = self.resolve(action['_index'])
+            result = {'_index': action['_index'], '_id': action['_id'], 'status': 200}
+            if index is None:
+                result['status'] = 404
+            elif op == 'delete':
+                if self.documents[index].pop(int(action['_id']), None) is None:
+                    result['status'] = 404
+            else:
+                self.documents[index][int(action['_id'])] = action['_source']
+            yield result['status'] < 300, {op: result}
+        if self.on_bulk:
+            self.on_bulk()
+
+    def bulk(self, client, actions, **kwargs):
+        results = list(self.results(actions))
+        return sum(ok for ok, _ in results), [item for ok, item in results if not ok]
+
+    def parallel_bulk(self, client, actions, **kwargs):
+        yield from self.results(actions)
+
+
+class _StubIndices:
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def _matching(self, index):
+        if index.endswith('*'):
+            return sorted(name for name in self.cluster.documents if name.startswith(index[:-1]))
+        return [index] if index in self.cluster.documents else []
+
+    def create(self, index, body=None, **kwargs):
+        self.cluster.documents[index] = {}
+        self.cluster.meta[index] = {}
+
+    def exists(self, index):
+        return index in self.cluster.documents
+
+    def get(self, index):
+        return {name: {} for name in self._matching(index)}
+
+    def delete(self, index):
+        del self.cluster.documents[index]
+        del self.cluster.meta[index]
+        for indexes in self.cluster.aliases.values():
+            indexes.discard(index)
+
+    def exists_alias(self, name):
+        return bool(self.cluster.aliases.get(name))
+
+    def get_alias(self, name):
+        return {index: {'aliases': {name: {}}} for index in sorted(self.cluster.aliases.get(name, ()))}
+
+    def update_aliases(self, actions):
+        for action in actions:
+            (op, spec), = action.items()
+            if op == 'add':
+                self.cluster.aliases.setdefault(spec['alias'], set()).add(spec['index'])
+            elif op == 'remove':
+                self.cluster.aliases[spec['alias']].discard(spec['index'])
+            else:
+                self.delete(spec['index'])
+
+    def get_mapping(self, index):
+        return {name: {'mappings': {'_meta': self.cluster.meta[name]}} for name in self._matching(index)}
+
+    def put_mapping(self, index, meta):
+        self.cluster.meta[index] = meta
+
+    def put_settings(self, index, settings):
+        pass
+
+    def refresh(self, index):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def local_http_server():
+    """Serve the project on an ephemeral localhost port; yields its base URL."""
+    server = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler, allow_reuse_address=False)
+    server.set_app(WSGIHandler())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
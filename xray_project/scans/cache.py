@@ -0,0 +1,89 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import caches
+from django.db.models import F
+
+from . import metrics
+from .models import DatasetGeneration
+
+GENERATION_ID = 1
+
+
+def get_state():
+    """
+    (generation, last modified Unix time) of the dataset, in one primary
+    key lookup. The generation changes whenever a scan is written.
+    """
+    rows = DatasetGeneration.objects.filter(pk=GENERATION_ID).values_list('generation', 'modified_at')
+    state = rows.first()
+    if state is None:
+        # Seed from the clock so a fresh row can never collide with keys
+        # cached under an earlier value. An unknown last write is treated
+        # as "just now", which is never earlier than the real one.
+        now = time.time()
+        DatasetGeneration.objects.bulk_create(
+            [DatasetGeneration(pk=GENERATION_ID, generation=int(now * 1000), modified_at=now)],
+            ignore_conflicts=True,
+        )
+        state = rows.first()
+    return state
+
+
+def get_generation():
+    """Current dataset generation; changes whenever a scan is written."""
+    return get_state()[0]
+
+
+def get_last_modified():
+    """Unix time of the last scan write, or of the first read if unknown."""
+    return get_state()[1]
+
+
+def bump_generation():
+    """
+    Invalidate every entry cached under the current generation. Inside a
+    transaction the bump commits (or rolls back) with the write, so no
+    process sees the new generation before the data it stands for.
+    """
+    bumped = DatasetGeneration.objects.filter(pk=GENERATION_ID).update(
+        generation=F('generation') + 1, modified_at=time.time()
+    )
+    if not bumped:
+        get_state()
+
+
+def normalize_params(query_params, exclude=()):
+    """
+    Canonical string for a QueryDict, skipping `exclude` keys. Keys are
+    sorted but each key's values keep their order: filters read with
+    `.get()` use the last one, so `?a=1&a=2` and `?a=2&a=1` differ.
+    """
+    items = []
+    for key, values in sorted(query_params.lists()):
+        if key in exclude:
+            continue
+        # Blank values are kept: `?cursor=` and no cursor page differently.
+        # JSON keeps values containing commas apart.
+        items.append(f'{key}={json.dumps([value.strip() for value in values])}')
+    return '&'.join(items)
+
+
+def versioned_key(prefix, query_params, exclude=(), generation=None):
+    normalized = normalize_params(query_params, exclude)
+    digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+    if generation is None:
+        generation = get_generation()
+    return f'scans:{prefix}:{generation}:{digest}'
+
+
+def get_search_response(key):
+    """Cached search response data for `key`, counting hits and misses."""
+    data = caches['search'].get(key)
+    metrics.inc('search_cache_requests_total', result='miss' if data is None else 'hit')
+    return data
+
+
+def set_search_response(key, data):
+    caches['search'].set(key, data)
@@ -1,17 +1,28 @@
 from django_elasticsearch_dsl import Document, Index, fields
 from django_elasticsearch_dsl.registries import registry
 from .models import XRayScan
+from .tags import normalize_all
 
 xray_index = Index('xray_scans')
 xray_index.settings(number_of_shards=1, number_of_replicas=0)
 
-#@registry.register_document
+@registry.register_document
 class XRayScanDocument(Document):
+    id = fields.LongField()
+    scan_date = fields.DateField()
     description = fields.TextField()
-    diagnosis = fields.TextField()
     tags = fields.TextField(multi=True)
-    body_part = fields.TextField()
-    institution = fields.TextField()
+    # Normalized as in scans.tags, for exact `?tag=` filters.
+    tag_names = fields.KeywordField(multi=True)
+    # Analyzed for search; the `raw` keyword sub-field serves exact filters
+    # and facet aggregations.
+    diagnosis = fields.TextField(fields={'raw': fields.KeywordField()})
+    body_part = fields.TextField(fields={'raw': fields.KeywordField()})
+    institution = fields.TextField(fields={'raw': fields.KeywordField()})
+    patient_id = fields.TextField(fields={'raw': fields.KeywordField()})
+    # CloudinaryField has no automatic ES mapping, which is what kept this
+    # document from being registered.
+    image = fields.KeywordField(index=False)
 
     class Index:
         name = 'xray_scans'
@@ -19,4 +30,20 @@ class XRayScanDocument(Document):
 
     class Django:
         model = XRayScan
-        fields = ['patient_id', 'scan_date', 'image']
+        fields = []
+
+
+def scan_source(scan):
+    """The document body indexed for one scan."""
+    return {
+        'id': scan.pk,
+        'patient_id': scan.patient_id,
+        'body_part': scan.body_part,
+        'scan_date': scan.scan_date,
+        'institution': scan.institution,
+        'description': scan.description,
+        'diagnosis': scan.diagnosis,
+        'tags': scan.tags,
+        'tag_names': normalize_all(scan.tags) if isinstance(scan.tags, list) else [],
+        'image': str(scan.image) if scan.image else None,
+    }
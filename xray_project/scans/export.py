@@ -0,0 +1,71 @@
+"""
+Streaming encoders for GET /api/scans/export/.
+
+Each encoder turns an iterator of list-serializer rows into an iterator of
+bytes, so an export of any size runs in constant memory: rows come from a
+server-side cursor, are encoded one at a time, and are flushed to the
+client in OUTPUT_CHUNK_SIZE pieces.
+"""
+import csv
+import io
+import json
+import zlib
+
+OUTPUT_CHUNK_SIZE = 64 * 1024
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+
+def ndjson_lines(data):
+    for item in data:
+        yield json.dumps(item, separators=(',', ':')) + '\n'
+
+
+def csv_lines(data, fields):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(fields)
+    yield flush()
+    for item in data:
+        writer.writerow([
+            json.dumps(value) if isinstance(value, (list, dict)) else value
+            for value in (item[name] for name in fields)
+        ])
+        yield flush()
+
+
+def chunked(lines, size=OUTPUT_CHUNK_SIZE):
+    """Join text lines into UTF-8 chunks of about `size` bytes."""
+    pending, length = [], 0
+    for line in lines:
+        pending.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(pending).encode('utf-8')
+            pending, length = [], 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def encode(data, output, fields, gzip=False):
+    lines = ndjson_lines(data) if output == 'ndjson' else csv_lines(data, fields)
+    chunks = chunked(lines)
+    return gzipped(chunks) if gzip else chunks
@@ -0,0 +1,29 @@
+from collections import Counter
+
+from django.db.models import Count
+
+FACET_FIELDS = ('body_part', 'diagnosis', 'institution')
+
+
+def compute_facets(queryset):
+    """
+    Distinct values and row counts for each facet field.
+
+    A single GROUP BY over all facet columns is rolled up per field in
+    Python; the number of groups is bounded by the vocabulary of the
+    facets, not by the number of scans.
+    """
+    counters = {field: Counter() for field in FACET_FIELDS}
+    rows = queryset.order_by().values_list(*FACET_FIELDS).annotate(n=Count('id'))
+    for row in rows:
+        *values, n = row
+        for field, value in zip(FACET_FIELDS, values):
+            counters[field][value] += n
+
+    return {
+        field: [
+            {'value': value, 'count': count}
+            for value, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+        ]
+        for field, counter in counters.items()
+    }
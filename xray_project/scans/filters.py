@@ -0,0 +1,44 @@
+from django_filters import rest_framework as filters
+from django_filters.widgets import QueryArrayWidget
+
+from . import tags
+from .models import XRayScan
+
+
+class TagWidget(QueryArrayWidget):
+    """QueryArrayWidget that splits every value on commas, repeated ones too."""
+
+    def value_from_datadict(self, data, files, name):
+        values = super().value_from_datadict(data, files, name)
+        return sorted({part.strip() for value in values for part in value.split(',') if part.strip()})
+
+
+class TagFilter(filters.BaseInFilter, filters.CharFilter):
+    """
+    Tag names from `?tag=a&tag=b`, `?tag=a,b` or `?tag[]=a`. The split is
+    done here, once for the DB and Elasticsearch paths, so a stored tag
+    containing a comma cannot be filtered on.
+    """
+
+
+class XRayScanFilter(filters.FilterSet):
+    """
+    Exact matches on the facet columns plus a `scan_date_after` /
+    `scan_date_before` range, and exact tags: scans with every `tag`, or
+    any of them with `tag_mode=any`. search.py compiles the same fields
+    into Elasticsearch filter clauses, so both paths accept identical params.
+    """
+    scan_date = filters.DateFromToRangeFilter()
+    tag = TagFilter(widget=TagWidget, method='filter_tags')
+    # Read by filter_tags.
+    tag_mode = filters.ChoiceFilter(choices=tags.MODE_CHOICES, method='filter_nothing')
+
+    class Meta:
+        model = XRayScan
+        fields = ['body_part', 'institution', 'diagnosis', 'patient_id', 'scan_date']
+
+    def filter_tags(self, queryset, name, value):
+        return tags.filter_scans(queryset, value, self.form.cleaned_data.get('tag_mode') or tags.ALL)
+
+    def filter_nothing(self, queryset, name, value):
+        return queryset
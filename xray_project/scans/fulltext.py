@@ -0,0 +1,150 @@
+"""
+SQLite FTS5 index over the searchable XRayScan columns.
+
+The index is an external-content FTS5 table: it stores only the inverted
+index and reads column values back from `scans_xrayscan`. Triggers on the
+scans table keep it in sync, so bulk_create, queryset.update() and raw SQL
+writes are covered as well as model saves.
+"""
+import re
+
+from django.db import connection
+
+from .models import XRayScan
+
+FTS_TABLE = 'scans_xrayscan_fts'
+
+# Column -> BM25 weight. Hits on the short, curated fields count for more
+# than hits in free-text descriptions.
+FTS_COLUMNS = {
+    'description': 1.0,
+    'diagnosis': 4.0,
+    'tags': 3.0,
+    'body_part': 2.0,
+    'institution': 1.0,
+    'patient_id': 5.0,
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_available = {}
+
+
+def _statements(table):
+    columns = ', '.join(FTS_COLUMNS)
+    new_values = ', '.join(f'new.{column}' for column in FTS_COLUMNS)
+    old_values = ', '.join(f'old.{column}' for column in FTS_COLUMNS)
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {columns},
+            content='{table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns})
+            VALUES ('delete', old.id, {old_values});
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values});
+        END
+        """,
+    ]
+
+
+def install(conn=None, rebuild=False):
+    """
+    Create the FTS table and sync triggers if they are missing.
+
+    Safe to call repeatedly. SQLite drops triggers whenever a migration
+    rebuilds the scans table, so this also runs after every migrate.
+    Returns False when the database is not SQLite or lacks FTS5.
+    """
+    conn = conn or connection
+    _available.pop(conn.alias, None)
+    if conn.vendor != 'sqlite':
+        return False
+
+    table = XRayScan._meta.db_table
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+        )
+        rebuild = rebuild or cursor.fetchone() is None
+        try:
+            for sql in _statements(table):
+                cursor.execute(sql)
+        except Exception:
+            # SQLite compiled without FTS5: search keeps using icontains.
+            return False
+        if rebuild:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def uninstall(conn=None):
+    conn = conn or connection
+    _available.pop(conn.alias, None)
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def is_available(conn=None):
+    conn = conn or connection
+    if conn.vendor != 'sqlite':
+        return False
+    if conn.alias not in _available:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+            )
+            _available[conn.alias] = cursor.fetchone() is not None
+    return _available[conn.alias]
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, each as a
+    prefix so that partially typed terms still hit. Quoting each token
+    keeps FTS5 operators in user input from being interpreted.
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search(queryset, text):
+    """
+    Restrict `queryset` to scans matching `text`, best BM25 match first.
+
+    Returns None when the FTS index is unavailable or `text` has no
+    searchable words, so the caller can fall back to `icontains`.
+    """
+    match = build_match_query(text)
+    if match is None or not is_available():
+        return None
+
+    table = XRayScan._meta.db_table
+    weights = ', '.join(str(weight) for weight in FTS_COLUMNS.values())
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[match],
+        select={'search_rank': f'bm25({FTS_TABLE}, {weights})'},
+        order_by=['search_rank', '-scan_date', '-id'],
+    )
@@ -0,0 +1,330 @@
+"""
+Image processing for stored scans.
+
+Derivative renditions (grid thumbnails, a mid-size preview, and WebP
+variants of both) are rendered with Pillow from the staged upload and kept
+through the image storage backend; `XRayScan.renditions` maps rendition
+name to stored value.
+
+Full-resolution originals also get a DeepZoom tile pyramid on local disk
+under SCANS_TILES_ROOT, described by `XRayScan.tiles`, so viewers fetch
+only the tiles in view at each zoom level.
+
+Per-scan processing steps are registered in STEPS so
+`manage.py process_images` can backfill existing scans, including the
+`content_hash` that upload deduplication keys on, the
+`perceptual_hash` behind near-duplicate search, and the feature vectors
+behind similarity search.
+"""
+import hashlib
+import logging
+import math
+import os
+import shutil
+import tempfile
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from . import similarity
+from .models import XRayScan
+
+logger = logging.getLogger(__name__)
+
+# name -> (longest side in px, Pillow format)
+RENDITIONS = {
+    'preview': (1024, 'JPEG'),
+    'preview_webp': (1024, 'WEBP'),
+    'thumbnail': (256, 'JPEG'),
+    'thumbnail_webp': (256, 'WEBP'),
+}
+EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+QUALITY = 85
+
+
+def load(path, max_size=None):
+    """
+    Open an image for rendering: upright, 8-bit grayscale or RGB. With
+    `max_size`, JPEGs are decoded at reduced scale when that still leaves
+    at least `max_size` pixels on each side.
+    """
+    image = Image.open(path)
+    if max_size and image.format == 'JPEG':
+        image.draft(image.mode, (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode.startswith('I'):
+        # 16-bit radiographs: keep the top 8 bits rather than clipping.
+        image = image.convert('I').point(lambda value: value * (1 / 256)).convert('L')
+    elif image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    return image
+
+
+def render(image, directory, stem):
+    """Write every rendition of `image` into `directory`; returns {name: path}."""
+    paths = {}
+    # Largest first, each size scaled down from the previous one.
+    current = image
+    for name, (size, image_format) in sorted(RENDITIONS.items(), key=lambda item: -item[1][0]):
+        if max(current.size) > size:
+            current = current.copy()
+            current.thumbnail((size, size), Image.LANCZOS)
+        path = os.path.join(directory, f'{stem}_{name}{EXTENSIONS[image_format]}')
+        current.save(path, image_format, quality=QUALITY, optimize=image_format == 'JPEG')
+        paths[name] = path
+    return paths
+
+
+def store_renditions(source_path, storage):
+    """
+    Render and store the renditions of the image at `source_path`.
+
+    Returns {name: stored value}, or {} when the file is not a readable
+    image. Storage errors propagate so the caller can retry.
+    """
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            largest = max(size for size, _ in RENDITIONS.values())
+            with load(source_path, max_size=largest) as image:
+                paths = render(image, directory, stem)
+        except (UnidentifiedImageError, OSError) as e:
+            logger.warning(f"Can't render {source_path}: {e}")
+            return {}
+        return {name: storage.save(path) for name, path in paths.items()}
+
+
+def renditions_step(scan, source_path, storage):
+    renditions = store_renditions(source_path, storage)
+    if renditions:
+        # update() skips signals; process_images bumps the generation once.
+        XRayScan.objects.filter(pk=scan.pk).update(renditions=renditions, updated_at=timezone.now())
+    return bool(renditions)
+
+
+def tiles_path(scan_id, version, *parts):
+    return os.path.join(settings.SCANS_TILES_ROOT, str(scan_id), version, *parts)
+
+
+def build_tiles(scan_id, source_path):
+    """
+    Cut a DeepZoom pyramid for the image at `source_path`.
+
+    Level `max_level` is full resolution and each level below halves it, down
+    to 1x1 at level 0. Tiles are `tile_size` square plus `overlap` pixels
+    on inner edges, named `<level>/<col>_<row>.jpg`. Each build goes to a
+    fresh version directory, so tile URLs never change content and can be
+    cached forever. Returns the descriptor for `XRayScan.tiles`, or None
+    when the file is not a readable image.
+    """
+    tile_size, overlap = settings.SCANS_TILE_SIZE, settings.SCANS_TILE_OVERLAP
+    try:
+        image = load(source_path)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Can't tile {source_path}: {e}")
+        return None
+
+    width, height = image.size
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    version = uuid.uuid4().hex[:12]
+    directory = tiles_path(scan_id, version)
+    building = f'{directory}.tmp'
+
+    try:
+        _cut_levels(image, building, max_level, tile_size, overlap)
+        os.rename(building, directory)
+    except Exception:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+
+    return {
+        'version': version,
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'format': 'jpg',
+        'max_level': max_level,
+    }
+
+
+def _cut_levels(image, directory, max_level, tile_size, overlap):
+    width, height = image.size
+    level_image = image
+    for level in range(max_level, -1, -1):
+        scale = 2 ** (max_level - level)
+        size = (math.ceil(width / scale), math.ceil(height / scale))
+        if level_image.size != size:
+            # Halve the previous level rather than resampling the original.
+            level_image = level_image.resize(size, Image.LANCZOS)
+        level_dir = os.path.join(directory, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        for col in range(math.ceil(size[0] / tile_size)):
+            for row in range(math.ceil(size[1] / tile_size)):
+                box = (
+                    max(col * tile_size - overlap, 0),
+                    max(row * tile_size - overlap, 0),
+                    min((col + 1) * tile_size + overlap, size[0]),
+                    min((row + 1) * tile_size + overlap, size[1]),
+                )
+                level_image.crop(box).save(
+                    os.path.join(level_dir, f'{col}_{row}.jpg'), 'JPEG', quality=QUALITY
+                )
+
+
+def remove_tiles(scan_id, keep=None):
+    """Delete a scan's tile pyramids, except the `keep` version."""
+    root = os.path.join(settings.SCANS_TILES_ROOT, str(scan_id))
+    if not os.path.isdir(root):
+        return
+    for version in os.listdir(root):
+        if version != keep:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def share_tiles(tiles, source_id, scan_id):
+    """
+    Give `scan_id` its own copy of another scan's pyramid, hard-linked where
+    the filesystem allows, so either scan can be deleted independently.
+    Returns the descriptor, or None when there is nothing to share.
+    """
+    if not tiles:
+        return None
+    try:
+        shutil.copytree(
+            tiles_path(source_id, tiles['version']), tiles_path(scan_id, tiles['version']),
+            copy_function=_link_or_copy, dirs_exist_ok=True,
+        )
+    except OSError as e:
+        logger.warning(f"Can't share tiles of scan {source_id} with scan {scan_id}: {e}")
+        return None
+    return tiles
+
+
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def tiles_step(scan, source_path, storage):
+    tiles = build_tiles(scan.pk, source_path)
+    if tiles:
+        XRayScan.objects.filter(pk=scan.pk).update(tiles=tiles, updated_at=timezone.now())
+        remove_tiles(scan.pk, keep=tiles['version'])
+    return bool(tiles)
+
+
+def file_hash(path):
+    """SHA-256 hex digest of the file at `path`, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def perceptual_hash(path):
+    """
+    64-bit difference hash (dHash) of the image at `path`, as 16 hex digits.
+
+    Each bit compares two horizontally adjacent pixels of a 9x8 grayscale
+    thumbnail, so the hash survives rescaling and recompression; near
+    copies differ in a few bits. Returns '' when the file is not a
+    readable image.
+    """
+    try:
+        with load(path, max_size=64) as image:
+            small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Can't hash {path}: {e}")
+        return ''
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left, right = pixels[row * 9 + col], pixels[row * 9 + col + 1]
+            bits = bits << 1 | (left > right)
+    return f'{bits:016x}'
+
+
+def perceptual_hash_step(scan, source_path, storage):
+    value = perceptual_hash(source_path)
+    if value:
+        XRayScan.objects.filter(pk=scan.pk).update(perceptual_hash=value, updated_at=timezone.now())
+    return bool(value)
+
+
+def describe(path):
+    """
+    Feature vector of the image at `path` for similarity search, or None
+    when the file is not a readable image. Three blocks, each centred or
+    scaled to unit length so none dominates: an 8x8 intensity thumbnail
+    (64), a 16-bin intensity histogram (16), and gradient orientation
+    histograms for the top and bottom halves (2x8). The whole vector is
+    unit length, so dot products are cosine similarities.
+    """
+    try:
+        with load(path, max_size=256) as image:
+            gray = image.convert('L')
+            gray.thumbnail((256, 256), Image.BILINEAR)
+            thumbnail = np.asarray(gray.resize((8, 8), Image.BOX), dtype=np.float32).ravel() / 255
+            pixels = np.asarray(gray, dtype=np.float32) / 255
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Can't describe {path}: {e}")
+        return None
+
+    histogram = np.sqrt(np.histogram(pixels, bins=16, range=(0, 1))[0].astype(np.float32))
+    dy, dx = np.gradient(pixels)
+    magnitude = np.hypot(dx, dy)
+    orientation = np.minimum((np.arctan2(dy, dx) % np.pi) / np.pi * 8, 7).astype(np.intp)
+    half = len(pixels) // 2
+    gradients = np.concatenate([
+        np.bincount(orientation[rows].ravel(), weights=magnitude[rows].ravel(), minlength=8)
+        for rows in (slice(None, half), slice(half, None))
+    ]).astype(np.float32)
+
+    blocks = [_unit(thumbnail - thumbnail.mean()), _unit(histogram), _unit(gradients)]
+    return _unit(np.concatenate(blocks))
+
+
+def _unit(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def features_step(scan, source_path, storage):
+    vector = describe(source_path)
+    if vector is not None:
+        similarity.get_store().write(scan.pk, vector)
+        XRayScan.objects.filter(pk=scan.pk).update(has_features=True)
+    return vector is not None
+
+
+def content_hash_step(scan, source_path, storage):
+    XRayScan.objects.filter(pk=scan.pk).update(
+        content_hash=file_hash(source_path), updated_at=timezone.now()
+    )
+    return True
+
+
+class Step:
+    """A backfill step: which scans still need it, and how to run it on one."""
+
+    def __init__(self, pending, run):
+        self.pending = pending
+        self.run = run
+
+
+STEPS = {
+    'renditions': Step(pending=Q(renditions={}), run=renditions_step),
+    'tiles': Step(pending=Q(tiles__isnull=True), run=tiles_step),
+    'content_hash': Step(pending=Q(content_hash=''), run=content_hash_step),
+    'perceptual_hash': Step(pending=Q(perceptual_hash=''), run=perceptual_hash_step),
+    'features': Step(pending=Q(has_features=False), run=features_step),
+}
@@ -0,0 +1,83 @@
+"""
+Where a request's time goes: DB queries, Elasticsearch calls and
+serialization, accumulated on the RequestStats of the request being
+handled on this thread (see `scans.middleware.RequestMetricsMiddleware`).
+
+DB queries are timed by a connection execute wrapper installed for the
+request. Elasticsearch calls (`scans.search.execute`) and serializers
+report themselves through `record_es` and `timing_serializer`; outside a
+tracked request these are no-ops. With `capture`, the SQL and ES query
+bodies are kept too, for the slow-request log.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+# Per request; a runaway N+1 should not also exhaust memory.
+MAX_CAPTURED = 200
+
+_current = contextvars.ContextVar('scans_request_stats', default=None)
+
+
+class RequestStats:
+    def __init__(self, capture=False):
+        self.capture = capture
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.es_calls = 0
+        self.es_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.queries = []  # (kind, statement, seconds) when capturing
+
+    def __call__(self, execute, sql, params, many, context):
+        """Connection execute wrapper."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.db_queries += 1
+            self.db_seconds += elapsed
+            self._keep('sql', sql, elapsed)
+
+    def _keep(self, kind, statement, seconds):
+        if self.capture and len(self.queries) < MAX_CAPTURED:
+            self.queries.append((kind, statement, seconds))
+
+
+@contextmanager
+def tracking(capture=False):
+    """Collect RequestStats for the enclosed block on this thread."""
+    stats = RequestStats(capture)
+    token = _current.set(stats)
+    try:
+        with connection.execute_wrapper(stats):
+            yield stats
+    finally:
+        _current.reset(token)
+
+
+def record_es(seconds, search=None):
+    """Count one Elasticsearch round trip; `search` is the Search sent."""
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.es_calls += 1
+    stats.es_seconds += seconds
+    if stats.capture and search is not None:
+        stats._keep('es', search.to_dict(), seconds)
+
+
+@contextmanager
+def timing_serializer():
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_seconds += time.perf_counter() - started
@@ -0,0 +1,284 @@
+import io
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from scans.bench import (
+    StubElasticsearch, insert_synthetic_scans, local_http_server, local_image_storage, percentiles,
+    scratch_database,
+)
+from scans.models import UploadJob, XRayScan
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'api_baseline.json')
+# p95 latencies of repeated runs on one machine vary by up to about this
+# much; across machines the baseline is not comparable at all.
+DEFAULT_TOLERANCE = 0.25
+SCENARIOS = ['list', 'filter', 'search_es', 'search_fallback', 'detail', 'create']
+SEARCH_TERMS = ['pneumonia', 'lung', 'fracture knee', 'mayo', 'effusion noted', 'tuberculosis severe']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the scans API (list, filter, search, detail, create) on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 100_000, 1_000_000],
+                            help='Dataset sizes to benchmark')
+        parser.add_argument('--requests', type=int, default=100,
+                            help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Untimed requests before each scenario')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'Comma-separated, from: {", ".join(SCENARIOS)}')
+        parser.add_argument('--transport', choices=['client', 'http', 'both'], default='both',
+                            help='Django test client, a local HTTP server, or both')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Concurrent connections for the HTTP transport (create runs one at a time)')
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--es-latency', type=float, default=2.0,
+                            help='Simulated Elasticsearch round trip, in ms')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                            help='Baseline JSON to compare against')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Write these results to --baseline instead of comparing')
+        parser.add_argument('--tolerance', type=float, default=None,
+                            help='Allowed p95 slowdown against the baseline, as a fraction '
+                                 f'(default: the one saved with the baseline, else {DEFAULT_TOLERANCE})')
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help='Exit with an error when a scenario regressed')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = [name for name in scenarios if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}')
+        transports = ['client', 'http'] if options['transport'] == 'both' else [options['transport']]
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.gradient = Image.linear_gradient('L').resize((1024, 1024))
+        self.client = Client(SERVER_NAME='localhost')
+        self.regressions = 0
+        self.sequence = itertools.count()
+        # Per-request console logging would dominate the timings.
+        logging.getLogger('scans').setLevel(logging.WARNING)
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        baseline = None
+        saved = {}
+        if not options['save_baseline'] and os.path.exists(options['baseline']):
+            with open(options['baseline']) as source:
+                saved = json.load(source)
+            baseline = saved['results']
+            if saved.get('machine') != machine():
+                self.stdout.write(self.style.WARNING(
+                    f'The baseline was recorded on {saved.get("machine") or "an unrecorded machine"}; '
+                    'latencies are only comparable on the same one.'
+                ))
+        if options['tolerance'] is None:
+            options['tolerance'] = saved.get('tolerance', DEFAULT_TOLERANCE)
+
+        results = {}
+        with ExitStack() as stack:
+            stack.enter_context(scratch_database())
+            stack.enter_context(local_image_storage())
+            if 'http' in transports:
+                self.base_url = stack.enter_context(local_http_server())
+            loaded = 0
+            for rows in sorted(options['rows']):
+                self.stdout.write(f'Loading {rows} rows...')
+                loaded += insert_synthetic_scans(rows - loaded, seed=rows, images=1000)
+                self.ids = list(XRayScan.objects.values_list('id', flat=True))
+                for transport in transports:
+                    measured = {name: self.run_scenario(name, transport) for name in scenarios}
+                    results.setdefault(str(rows), {})[transport] = measured
+                    self.report(rows, transport, measured, (baseline or {}).get(str(rows), {}).get(transport))
+
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']) or '.', exist_ok=True)
+            with open(options['baseline'], 'w') as out:
+                json.dump({
+                    'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'machine': machine(),
+                    'options': {name: options[name] for name in ('requests', 'page_size', 'concurrency', 'es_latency')},
+                    'tolerance': options['tolerance'],
+                    'results': results,
+                }, out, indent=2, sort_keys=True)
+                out.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {options["baseline"]}'))
+        elif baseline is None:
+            self.stdout.write(f'No baseline at {options["baseline"]}; run with --save-baseline to record one.')
+        elif self.regressions and options['fail_on_regression']:
+            raise CommandError(f'{self.regressions} scenario(s) regressed against {options["baseline"]}')
+
+    def make_upload(self, index):
+        # Distinct bytes per upload, or content-hash deduplication would
+        # skip every transfer after the first.
+        info = PngInfo()
+        info.add_text('benchmark', str(index))
+        buffer = io.BytesIO()
+        self.gradient.save(buffer, 'PNG', pnginfo=info)
+        return buffer.getvalue()
+
+    def request_for(self, name, index):
+        """(method, path, body) for the `index`th request of a scenario."""
+        page_size = self.options['page_size']
+        if name == 'list':
+            return 'GET', f'/api/scans/?page_size={page_size}', None
+        if name == 'filter':
+            return 'GET', f'/api/scans/?body_part=Chest&diagnosis=Normal&page_size={page_size}', None
+        if name in ('search_es', 'search_fallback'):
+            # A query string never sent before, so the search response cache
+            # never answers: this measures the search itself.
+            query = urlencode({
+                'search': SEARCH_TERMS[index % len(SEARCH_TERMS)], 'page_size': page_size, '_': next(self.sequence),
+            })
+            return 'GET', f'/api/scans/?{query}', None
+        if name == 'detail':
+            return 'GET', f'/api/scans/{self.rng.choice(self.ids)}/', None
+        body = encode_multipart(BOUNDARY, {
+            'patient_id': f'B{index:06d}', 'body_part': 'Chest', 'scan_date': '2024-01-01',
+            'institution': 'Benchmark', 'description': 'Benchmark upload', 'diagnosis': 'Normal',
+            'tags': '["benchmark"]', 'image': _NamedBytes(self.make_upload(index), 'bench.png'),
+        })
+        return 'POST', '/api/scans/', body
+
+    def run_scenario(self, name, transport):
+        es = StubElasticsearch(
+            available=name != 'search_fallback', latency=self.options['es_latency'] / 1000
+        )
+        warmup, count = self.options['warmup'], self.options['requests']
+        with es.installed():
+            for index in range(warmup):
+                self.send(transport, *self.request_for(name, -1 - index))
+            requests = [self.request_for(name, index) for index in range(count)]
+            if transport == 'client':
+                measured = self.run_client(requests)
+            else:
+                # SQLite takes one writer at a time; concurrent creates
+                # would mostly measure lock contention.
+                measured = self.run_http(requests, 1 if name == 'create' else self.options['concurrency'])
+        if name == 'create':
+            self.wait_for_uploads()
+        return measured
+
+    def run_client(self, requests):
+        timings, queries, errors = [], 0, 0
+        started = time.perf_counter()
+        for request in requests:
+            with CaptureQueriesContext(connection) as captured:
+                elapsed, status = self.send('client', *request)
+            timings.append(elapsed)
+            queries += len(captured)
+            errors += status >= 400
+        total = time.perf_counter() - started
+        return self.summary(timings, total, errors, queries=queries / len(requests))
+
+    def run_http(self, requests, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(lambda request: self.send('http', *request), requests))
+        total = time.perf_counter() - started
+        timings = [elapsed for elapsed, _ in outcomes]
+        errors = sum(status >= 400 for _, status in outcomes)
+        return self.summary(timings, total, errors)
+
+    def send(self, transport, method, path, body):
+        """Issue one request; returns (elapsed ms, status)."""
+        if transport == 'client':
+            started = time.perf_counter()
+            if method == 'GET':
+                response = self.client.get(path)
+            else:
+                response = self.client.generic('POST', path, body, content_type=MULTIPART_CONTENT)
+            return (time.perf_counter() - started) * 1000, response.status_code
+
+        request = Request(self.base_url + path, data=body, method=method)
+        if body is not None:
+            request.add_header('Content-Type', MULTIPART_CONTENT)
+        started = time.perf_counter()
+        try:
+            with urlopen(request, timeout=60) as response:
+                response.read()
+                status = response.status
+        except HTTPError as e:
+            status = e.code
+        return (time.perf_counter() - started) * 1000, status
+
+    def wait_for_uploads(self, timeout=300):
+        """Let the upload pool drain so its work doesn't bleed into the next scenario."""
+        deadline = time.monotonic() + timeout
+        busy = UploadJob.objects.filter(status__in=[UploadJob.PENDING, UploadJob.RUNNING])
+        while busy.exists() and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+    def summary(self, timings, total, errors, queries=None):
+        return {
+            **{key: round(value, 2) for key, value in percentiles(timings).items()},
+            'requests': len(timings),
+            'throughput': round(len(timings) / total, 1),
+            'queries': None if queries is None else round(queries, 1),
+            'errors': errors,
+        }
+
+    def report(self, rows, transport, measured, baseline):
+        self.stdout.write(f'\n{rows} rows, {transport} ({self.options["requests"]} requests per scenario)')
+        self.stdout.write(
+            f'{"scenario":<17}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"req/s":>9}'
+            f'{"queries":>9}{"errors":>8}  vs baseline p95'
+        )
+        for name, result in measured.items():
+            queries = '-' if result['queries'] is None else f'{result["queries"]:.1f}'
+            line = (
+                f'{name:<17}{result["p50"]:>9.1f}{result["p95"]:>9.1f}{result["p99"]:>9.1f}'
+                f'{result["throughput"]:>9.1f}{queries:>9}{result["errors"]:>8}'
+            )
+            previous = (baseline or {}).get(name)
+            if previous:
+                change = result['p95'] / previous['p95'] - 1 if previous['p95'] else 0
+                regressed = change > self.options['tolerance'] or (
+                    result['queries'] is not None and previous.get('queries') is not None
+                    and result['queries'] > previous['queries']
+                )
+                comparison = f'  {change:+.0%}' + (' REGRESSION' if regressed else '')
+                self.regressions += regressed
+                line = (self.style.ERROR if regressed else str)(line + comparison)
+            self.stdout.write(line)
+
+
+def machine():
+    """What a baseline's latencies depend on besides the code."""
+    return {
+        'cpus': os.cpu_count(),
+        'platform': platform.platform(),
+        'processor': platform.machine(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+    }
+
+
+class _NamedBytes(io.BytesIO):
+    """File-like upload body that encode_multipart names `name`."""
+
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
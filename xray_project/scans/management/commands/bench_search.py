@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from scans import fulltext
+from scans.bench import insert_synthetic_scans, scratch_database, time_call
+from scans.models import XRayScan
+
+QUERIES = ['pneumonia', 'lung', 'fracture knee', 'mayo', 'effusion noted', 'tuberculosis severe', 'P0004242']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark FTS5 search against the icontains fallback on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000],
+                            help='Dataset sizes to benchmark')
+        parser.add_argument('--page-size', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        page_size = options['page_size']
+        repeat = options['repeat']
+
+        def icontains(text):
+            return XRayScan.objects.filter(
+                Q(description__icontains=text) |
+                Q(diagnosis__icontains=text) |
+                Q(tags__icontains=text) |
+                Q(body_part__icontains=text) |
+                Q(institution__icontains=text) |
+                Q(patient_id__icontains=text)
+            ).order_by('-scan_date', '-id')
+
+        def ranked(text):
+            return fulltext.search(XRayScan.objects.order_by('-scan_date', '-id'), text)
+
+        def first_page(queryset):
+            # What the list endpoint does: COUNT(*) plus the first page.
+            return lambda: (queryset.count(), list(queryset[:page_size]))
+
+        with scratch_database():
+            if not fulltext.is_available():
+                self.stdout.write(self.style.ERROR('SQLite FTS5 is not available.'))
+                return
+
+            loaded = 0
+            for rows in sorted(options['rows']):
+                self.stdout.write(f'Loading {rows} rows...')
+                loaded += insert_synthetic_scans(rows - loaded, seed=rows)
+
+                self.stdout.write(f'\n{rows} rows (median of {repeat}, ms)')
+                self.stdout.write(f'{"query":<18}{"icontains":>12}{"fts5":>12}{"speedup":>10}')
+                for text in QUERIES:
+                    slow = time_call(first_page(icontains(text)), repeat)
+                    fast = time_call(first_page(ranked(text)), repeat)
+                    self.stdout.write(f'{text:<18}{slow:>12.1f}{fast:>12.1f}{slow / fast:>9.1f}x')
+                self.stdout.write('')
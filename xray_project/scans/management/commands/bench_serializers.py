@@ -0,0 +1,62 @@
+import logging
+
+import cloudinary
+from django.core.management.base import BaseCommand
+
+from scans.bench import insert_synthetic_scans, scratch_database, time_call
+from scans.models import XRayScan
+from scans.serializers import XRayScanListSerializer, XRayScanSerializer, stored_image_url
+
+
+class Command(BaseCommand):
+    help = 'Benchmark list serialization cost on synthetic data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--images', type=int, default=1000,
+                            help='Distinct image public ids among the rows')
+        parser.add_argument('--repeat', type=int, default=7)
+        parser.add_argument('--per', type=int, default=1000,
+                            help='Report milliseconds per this many rows')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        if not cloudinary.config().cloud_name:
+            # URL building needs a cloud name; nothing is sent anywhere.
+            cloudinary.config(cloud_name='benchmark')
+        # Per-row debug logging to the console would dominate the timings.
+        logging.getLogger('scans.serializers').setLevel(logging.INFO)
+        with scratch_database():
+            insert_synthetic_scans(rows, images=options['images'])
+            queryset = XRayScan.objects.order_by('-scan_date', '-id')
+            scans = list(queryset)
+            full_list = XRayScanListSerializer()
+            sparse_list = XRayScanListSerializer(['id', 'patient_id', 'body_part', 'image_url'])
+
+            def serialize():
+                return XRayScanSerializer(scans, many=True).data
+
+            def serialize_cold():
+                stored_image_url.cache_clear()
+                return serialize()
+
+            def fetch_and_serialize():
+                return XRayScanSerializer(list(queryset), many=True).data
+
+            def values_list_path(list_serializer):
+                return lambda: list_serializer.serialize(list_serializer.rows(queryset))
+
+            per = options['per']
+            scale = per / len(scans)
+            results = [
+                ('URL cache cold', time_call(serialize_cold, repeat)),
+                ('URL cache warm', time_call(serialize, repeat)),
+                ('fetch + ModelSerializer', time_call(fetch_and_serialize, repeat)),
+                ('values() list, all fields', time_call(values_list_path(full_list), repeat)),
+                ('values() list, 4 fields', time_call(values_list_path(sparse_list), repeat)),
+            ]
+
+            self.stdout.write(f'{len(scans)} rows, median of {repeat}, ms per {per} rows')
+            for label, ms in results:
+                self.stdout.write(f'  {label:<27} {ms * scale:8.1f}')
+            self.stdout.write(f'  {stored_image_url.cache_info()}')
@@ -0,0 +1,33 @@
+import math
+import time
+
+from django.core.management.base import BaseCommand
+
+from scans.cache import bump_generation
+from scans.similarity import get_store
+
+
+class Command(BaseCommand):
+    help = 'Train the IVF coarse index used by /api/scans/<id>/similar/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lists', type=int, default=None,
+                            help='Number of k-means lists (default: 4 * sqrt(scans))')
+        parser.add_argument('--iterations', type=int, default=10,
+                            help='k-means iterations')
+        parser.add_argument('--sample', type=int, default=100_000,
+                            help='Scans sampled to train the centroids')
+
+    def handle(self, *args, **options):
+        store = get_store()
+        lists = options['lists'] or max(1, int(4 * math.sqrt(len(store.matrix()))))
+        started = time.perf_counter()
+        indexed = store.build_index(lists, iterations=options['iterations'], sample=options['sample'])
+        if not indexed:
+            self.stdout.write(self.style.WARNING('No feature vectors yet; run process_images --steps features'))
+            return
+        # Cached /similar/ pages were ranked with the previous index.
+        bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} scans into {min(lists, indexed)} lists in {time.perf_counter() - started:.1f}s'
+        ))
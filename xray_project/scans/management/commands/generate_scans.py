@@ -0,0 +1,65 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from scans.models import XRayScan
+from scans.storage import LocalImageStorage, get_storage
+from scans.synthetic import SAMPLE_IMAGES_DIR, generate, store_sample_images
+
+
+class Command(BaseCommand):
+    help = 'Bulk insert synthetic X-ray scans, e.g. to reproduce a production-size dataset locally'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100_000,
+                            help='Scans to create')
+        parser.add_argument('--batch-size', type=int, default=10_000,
+                            help='Rows per bulk insert and transaction')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed produces the same rows')
+        parser.add_argument('--images-dir', default=SAMPLE_IMAGES_DIR,
+                            help='Local images the scans share, stored once through the image storage')
+        parser.add_argument('--upload', action='store_true',
+                            help='Allow storing the images through a remote SCANS_IMAGE_STORAGE')
+        parser.add_argument('--no-images', action='store_true',
+                            help='Create scans without images')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete every existing scan first')
+
+    def handle(self, *args, **options):
+        if options['count'] < 0 or options['batch_size'] < 1:
+            raise CommandError('--count must be at least 0 and --batch-size at least 1')
+
+        sample_images = None
+        if not options['no_images']:
+            if not os.path.isdir(options['images_dir']):
+                raise CommandError(f'Image directory {options["images_dir"]} does not exist')
+            storage = get_storage()
+            if not isinstance(storage, LocalImageStorage) and not options['upload']:
+                raise CommandError(
+                    f'SCANS_IMAGE_STORAGE is {settings.SCANS_IMAGE_STORAGE}; pass --upload to store the '
+                    'sample images there, set it to scans.storage.LocalImageStorage, or use --no-images'
+                )
+            sample_images = store_sample_images(options['images_dir'], storage)
+            self.stdout.write(f'Stored {len(sample_images[""])} shared images')
+
+        if options['clear']:
+            deleted, _ = XRayScan.objects.all().delete()
+            self.stdout.write(f'Deleted {deleted} existing rows')
+
+        started = time.perf_counter()
+
+        def progress(created):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{created}/{options["count"]} scans ({created / elapsed:.0f} rows/s)')
+
+        created = generate(
+            options['count'], batch_size=options['batch_size'], seed=options['seed'],
+            sample_images=sample_images, progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} scans in {time.perf_counter() - started:.1f}s; '
+            'run index_scans to make them searchable through Elasticsearch'
+        ))
@@ -1,51 +1,51 @@
-from django.core.management.base import BaseCommand
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone as django_timezone
 from scans.models import XRayScan
 
+# Clock skew allowed between app servers stamping updated_at and this one.
+CATCH_UP_SLACK = timedelta(seconds=5)
+
+
 class Command(BaseCommand):
     help = 'Index all XRayScan records in Elasticsearch'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows per DB fetch and documents per bulk request')
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Parallel bulk request threads')
+        parser.add_argument('--checkpoint-every', type=int, default=20000,
+                            help='Rows indexed between resumable checkpoints')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue the most recent interrupted rebuild')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Keep the previous index versions after the alias swap')
+
     def handle(self, *args, **options):
         try:
-            from scans.documents import XRayScanDocument
-            
-            # Delete existing index if it exists
-            try:
-                XRayScanDocument._index.delete()
-            except:
-                pass
-            
-            # Create the index
-            XRayScanDocument._index.create()
-            
-            # Index all scans
-            scans = XRayScan.objects.all()
-            count = 0
-            
-            for scan in scans:
-                # Create document instance
-                doc = XRayScanDocument(
-                    meta={'id': scan.id},
-                    patient_id=scan.patient_id,
-                    body_part=scan.body_part,
-                    scan_date=scan.scan_date,
-                    institution=scan.institution,
-                    description=scan.description,
-                    diagnosis=scan.diagnosis,
-                    tags=scan.tags
-                )
-                # Save to Elasticsearch
-                doc.save()
-                count += 1
-                
-            self.stdout.write(
-                self.style.SUCCESS(f'Successfully indexed {count} scans')
-            )
+            from elasticsearch.helpers import parallel_bulk
+            from scans.documents import XRayScanDocument, scan_source
         except ImportError:
             self.stdout.write(
                 self.style.WARNING('Elasticsearch is not configured. Skipping indexing.')
             )
+            return
+
+        try:
+            self.client = XRayScanDocument._get_connection().options(
+                request_timeout=settings.SCANS_INDEXING_TIMEOUT
+            )
+            self.alias = XRayScanDocument._index._name
+            self.rebuild(XRayScanDocument, scan_source, parallel_bulk, options)
+        except CommandError:
+            raise
         except Exception as e:
-            if "Connection refused" in str(e):
+            if "Connection refused" in str(e) or type(e).__name__ == 'ConnectionError':
                 self.stdout.write(
                     self.style.ERROR('Error: Elasticsearch is not running.')
                 )
@@ -64,4 +64,148 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(
                     self.style.ERROR(f'Error indexing scans: {e}')
-                )
\ No newline at end of file
+                )
+
+    def rebuild(self, document, scan_source, parallel_bulk, options):
+        """
+        Build a new versioned index behind the live alias, then swap the
+        alias over in one atomic request. Search keeps answering from the
+        old index for the whole rebuild.
+        """
+        chunk_size = options['chunk_size']
+        if options['resume']:
+            target = self.find_interrupted_index()
+            last_id = self.read_checkpoint(target)
+            self.stdout.write(f'Resuming {target} after scan id {last_id}')
+        else:
+            target = f"{self.alias}_v{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+            # No refreshes or replicas while bulk loading; restored before the swap.
+            document._index.clone(name=target).settings(
+                refresh_interval='-1', number_of_replicas=0
+            ).create(using=self.client)
+            last_id = 0
+            self.write_checkpoint(target, last_id)
+            self.stdout.write(f'Building {target}')
+
+        read_at = django_timezone.now() - CATCH_UP_SLACK
+        queryset = XRayScan.objects.filter(id__gt=last_id).order_by('id')
+        total = queryset.count()
+        rows = queryset.iterator(chunk_size=chunk_size)
+
+        indexed = 0
+        started = time.perf_counter()
+        while True:
+            # Checkpoints fall between segments: parallel_bulk completes
+            # chunks out of order, so only a finished segment is known to be
+            # fully indexed. Re-indexing part of a segment on resume is safe
+            # because documents are keyed by scan id.
+            segment = list(islice(rows, options['checkpoint_every']))
+            if not segment:
+                break
+
+            actions = (
+                {'_index': target, '_id': scan.pk, '_source': scan_source(scan)}
+                for scan in segment
+            )
+            self.send(parallel_bulk, actions, last_id, options)
+            # Changes synced from the outbox (see search_sync.drain) while
+            # this segment was in flight may have been overwritten by the
+            # older copies read for it; index those scans again. Later
+            # changes reach the new index through the outbox.
+            self.send(parallel_bulk, self.catch_up(target, segment, read_at, scan_source), last_id, options)
+
+            last_id = segment[-1].pk
+            self.write_checkpoint(target, last_id)
+            indexed += len(segment)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'  {indexed}/{total} scans, {indexed / elapsed:.0f} docs/s'
+            )
+
+        self.client.indices.put_settings(index=target, settings={
+            'refresh_interval': '1s',
+            'number_of_replicas': document._index._settings.get('number_of_replicas', 0),
+        })
+        self.client.indices.refresh(index=target)
+        self.swap_alias(target, options['keep_old'])
+        # Only now is the index no candidate for --resume.
+        self.write_checkpoint(target, last_id, complete=True)
+
+        elapsed = time.perf_counter() - started
+        rate = indexed / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Successfully indexed {indexed} scans into {target} '
+                f'in {elapsed:.1f}s ({rate:.0f} docs/s)'
+            )
+        )
+
+    def send(self, parallel_bulk, actions, last_id, options):
+        errors = [
+            item for ok, item in parallel_bulk(
+                self.client, actions,
+                thread_count=options['workers'],
+                chunk_size=options['chunk_size'],
+                raise_on_error=False,
+            )
+            # Deleting a document that was never indexed is not a failure.
+            if not ok and item.get('delete', {}).get('status') != 404
+        ]
+        if errors:
+            raise CommandError(
+                f'{len(errors)} documents failed after scan id {last_id}, first: {errors[0]}. '
+                'Fix the cause and rerun with --resume.'
+            )
+
+    def catch_up(self, target, segment, since, scan_source):
+        """Actions re-syncing the segment's scans changed or deleted since `since`."""
+        current = XRayScan.objects.filter(id__gte=segment[0].pk, id__lte=segment[-1].pk)
+        remaining = set(current.values_list('id', flat=True))
+        for scan in current.filter(updated_at__gte=since):
+            yield {'_index': target, '_id': scan.pk, '_source': scan_source(scan)}
+        for scan in segment:
+            if scan.pk not in remaining:
+                yield {'_op_type': 'delete', '_index': target, '_id': scan.pk}
+
+    def swap_alias(self, target, keep_old):
+        actions = [{'add': {'index': target, 'alias': self.alias}}]
+        previous = []
+        if self.client.indices.exists_alias(name=self.alias):
+            previous = list(self.client.indices.get_alias(name=self.alias))
+            actions += [{'remove': {'index': index, 'alias': self.alias}} for index in previous]
+        elif self.client.indices.exists(index=self.alias):
+            # A concrete index from before versioning has the alias's name;
+            # it is dropped in the same atomic request.
+            actions.append({'remove_index': {'index': self.alias}})
+        self.client.indices.update_aliases(actions=actions)
+        self.stdout.write(f'Alias {self.alias} -> {target}')
+
+        if not keep_old:
+            for index in previous:
+                if index != target:
+                    self.client.indices.delete(index=index)
+
+    def find_interrupted_index(self):
+        """
+        The newest rebuild whose checkpoint is still marked incomplete, if
+        it started after the live index and every finished one. Versions
+        kept by --keep-old are complete, so they are never "resumed" and
+        swapped back in.
+        """
+        live = set()
+        if self.client.indices.exists_alias(name=self.alias):
+            live = set(self.client.indices.get_alias(name=self.alias))
+        versions = sorted(self.client.indices.get(index=f'{self.alias}_v*'))
+        if not versions or versions[-1] in live or self.read_meta(versions[-1]).get('complete') is not False:
+            raise CommandError('No interrupted rebuild to resume.')
+        return versions[-1]
+
+    def read_meta(self, index):
+        mapping = self.client.indices.get_mapping(index=index)[index]['mappings']
+        return mapping.get('_meta', {})
+
+    def read_checkpoint(self, index):
+        return self.read_meta(index).get('last_indexed_id', 0)
+
+    def write_checkpoint(self, index, last_id, complete=False):
+        self.client.indices.put_mapping(index=index, meta={'last_indexed_id': last_id, 'complete': complete})
@@ -0,0 +1,108 @@
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+
+from scans.cache import bump_generation
+from scans.images import STEPS
+from scans.models import XRayScan
+from scans.storage import get_storage
+
+
+class Command(BaseCommand):
+    help = 'Backfill image processing steps (renditions, ...) for stored scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--steps', default=','.join(STEPS),
+                            help=f'Comma-separated steps to run, from: {", ".join(STEPS)}')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Scans processed in parallel')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Process at most this many scans')
+        parser.add_argument('--force', action='store_true',
+                            help='Re-run steps on scans that already have their output')
+
+    def handle(self, *args, **options):
+        names = [name.strip() for name in options['steps'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in STEPS]
+        if unknown:
+            raise CommandError(f'Unknown steps: {", ".join(unknown)}')
+        steps = {name: STEPS[name] for name in names}
+
+        scans = XRayScan.objects.exclude(image__isnull=True).exclude(image='')
+        if not options['force']:
+            pending = Q()
+            for step in steps.values():
+                pending |= step.pending
+            scans = scans.filter(pending)
+        scans = scans.order_by('id').only('id', 'image', 'patient_id')
+        limit = options['limit']
+
+        storage = get_storage()
+        force = options['force']
+        workers = options['workers']
+        started = time.perf_counter()
+        processed = failed = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            while limit is None or processed < limit:
+                # Keyset chunks, each read in full before the workers write:
+                # an open SQLite read cursor would block their updates.
+                size = max(workers, 1) * 50
+                if limit is not None:
+                    size = min(size, limit - processed)
+                chunk = list(scans.filter(id__gt=last_id)[:size])
+                if not chunk:
+                    break
+                last_id = chunk[-1].pk
+                if workers > 1:
+                    results = executor.map(lambda scan: self.process_in_worker(scan, steps, storage, force), chunk)
+                else:
+                    results = (self.process(scan, steps, storage, force) for scan in chunk)
+                for scan, error in results:
+                    processed += 1
+                    if error:
+                        failed += 1
+                        self.stderr.write(f'  scan {scan.pk}: {error}')
+                rate = processed / (time.perf_counter() - started)
+                self.stdout.write(f'  {processed} scans, {rate:.1f}/s')
+
+        if processed:
+            # The steps write with update(), which sends no signals.
+            bump_generation()
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(
+            f'Processed {processed} scans ({failed} failed) in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def process(self, scan, steps, storage, force):
+        """Fetch the scan's image once and run every step it needs on it."""
+        try:
+            needed = [
+                step for step in steps.values()
+                if force or XRayScan.objects.filter(step.pending, pk=scan.pk).exists()
+            ]
+            if not needed:
+                return scan, None
+            with tempfile.TemporaryDirectory() as directory:
+                name = os.path.basename(scan.image.public_id)
+                if scan.image.format:
+                    name = f'{name}.{scan.image.format}'
+                path = os.path.join(directory, name)
+                storage.fetch(scan.image, path)
+                for step in needed:
+                    step.run(scan, path, storage)
+            return scan, None
+        except Exception as e:
+            return scan, e
+
+    def process_in_worker(self, scan, steps, storage, force):
+        try:
+            return self.process(scan, steps, storage, force)
+        finally:
+            # Pool threads open their own connections; don't leak them.
+            connections.close_all()
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from scans import uploads
+from scans.models import UploadJob
+
+
+class Command(BaseCommand):
+    help = 'Run scan upload jobs left behind by a restart, or retry failed ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=10,
+                            help='Only pick up pending/running jobs idle for this many minutes')
+        parser.add_argument('--failed', action='store_true',
+                            help='Also retry failed jobs, with a fresh set of attempts')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(minutes=options['older_than'])
+        # Anything younger may still be in flight on a server's worker pool.
+        selected = Q(status__in=[UploadJob.PENDING, UploadJob.RUNNING], updated_at__lt=cutoff)
+        if options['failed']:
+            UploadJob.objects.filter(status=UploadJob.FAILED).update(attempts=0)
+            selected |= Q(status=UploadJob.FAILED)
+        jobs = UploadJob.objects.filter(selected)
+
+        done = failed = 0
+        for job_id in jobs.order_by('id').values_list('id', flat=True):
+            job = uploads.run(job_id)
+            if job is None:
+                continue
+            if job.status == UploadJob.DONE:
+                done += 1
+            else:
+                failed += 1
+            self.stdout.write(f'  job {job.pk} (scan {job.scan_id}): {job.status}')
+
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(style(f'{done} uploads stored, {failed} failed'))
@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
+from scans.images import file_hash
 from scans.models import XRayScan
-from django.core.files import File
+from scans.storage import get_storage
+from scans.uploads import find_stored
 import os
 from faker import Faker
 import random
@@ -22,23 +24,27 @@ class Command(BaseCommand):
             )
             return
             
+        # Every scan gets the same bytes: store them once, or not at all
+        # when an earlier seed already did.
+        content_hash = file_hash(image_path)
+        stored = find_stored(content_hash)
+        image = stored.image if stored else get_storage().save(image_path)
+        renditions = stored.renditions if stored else {}
+
         for i in range(10):
-            # Create a unique file name for each scan
-            file_name = f"xray_{i}.jpg"
-            
-            with open(image_path, 'rb') as f:
-                scan = XRayScan(
-                    patient_id=f"P{i:05}",
-                    body_part=random.choice(['Chest', 'Knee', 'Arm', 'Head', 'Spine']),
-                    scan_date=fake.date_between(start_date="-2y", end_date="today"),
-                    institution=random.choice(['Mayo Clinic', 'Johns Hopkins', 'Stanford', 'Cleveland Clinic', 'UCLA Medical Center']),
-                    description=fake.sentence(),
-                    diagnosis=random.choice(['Pneumonia', 'Fracture', 'Normal', 'Infection', 'Tumor']),
-                    tags=random.sample(tags_pool, random.randint(2, 5))
-                )
-                # Save the image file
-                scan.image.save(file_name, File(f), save=True)
+            scan = XRayScan.objects.create(
+                patient_id=f"P{i:05}",
+                body_part=random.choice(['Chest', 'Knee', 'Arm', 'Head', 'Spine']),
+                scan_date=fake.date_between(start_date="-2y", end_date="today"),
+                institution=random.choice(['Mayo Clinic', 'Johns Hopkins', 'Stanford', 'Cleveland Clinic', 'UCLA Medical Center']),
+                description=fake.sentence(),
+                diagnosis=random.choice(['Pneumonia', 'Fracture', 'Normal', 'Infection', 'Tumor']),
+                tags=random.sample(tags_pool, random.randint(2, 5)),
+                image=image,
+                renditions=renditions,
+                content_hash=content_hash,
+            )
                 
             self.stdout.write(
                 self.style.SUCCESS(f'Successfully created scan {scan.patient_id}')
-            )
\ No newline at end of file
+            )
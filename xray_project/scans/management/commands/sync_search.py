@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from scans import search_sync
+
+
+class Command(BaseCommand):
+    help = 'Flush pending scan changes from the search outbox to Elasticsearch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Outbox rows per bulk request')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain what is due now and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        while True:
+            processed = search_sync.drain(batch_size=batch_size)
+            total += processed
+            if processed:
+                self.stdout.write(f'Flushed {processed} outbox rows')
+            if processed < batch_size:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {total} outbox rows'))
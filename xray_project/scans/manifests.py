@@ -0,0 +1,95 @@
+"""
+Metadata manifests for batch scan uploads (POST /api/scans/batch/).
+
+A manifest is a JSON list of objects or a CSV file with a header row,
+one entry per scan, using the XRayScan field names. Each entry's `image`
+is the file name of one of the images uploaded alongside it. In CSV,
+`tags` may be a JSON list or `;`-separated words.
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+from rest_framework import serializers
+
+from .serializers import XRayScanSerializer
+
+
+def read_manifest(manifest):
+    """Parse an uploaded manifest file or a manifest string into a list of dicts."""
+    name = getattr(manifest, 'name', '') or ''
+    if hasattr(manifest, 'read'):
+        try:
+            manifest = manifest.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise serializers.ValidationError({'manifest': ['Manifest must be UTF-8 text.']})
+
+    if name.lower().endswith('.csv') or not manifest.lstrip().startswith('['):
+        return _read_csv(manifest)
+    try:
+        rows = json.loads(manifest)
+    except json.JSONDecodeError as e:
+        raise serializers.ValidationError({'manifest': [f'Invalid JSON: {e}']})
+    if not all(isinstance(row, dict) for row in rows):
+        raise serializers.ValidationError({'manifest': ['Manifest must be a list of objects.']})
+    return rows
+
+
+def _read_csv(text):
+    rows = []
+    for row in csv.DictReader(io.StringIO(text)):
+        row = {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        tags = row.get('tags', '')
+        if not tags.startswith('['):
+            row['tags'] = json.dumps([tag.strip() for tag in tags.split(';') if tag.strip()])
+        rows.append(row)
+    return rows
+
+
+def validate_items(rows, images, context=None):
+    """
+    Validate every manifest entry against XRayScanSerializer, with its
+    image attached. Returns the validated serializers in manifest order, or
+    raises one ValidationError with the errors of every bad entry, keyed
+    by manifest index.
+    """
+    if not rows:
+        raise serializers.ValidationError({'manifest': ['Manifest has no entries.']})
+    if len(rows) > settings.SCANS_BATCH_MAX_ITEMS:
+        raise serializers.ValidationError(
+            {'manifest': [f'At most {settings.SCANS_BATCH_MAX_ITEMS} scans per batch.']}
+        )
+
+    by_name = {}
+    for image in images:
+        if image.name in by_name:
+            raise serializers.ValidationError({'images': [f'Duplicate file name: {image.name}']})
+        by_name[image.name] = image
+
+    items, errors, used = [], {}, set()
+    for index, row in enumerate(rows):
+        name = row.get('image')
+        if not isinstance(name, str):
+            errors[index] = {'image': ['Must be the file name of an uploaded image.']}
+            continue
+        if name not in by_name:
+            errors[index] = {'image': [f'No uploaded image named {name!r}.']}
+            continue
+        if name in used:
+            errors[index] = {'image': [f'Image {name!r} is used twice.']}
+            continue
+        used.add(name)
+
+        serializer = XRayScanSerializer(data={**row, 'image': by_name[name]}, context=context)
+        if serializer.is_valid():
+            items.append(serializer)
+        else:
+            errors[index] = serializer.errors
+
+    if errors:
+        raise serializers.ValidationError({'items': errors})
+    unused = sorted(set(by_name) - used)
+    if unused:
+        raise serializers.ValidationError({'images': [f'Not in the manifest: {", ".join(unused)}']})
+    return items
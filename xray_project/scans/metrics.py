@@ -0,0 +1,241 @@
+"""
+Counters, gauges and histograms for the scans app.
+
+Values are keyed by metric name plus a sorted tuple of label pairs, so
+`inc('search_requests_total', backend='fallback')` and the same call with
+another backend are tracked separately. `render()` writes everything in
+the Prometheus text exposition format, served at /metrics.
+
+Values are kept per process. With several worker processes, point
+settings.SCANS_METRICS_DIR at a directory they share, emptied whenever
+the service starts (as with prometheus_client's multiprocess mode): each
+process writes its values there at most every FLUSH_INTERVAL seconds and
+`render()` adds up every process's file. Gauges are not added up but get
+a `pid` label. Without the directory, /metrics only shows the process
+that answers the scrape, so run a single worker.
+"""
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+# Seconds; the Prometheus client libraries' defaults.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+# key -> [upper bounds, per-bucket counts (last one +Inf), sum, count]
+_histograms = {}
+_flushed_at = 0.0
+_flush_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += value
+    _flush_if_due()
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+    _flush_if_due()
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """
+    Add `value` to a histogram. `buckets` are the upper bounds, fixed by
+    the first observation of each labelled series.
+    """
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [tuple(buckets), [0] * (len(buckets) + 1), 0.0, 0]
+        histogram[1][bisect.bisect_left(histogram[0], value)] += 1
+        histogram[2] += value
+        histogram[3] += 1
+    _flush_if_due()
+
+
+def get(name, **labels):
+    key = _key(name, labels)
+    with _lock:
+        return _counters.get(key, _gauges.get(key, 0))
+
+
+def total(name, **labels):
+    """Like `get`, over every process when SCANS_METRICS_DIR is set."""
+    key = _key(name, labels)
+    data = collect()
+    return data['counters'].get(key, data['gauges'].get(key, 0))
+
+
+def snapshot():
+    """
+    Copy of this process's metrics as {(name, labels): value}; histogram
+    values are {'buckets': {upper bound: cumulative count}, 'sum': ...,
+    'count': ...}.
+    """
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'histograms': {key: _cumulative(*histogram) for key, histogram in _histograms.items()},
+        }
+
+
+def collect():
+    """Like `snapshot`, summed over every process's file in SCANS_METRICS_DIR."""
+    directory = settings.SCANS_METRICS_DIR
+    if not directory:
+        return snapshot()
+    flush()
+    counters = defaultdict(float)
+    gauges = {}
+    histograms = {}
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            # Removed meanwhile, or not ours.
+            continue
+        pid = os.path.splitext(os.path.basename(path))[0]
+        for name, labels, value in data['counters']:
+            counters[_key(name, dict(labels))] += value
+        for name, labels, value in data['gauges']:
+            gauges[_key(name, {**dict(labels), 'pid': pid})] = value
+        for name, labels, bounds, counts, total_value, count in data['histograms']:
+            key = _key(name, dict(labels))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = [tuple(bounds), counts, total_value, count]
+            elif merged[0] == tuple(bounds):
+                merged[1] = [a + b for a, b in zip(merged[1], counts)]
+                merged[2] += total_value
+                merged[3] += count
+    return {
+        'counters': dict(counters),
+        'gauges': gauges,
+        'histograms': {key: _cumulative(*histogram) for key, histogram in histograms.items()},
+    }
+
+
+def flush():
+    """Write this process's metrics to its file in SCANS_METRICS_DIR."""
+    directory = settings.SCANS_METRICS_DIR
+    if not directory:
+        return
+    with _flush_lock:
+        _write(directory)
+
+
+def _flush_if_due():
+    if not settings.SCANS_METRICS_DIR or time.monotonic() - _flushed_at < FLUSH_INTERVAL:
+        return
+    # A thread already writing makes this write unnecessary; don't wait.
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() - _flushed_at >= FLUSH_INTERVAL:
+            _write(settings.SCANS_METRICS_DIR)
+    except OSError as e:
+        # Metrics must never fail the request or job that records them.
+        logger.warning(f"Can't write metrics to {settings.SCANS_METRICS_DIR}: {e}")
+    finally:
+        _flush_lock.release()
+
+
+def _write(directory):
+    """Called with _flush_lock held, so one file is being written at a time."""
+    global _flushed_at
+    with _lock:
+        data = {
+            'counters': [[name, labels, value] for (name, labels), value in _counters.items()],
+            'gauges': [[name, labels, value] for (name, labels), value in _gauges.items()],
+            'histograms': [
+                [name, labels, histogram[0], list(histogram[1]), histogram[2], histogram[3]]
+                for (name, labels), histogram in _histograms.items()
+            ],
+        }
+        _flushed_at = time.monotonic()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    # Renamed into place, so a scrape never reads half a file.
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+atexit.register(flush)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+
+def render():
+    """Every metric in the Prometheus text exposition format (0.0.4)."""
+    data = collect()
+    series = defaultdict(list)
+    for kind, type_name in (('counters', 'counter'), ('gauges', 'gauge'), ('histograms', 'histogram')):
+        for (name, labels), value in data[kind].items():
+            series[name, type_name].append((labels, value))
+
+    lines = []
+    for (name, type_name), values in sorted(series.items()):
+        lines.append(f'# TYPE {name} {type_name}')
+        for labels, value in sorted(values, key=lambda item: item[0]):
+            if type_name != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+                continue
+            for bound, count in value['buckets'].items():
+                lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {count}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(value["sum"])}')
+            lines.append(f'{name}_count{_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _cumulative(bounds, counts, total, count):
+    running = 0
+    buckets = {}
+    for bound, bucket_count in zip(bounds + (float('inf'),), counts):
+        running += bucket_count
+        buckets[bound] = running
+    return {'buckets': buckets, 'sum': total, 'count': count}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return f'{{{pairs}}}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
@@ -0,0 +1,68 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+
+from . import instrumentation, metrics
+
+logger = logging.getLogger(__name__)
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class RequestMetricsMiddleware:
+    """
+    Per-endpoint request metrics, exposed at /metrics: latency, DB query
+    count and time, Elasticsearch and serializer time, and response size.
+    Endpoints are labelled by URL name (`xrayscan-list`), so the label set
+    stays small whatever the ids and query strings.
+
+    With SCANS_SLOW_REQUEST_MS set, requests slower than that are logged
+    with their SQL and Elasticsearch queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = settings.SCANS_SLOW_REQUEST_MS
+        started = time.perf_counter()
+        with instrumentation.tracking(capture=bool(threshold)) as stats:
+            response = self.get_response(request)
+        # For streaming responses (exports) this is the time to the first byte.
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        endpoint = match.view_name if match else 'unmatched'
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        metrics.observe('http_request_duration_seconds', elapsed, endpoint=endpoint, method=request.method)
+        metrics.observe('http_request_db_queries', stats.db_queries, buckets=COUNT_BUCKETS, endpoint=endpoint)
+        metrics.observe('http_request_db_duration_seconds', stats.db_seconds, endpoint=endpoint)
+        if stats.es_calls:
+            metrics.observe('http_request_es_duration_seconds', stats.es_seconds, endpoint=endpoint)
+        if stats.serializer_seconds:
+            metrics.observe('http_request_serializer_duration_seconds', stats.serializer_seconds, endpoint=endpoint)
+        if not response.streaming:
+            metrics.observe('http_response_size_bytes', len(response.content), buckets=SIZE_BUCKETS, endpoint=endpoint)
+
+        if threshold and elapsed * 1000 >= threshold:
+            metrics.inc('http_slow_requests_total', endpoint=endpoint)
+            self.log_slow(request, response, elapsed, stats)
+        return response
+
+    def log_slow(self, request, response, elapsed, stats):
+        lines = [
+            f"🐢 Slow request: {request.method} {request.get_full_path()} -> {response.status_code} "
+            f"in {elapsed * 1000:.0f}ms (db: {stats.db_queries} queries, {stats.db_seconds * 1000:.0f}ms; "
+            f"es: {stats.es_calls} calls, {stats.es_seconds * 1000:.0f}ms; "
+            f"serializer: {stats.serializer_seconds * 1000:.0f}ms)"
+        ]
+        for kind, statement, seconds in stats.queries:
+            if kind == 'es':
+                statement = json.dumps(statement, default=str)
+            lines.append(f"   [{kind} {seconds * 1000:.1f}ms] {statement}")
+        if stats.db_queries + stats.es_calls > len(stats.queries):
+            lines.append(f"   ... {stats.db_queries + stats.es_calls - len(stats.queries)} more not captured")
+        logger.warning('\n'.join(lines))
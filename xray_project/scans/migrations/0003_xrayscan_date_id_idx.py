@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:46
+
+import cloudinary.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0002_alter_xrayscan_image_alter_xrayscan_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='xrayscan',
+            name='image',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='image'),
+        ),
+        migrations.AddIndex(
+            model_name='xrayscan',
+            index=models.Index(fields=['scan_date', 'id'], name='xrayscan_date_id_idx'),
+        ),
+    ]
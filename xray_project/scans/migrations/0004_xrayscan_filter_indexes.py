@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0003_xrayscan_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='xrayscan',
+            index=models.Index(fields=['body_part', 'scan_date', 'id'], name='xrayscan_body_part_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xrayscan',
+            index=models.Index(fields=['institution', 'scan_date', 'id'], name='xrayscan_institution_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xrayscan',
+            index=models.Index(fields=['diagnosis', 'scan_date', 'id'], name='xrayscan_diagnosis_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xrayscan',
+            index=models.Index(fields=['patient_id', 'scan_date', 'id'], name='xrayscan_patient_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='xrayscan',
+            index=models.Index(fields=['body_part', 'diagnosis', 'institution'], name='xrayscan_facets_idx'),
+        ),
+    ]
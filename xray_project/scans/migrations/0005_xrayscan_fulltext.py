@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def install_fulltext(apps, schema_editor):
+    from scans import fulltext
+    fulltext.install(schema_editor.connection)
+
+
+def uninstall_fulltext(apps, schema_editor):
+    from scans import fulltext
+    fulltext.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0004_xrayscan_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_fulltext, uninstall_fulltext),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0005_xrayscan_fulltext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scan_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('index', 'Index'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['available_at', 'id'], name='outbox_available_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0008_uploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xrayscan',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0010_xrayscan_tiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xrayscan',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0011_xrayscan_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xrayscan',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0012_xrayscan_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='xrayscan',
+            name='has_features',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def install_tag_sync(apps, schema_editor):
+    from scans import tags
+    tags.install(schema_editor.connection, rebuild=True)
+
+
+def uninstall_tag_sync(apps, schema_editor):
+    from scans import tags
+    tags.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0013_xrayscan_has_features'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('scan_count', models.PositiveIntegerField(db_default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-scan_count', 'name'], name='tag_frequency_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScanTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scan_tags', to='scans.xrayscan')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='scan_tags', to='scans.tag')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tag', 'scan'), name='scantag_tag_scan_uniq')],
+            },
+        ),
+        migrations.RunPython(install_tag_sync, uninstall_tag_sync),
+    ]
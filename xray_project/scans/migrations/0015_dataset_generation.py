@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0014_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.BigIntegerField()),
+                ('modified_at', models.FloatField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scans', '0015_dataset_generation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='xrayscan',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 class XRayScan(models.Model):
@@ -10,6 +11,134 @@ class XRayScan(models.Model):
     description = models.TextField()
     diagnosis = models.CharField(max_length=255)
     tags = models.JSONField(default=list)  
+    # Rendition name -> stored image value; see scans.images.RENDITIONS.
+    renditions = models.JSONField(default=dict, blank=True)
+    # DeepZoom pyramid descriptor; see scans.images.build_tiles.
+    tiles = models.JSONField(null=True, blank=True)
+    # SHA-256 of the original image bytes; uploads of known bytes reuse the
+    # stored image instead of transferring it again.
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    # 64-bit dHash as 16 hex digits; see scans.near_duplicates.
+    perceptual_hash = models.CharField(max_length=16, blank=True, default='')
+    # Whether the feature store holds a descriptor; see scans.similarity.
+    has_features = models.BooleanField(default=False)
+    # Row version for detail ETag / Last-Modified headers. Indexed for the
+    # "changed since" reads of near_duplicates.refresh and index_scans.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Backs the default `-scan_date, -id` ordering and keyset pages.
+            models.Index(fields=['scan_date', 'id'], name='xrayscan_date_id_idx'),
+            # One per filterset field, each trailed by the ordering columns so
+            # a filtered page is read in order without a sort step. They also
+            # serve plain equality lookups on their leading column.
+            models.Index(fields=['body_part', 'scan_date', 'id'], name='xrayscan_body_part_date_idx'),
+            models.Index(fields=['institution', 'scan_date', 'id'], name='xrayscan_institution_date_idx'),
+            models.Index(fields=['diagnosis', 'scan_date', 'id'], name='xrayscan_diagnosis_date_idx'),
+            models.Index(fields=['patient_id', 'scan_date', 'id'], name='xrayscan_patient_date_idx'),
+            # Covering index for the facets GROUP BY.
+            models.Index(fields=['body_part', 'diagnosis', 'institution'], name='xrayscan_facets_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patient_id} - {self.body_part}"
+
+
+class Tag(models.Model):
+    """A distinct tag, normalized by `scans.tags.normalize`."""
+    name = models.CharField(max_length=255, unique=True)
+    # Scans with this tag, kept by the triggers in scans.tags.
+    scan_count = models.PositiveIntegerField(db_default=0)
+
+    class Meta:
+        indexes = [
+            # Serves /api/scans/tags/ without a sort step.
+            models.Index(fields=['-scan_count', 'name'], name='tag_frequency_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ScanTag(models.Model):
+    """
+    One tag of one scan: an index over `XRayScan.tags`, written by the
+    triggers in `scans.tags` rather than by the ORM.
+    """
+    # The (tag, scan) constraint's index serves tag -> scans lookups.
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='scan_tags', db_index=False)
+    scan = models.ForeignKey(XRayScan, on_delete=models.CASCADE, related_name='scan_tags')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'scan'], name='scantag_tag_scan_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.tag_id} on scan {self.scan_id}"
+
+
+class SearchOutbox(models.Model):
+    """
+    Pending Elasticsearch writes, recorded in the same transaction as the
+    scan change and flushed in batches by `manage.py sync_search`.
+    """
+    INDEX = 'index'
+    DELETE = 'delete'
+    ACTION_CHOICES = [(INDEX, 'Index'), (DELETE, 'Delete')]
+
+    # Not a foreign key: delete entries must outlive the scan.
+    scan_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='outbox_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} scan {self.scan_id}"
+
+
+class UploadJob(models.Model):
+    """
+    Background transfer of a staged scan image to the image storage
+    backend. Created by XRayScanViewSet.create; run by scans.uploads.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'),
+    ]
+
+    scan = models.ForeignKey(XRayScan, on_delete=models.CASCADE, related_name='upload_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    staged_path = models.CharField(max_length=500)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"upload {self.pk} for scan {self.scan_id}: {self.status}"
+
+
+class DatasetGeneration(models.Model):
+    """
+    The scans' cache generation (see scans.cache): a single row, bumped by
+    every scan write and read once per conditional or cached request. It
+    lives in the database so that every process (gunicorn workers and
+    management commands alike) sees a write as soon as it commits.
+    """
+    generation = models.BigIntegerField()
+    # Unix time of the last bump, for Last-Modified.
+    modified_at = models.FloatField()
+
+    def __str__(self):
+        return f"generation {self.generation}"
@@ -0,0 +1,150 @@
+"""
+Near-duplicate lookup over scan perceptual hashes.
+
+Every stored scan has a 64-bit dHash (`XRayScan.perceptual_hash`, see
+`scans.images.perceptual_hash`); re-exports of the same radiograph at
+another size or quality land within a few bits of each other.
+
+The hashes are held in a process-wide multi-index hash table: each hash
+is split into four 16-bit chunks, and each chunk position has its own
+chunk -> scan ids table. Two hashes within r bits agree to within r // 4
+bits on at least one chunk, so a query probes only the buckets near its
+own chunks and checks the full distance on what it finds there, instead
+of comparing against every scan. (A BK-tree was tried first; on 64-bit
+hashes at radius 10 it visits most of the tree and loses to a plain scan.)
+
+The index is refreshed incrementally: when the dataset generation has
+moved, only rows updated since the last refresh are read, through the
+index on `updated_at`. Deleted scans are dropped when their ids are
+resolved against the DB.
+"""
+import itertools
+import threading
+from datetime import timedelta
+from functools import lru_cache
+
+from django.utils import timezone
+
+from .cache import get_generation
+from .models import XRayScan
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# `updated_at` is stamped when a row is saved, not when its transaction
+# commits, so a slow commit lands behind rows already read. Each refresh
+# reads back this far before the previous one to pick those up.
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+@lru_cache(maxsize=None)
+def flip_masks(radius):
+    """Every CHUNK_BITS-bit mask with at most `radius` bits set."""
+    masks = []
+    for count in range(radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), count):
+            masks.append(sum(1 << bit for bit in bits))
+    return masks
+
+
+class MultiIndexHash:
+    """Hamming-radius search over 64-bit hashes, keyed by item."""
+
+    def __init__(self):
+        self.values = {}  # item -> hash
+        self.tables = [{} for _ in range(CHUNKS)]
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, value, item):
+        if item in self.values:
+            self.remove(item)
+        self.values[item] = value
+        for position, chunk in enumerate(self._chunks(value)):
+            self.tables[position].setdefault(chunk, set()).add(item)
+
+    def remove(self, item):
+        value = self.values.pop(item, None)
+        if value is None:
+            return
+        for position, chunk in enumerate(self._chunks(value)):
+            bucket = self.tables[position][chunk]
+            bucket.discard(item)
+            if not bucket:
+                del self.tables[position][chunk]
+
+    def search(self, value, radius):
+        """[(distance, item)] for every item within `radius` bits of `value`."""
+        masks = flip_masks(radius // CHUNKS)
+        seen = set()
+        found = []
+        for table, chunk in zip(self.tables, self._chunks(value)):
+            for mask in masks:
+                for item in table.get(chunk ^ mask, ()):
+                    if item in seen:
+                        continue
+                    seen.add(item)
+                    distance = hamming(value, self.values[item])
+                    if distance <= radius:
+                        found.append((distance, item))
+        return found
+
+    @staticmethod
+    def _chunks(value):
+        return [(value >> (position * CHUNK_BITS)) & CHUNK_MASK for position in range(CHUNKS)]
+
+
+class NearDuplicateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clear()
+
+    def _clear(self):
+        self._hashes = MultiIndexHash()
+        self._generation = None
+        self._synced_at = None
+
+    def refresh(self):
+        """Bring the index up to date with the DB; cheap when nothing changed."""
+        generation = get_generation()
+        with self._lock:
+            if generation == self._generation:
+                return
+            # Taken before the read; rows read twice are harmless.
+            read_at = timezone.now()
+            rows = XRayScan.objects.exclude(perceptual_hash='')
+            if self._synced_at is not None:
+                rows = rows.filter(updated_at__gte=self._synced_at - REFRESH_OVERLAP)
+            for pk, value in rows.values_list('id', 'perceptual_hash').iterator():
+                self._hashes.add(int(value, 16), pk)
+            self._synced_at = read_at
+            self._generation = generation
+
+    def search(self, value, radius):
+        """[(distance, scan id)] within `radius` bits of `value`, nearest first."""
+        self.refresh()
+        with self._lock:
+            return sorted(self._hashes.search(value, radius))
+
+    def discard(self, pks):
+        """Forget scans found to be deleted."""
+        with self._lock:
+            for pk in pks:
+                self._hashes.remove(pk)
+
+    def reset(self):
+        with self._lock:
+            self._clear()
+
+
+_index = NearDuplicateIndex()
+
+
+def get_index():
+    return _index
@@ -0,0 +1,240 @@
+import json
+from base64 import b64decode, b64encode
+from datetime import date
+from urllib import parse
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class LargeResultsSetPagination(PageNumberPagination):
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class ScanKeysetPagination(BasePagination):
+    """
+    Keyset pagination over (scan_date, id), newest first.
+
+    The cursor holds the (scan_date, id) of the row at the edge of the
+    page, so the next page is a range read on the composite index instead
+    of an OFFSET scan, and rows inserted while a client is walking the
+    list never shift the pages it has not fetched yet. No COUNT(*) is run.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            scan_date, pk, reverse = None, None, False
+        else:
+            scan_date, pk, reverse = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by('scan_date', 'id')
+            if scan_date is not None:
+                queryset = queryset.filter(scan_date__gte=scan_date).filter(
+                    Q(scan_date__gt=scan_date) | Q(id__gt=pk)
+                )
+        else:
+            queryset = queryset.order_by('-scan_date', '-id')
+            if scan_date is not None:
+                queryset = queryset.filter(scan_date__lte=scan_date).filter(
+                    Q(scan_date__lt=scan_date) | Q(id__lt=pk)
+                )
+
+        # Fetch one extra row to find out whether there is a further page.
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = self.cursor is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.cursor is not None
+
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Walked off the end of the list: step back from the old cursor.
+            # The reverse bound is exclusive, so shift it by one id to
+            # include the row the cursor pointed at.
+            scan_date, pk, _ = self.cursor
+            return self._cursor_url(scan_date, pk - 1, reverse=True)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = parse.parse_qs(querystring, keep_blank_values=True)
+            scan_date = date.fromisoformat(tokens['d'][0])
+            pk = int(tokens['i'][0])
+            reverse = bool(int(tokens.get('r', ['0'])[0]))
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return scan_date, pk, reverse
+
+    def encode_cursor(self, row, reverse):
+        return self._cursor_url(_row_value(row, 'scan_date'), _row_value(row, 'id'), reverse)
+
+    def _cursor_url(self, scan_date, pk, reverse):
+        tokens = {'d': scan_date.isoformat(), 'i': pk}
+        if reverse:
+            tokens['r'] = '1'
+        encoded = b64encode(parse.urlencode(tokens).encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class ScanPagination(LargeResultsSetPagination):
+    """
+    Page-number pagination by default; switches to keyset pagination when
+    the request carries a `cursor` parameter (an empty `?cursor=` starts a
+    walk from the newest scan).
+    """
+    keyset_class = ScanKeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.keyset_class.cursor_query_param in request.query_params:
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_previous_link()
+        return super().get_previous_link()
+
+    # Elasticsearch results are paged by the search engine itself: page
+    # numbers become from/size (bounded by ES's max_result_window) and
+    # cursors carry the `search_after` sort values of the last hit.
+    max_search_window = 10000
+
+    def get_search_window(self, request):
+        """Return (size, offset, search_after, count) for a search request."""
+        self.request = request
+        self.search_cursor = self.keyset_class.cursor_query_param in request.query_params
+        size = self.get_page_size(request)
+
+        if self.search_cursor:
+            encoded = request.query_params.get(self.keyset_class.cursor_query_param)
+            search_after = None
+            if encoded:
+                try:
+                    search_after = json.loads(b64decode(encoded.encode('ascii')))
+                except (TypeError, ValueError, UnicodeError):
+                    raise NotFound(self.keyset_class.invalid_cursor_message)
+                if not isinstance(search_after, list):
+                    raise NotFound(self.keyset_class.invalid_cursor_message)
+            return size, 0, search_after, False
+
+        try:
+            self.search_page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            self.search_page_number = 0
+        if self.search_page_number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=self.search_page_number, message=''))
+        offset = (self.search_page_number - 1) * size
+        if offset + size > self.max_search_window:
+            raise NotFound('Page is beyond the search window; use cursor pagination.')
+        return size, offset, None, True
+
+    def get_search_response(self, data, page):
+        url = self.request.build_absolute_uri()
+        if self.search_cursor:
+            next_link = None
+            if page.has_more:
+                encoded = b64encode(json.dumps(page.last_sort).encode('ascii')).decode('ascii')
+                next_link = replace_query_param(url, self.keyset_class.cursor_query_param, encoded)
+            # search_after only walks forward.
+            return Response({
+                'next': next_link,
+                'previous': None,
+                'results': data,
+                'facets': page.facets,
+            })
+
+        number = self.search_page_number
+        next_link = replace_query_param(url, self.page_query_param, number + 1) if page.has_more else None
+        previous_link = None
+        if number == 2:
+            previous_link = remove_query_param(url, self.page_query_param)
+        elif number > 2:
+            previous_link = replace_query_param(url, self.page_query_param, number - 1)
+        return Response({
+            'count': page.total,
+            'next': next_link,
+            'previous': previous_link,
+            'results': data,
+            'facets': page.facets,
+        })
+
+
+def _row_value(row, name):
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
+
@@ -0,0 +1,260 @@
+"""
+Elasticsearch queries for the scans API, guarded by a circuit breaker.
+
+All searches share the client that django_elasticsearch_dsl builds from
+settings.ELASTICSEARCH_DSL (one pooled urllib3 connection pool per node),
+with a short per-request timeout. After repeated failures the breaker opens
+and callers go straight to the database fallback; once `reset_timeout` has
+passed a single request is let through to probe whether ES is back.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from . import instrumentation, metrics, tags
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ['description', 'diagnosis', 'tags', 'body_part', 'institution', 'patient_id']
+# XRayScanFilter fields matched exactly against their keyword sub-fields.
+KEYWORD_FILTERS = ['body_part', 'institution', 'diagnosis', 'patient_id']
+FACET_FIELDS = ['body_part', 'diagnosis', 'institution']
+FACET_SIZE = 100
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._publish()
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """Whether a call may go through now."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                # Exactly one probe; everyone else keeps short-circuiting
+                # until it reports back.
+                self._transition(self.HALF_OPEN)
+                return True
+            metrics.inc('search_breaker_short_circuits_total', breaker=self.name)
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+                if self._state != self.OPEN:
+                    self._transition(self.OPEN)
+
+    def _transition(self, state):
+        logger.warning(f"Circuit breaker {self.name}: {self._state} -> {state}")
+        self._state = state
+        metrics.inc('search_breaker_transitions_total', breaker=self.name, state=state)
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge('search_breaker_state', self.STATE_VALUES[self._state], breaker=self.name)
+
+
+breaker = CircuitBreaker(
+    'elasticsearch',
+    failure_threshold=settings.SCANS_SEARCH_BREAKER_THRESHOLD,
+    reset_timeout=settings.SCANS_SEARCH_BREAKER_RESET,
+)
+
+
+class SearchUnavailable(Exception):
+    """Elasticsearch failed partway through a multi-request walk."""
+
+
+class SearchPage:
+    """One page of Elasticsearch hits: ids in rank order plus paging state."""
+
+    def __init__(self, ids, total, has_more, last_sort, facets=None):
+        self.ids = ids
+        self.total = total
+        self.has_more = has_more
+        self.last_sort = last_sort
+        self.facets = facets
+
+
+def build_search(query, filters=None):
+    """
+    Relevance query for `query`, restricted by the cleaned XRayScanFilter
+    values in `filters`. Filters go in the bool query's filter context, so
+    they narrow hits before ranking and are cached by ES.
+    """
+    from elasticsearch.dsl import Q
+    from .documents import XRayScanDocument
+
+    q = Q('multi_match', query=query, fields=SEARCH_FIELDS, fuzziness='auto')
+    # Ties on relevance fall back to the list order, ending on the unique
+    # id so that search_after positions are unambiguous.
+    search = (
+        XRayScanDocument.search()
+        .query(q)
+        .sort('_score', {'scan_date': 'desc'}, {'id': 'desc'})
+        .source(False)
+    )
+
+    filters = filters or {}
+    for field in KEYWORD_FILTERS:
+        if filters.get(field):
+            search = search.filter('term', **{f'{field}.raw': filters[field]})
+    date_range = filters.get('scan_date')
+    if date_range and (date_range.start or date_range.stop):
+        bounds = {}
+        if date_range.start:
+            bounds['gte'] = date_range.start.date().isoformat()
+        if date_range.stop:
+            bounds['lte'] = date_range.stop.date().isoformat()
+        search = search.filter('range', scan_date=bounds)
+    tag_names = tags.normalize_all(filters.get('tag') or [])
+    if tag_names and filters.get('tag_mode') == tags.ANY:
+        search = search.filter('terms', tag_names=tag_names)
+    else:
+        for name in tag_names:
+            search = search.filter('term', tag_names=name)
+    return search
+
+
+def add_facet_aggregations(search):
+    for field in FACET_FIELDS:
+        search.aggs.bucket(field, 'terms', field=f'{field}.raw', size=FACET_SIZE)
+    return search
+
+
+def read_facets(response):
+    """Aggregation buckets in the shape of the /facets/ endpoint."""
+    return {
+        field: [
+            {'value': bucket.key, 'count': bucket.doc_count}
+            for bucket in getattr(response.aggregations, field).buckets
+        ]
+        for field in FACET_FIELDS
+    }
+
+
+def execute(search):
+    """
+    Build and run a search through the breaker; `search` is a callable
+    returning the Search. None when ES is unavailable.
+    """
+    if not breaker.allow():
+        metrics.inc('search_requests_total', backend='fallback', reason='breaker_open')
+        return None
+
+    started = time.perf_counter()
+    built = None
+    try:
+        built = search()
+        response = built.execute()
+    except Exception as e:
+        breaker.record_failure()
+        metrics.inc('search_requests_total', backend='fallback', reason='error')
+        logger.warning(f"⚠️ Elasticsearch search failed: {e}")
+        return None
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('search_request_duration_seconds', elapsed)
+        instrumentation.record_es(elapsed, built)
+
+    breaker.record_success()
+    metrics.inc('search_requests_total', backend='elasticsearch')
+    return response
+
+
+def search_page(query, size, offset=0, search_after=None, count=True, filters=None, facets=True):
+    """
+    One page of hits for `query`, either `offset` hits in (page-number
+    mode, limited by the index's max_result_window) or after the sort
+    values of a previous page's last hit (cursor mode, unbounded depth).
+    The exact total is only tracked when `count` is set. With `facets`,
+    facet counts over all filtered hits come back in the same request.
+    """
+    def search():
+        s = build_search(query, filters).extra(size=size + 1, track_total_hits=count)
+        if facets:
+            s = add_facet_aggregations(s)
+        if search_after is not None:
+            return s.extra(search_after=search_after)
+        return s.extra(from_=offset)
+
+    response = execute(search)
+    if response is None:
+        return None
+
+    hits = list(response.hits)
+    has_more = len(hits) > size
+    hits = hits[:size]
+    total = response.hits.total.value if count else None
+    return SearchPage(
+        ids=[int(hit.meta.id) for hit in hits],
+        total=total,
+        has_more=has_more,
+        last_sort=list(hits[-1].meta.sort) if hits else None,
+        facets=read_facets(response) if facets else None,
+    )
+
+
+def search_id_pages(query, size, filters=None):
+    """
+    Every hit for `query` in rank order, as lists of up to `size` ids,
+    walked with search_after as in the list's cursor mode. None when ES is
+    unavailable; a failure after the first page raises SearchUnavailable,
+    so a caller never mistakes part of the hits for all of them.
+    """
+    page = search_page(query, size, count=False, filters=filters, facets=False)
+    if page is None:
+        return None
+
+    def pages(page):
+        while True:
+            yield page.ids
+            if not page.has_more:
+                return
+            last_sort = page.last_sort
+            page = search_page(query, size, search_after=last_sort, count=False, filters=filters, facets=False)
+            if page is None:
+                raise SearchUnavailable(f'Elasticsearch failed after the hit sorted at {last_sort}')
+
+    return pages(page)
+
+
+def search_scan_ids(query, limit=None):
+    """
+    Ids of the best `limit` matches for `query`, best first, or None when
+    Elasticsearch is unavailable and the caller should use the database
+    fallback. Used where a whole result set is filtered in SQL.
+    """
+    limit = limit or settings.SCANS_SEARCH_ID_LIMIT
+    response = execute(lambda: build_search(query).extra(size=limit))
+    if response is None:
+        return None
+    return [int(hit.meta.id) for hit in response.hits]
@@ -0,0 +1,124 @@
+"""
+Incremental Elasticsearch sync through the SearchOutbox table.
+
+Scan writes enqueue an outbox row in their own transaction (see
+signals.py); `drain` turns a batch of rows into one bulk request. Several
+rows for the same scan collapse into a single action, and failed scans
+are retried later with exponential backoff.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .cache import bump_generation
+from .models import SearchOutbox, XRayScan
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+# How long past the bulk request timeout claimed rows stay claimed.
+CLAIM_MARGIN = timedelta(seconds=60)
+
+
+def enqueue(scan_ids, action):
+    """Record pending index/delete actions for `scan_ids`."""
+    SearchOutbox.objects.bulk_create(
+        [SearchOutbox(scan_id=scan_id, action=action) for scan_id in scan_ids]
+    )
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE_SECONDS * 2 ** attempts, BACKOFF_MAX_SECONDS))
+
+
+def building_indexes(client, alias):
+    """
+    Versioned indexes an `index_scans` rebuild is still filling, by the
+    incomplete checkpoint in their _meta. Outbox writes go to these as well
+    as to the alias, so changes made mid-rebuild survive the alias swap.
+    """
+    mappings = client.indices.get_mapping(index=f'{alias}_v*')
+    return [name for name in mappings if mappings[name]['mappings'].get('_meta', {}).get('complete') is False]
+
+
+def drain(batch_size=500, client=None):
+    """
+    Flush up to `batch_size` due outbox rows to Elasticsearch.
+
+    Returns the number of outbox rows processed. Raises nothing for ES
+    failures: the affected rows are rescheduled instead.
+
+    No transaction is open during the bulk request: on SQLite a long one
+    would block every scan write. The rows are claimed first by moving
+    their `available_at` past the request timeout, so other drainers skip
+    them, and a drainer that dies mid-request leaves them to be retried.
+    """
+    from elasticsearch.helpers import bulk
+    from .documents import XRayScanDocument, scan_source
+
+    client = client or XRayScanDocument._get_connection().options(
+        request_timeout=settings.SCANS_INDEXING_TIMEOUT
+    )
+    alias = XRayScanDocument._index._name
+
+    with transaction.atomic():
+        pending = SearchOutbox.objects.filter(available_at__lte=timezone.now()).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Lets several drainers share the table without double work.
+            pending = pending.select_for_update(skip_locked=True)
+        entries = list(pending[:batch_size])
+        if not entries:
+            return 0
+        lease = timedelta(seconds=settings.SCANS_INDEXING_TIMEOUT) + CLAIM_MARGIN
+        SearchOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).update(
+            available_at=timezone.now() + lease
+        )
+
+    # Rows are in id order, so the last action seen for a scan wins.
+    latest = {entry.scan_id: entry.action for entry in entries}
+    failed = set()
+    try:
+        scans = XRayScan.objects.in_bulk(
+            [scan_id for scan_id, action in latest.items() if action == SearchOutbox.INDEX]
+        )
+        sources = {scan_id: scan_source(scan) for scan_id, scan in scans.items()}
+        # Looked up after the rows were claimed: a rebuild that read a
+        # scan before this change was synced is already listed here.
+        indexes = [alias, *building_indexes(client, alias)]
+        actions = [
+            {'_op_type': 'delete', '_index': index, '_id': scan_id} if scan_id not in sources
+            else {'_index': index, '_id': scan_id, '_source': sources[scan_id]}
+            for index in indexes for scan_id in latest
+        ]
+        _, errors = bulk(client, actions, raise_on_error=False, raise_on_exception=False)
+    except Exception as e:
+        logger.warning(f"Search sync failed for {len(entries)} outbox rows: {e}")
+        failed = set(latest)
+    else:
+        for error in errors:
+            op, result = next(iter(error.items()))
+            # Deleting a document that was never indexed is not a failure.
+            if op == 'delete' and result.get('status') == 404:
+                continue
+            failed.add(int(result['_id']))
+        if failed:
+            logger.warning(f"Search sync failed for scans {sorted(failed)}")
+
+    with transaction.atomic():
+        done = [entry.pk for entry in entries if entry.scan_id not in failed]
+        SearchOutbox.objects.filter(pk__in=done).delete()
+        if len(failed) < len(latest):
+            # Search results just changed: retire cached pages and ETags.
+            bump_generation()
+
+        now = timezone.now()
+        retry = [entry for entry in entries if entry.scan_id in failed]
+        for attempts in {entry.attempts for entry in retry}:
+            SearchOutbox.objects.filter(
+                pk__in=[entry.pk for entry in retry if entry.attempts == attempts]
+            ).update(attempts=attempts + 1, available_at=now + backoff(attempts))
+    return len(entries)
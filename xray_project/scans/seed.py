@@ -1,11 +1,12 @@
+from .images import file_hash
 from .models import XRayScan
+from .synthetic import BODY_PARTS, DIAGNOSIS_MAP, INSTITUTIONS, TAG_MAP, TAGS_POOL
 import os
 from faker import Faker
 import random
 import cloudinary.uploader
 import datetime
 import cloudinary
-import os
 
 
 cloudinary.config(
@@ -16,7 +17,6 @@ cloudinary.config(
 
 def run():
     fake = Faker()
-    tags_pool = ['lung', 'infection', 'fracture', 'opacity', 'fluid', 'pneumonia', 'normal', 'consolidation']
     
     sample_images_dir = 'sample_xray_images'
     
@@ -37,55 +37,36 @@ def run():
     XRayScan.objects.all().delete()
     print(" Cleared existing scan data")
 
+    # content hash -> uploaded URL, so each sample file is uploaded once
+    uploaded = {}
+
     for i in range(min(len(image_files) * 2, 15)):
         selected_image = random.choice(image_files)
         image_path = os.path.join(sample_images_dir, selected_image)
         
-        body_parts = ['Chest', 'Knee', 'Arm', 'Hand', 'Spine', 'Hip', 'Shoulder']
-        selected_body_part = random.choice(body_parts)
-        
-        diagnosis_map = {
-            'Chest': ['Pneumonia', 'Normal', 'Pleural Effusion', 'Tuberculosis', 'Lung Nodule'],
-            'Knee': ['Normal', 'Arthritis', 'Fracture', 'Torn Meniscus'],
-            'Arm': ['Fracture', 'Normal', 'Dislocation'],
-            'Hand': ['Fracture', 'Normal', 'Arthritis'],
-            'Spine': ['Normal', 'Disc Herniation', 'Scoliosis', 'Fracture'],
-            'Hip': ['Normal', 'Hip Dysplasia', 'Fracture', 'Arthritis'],
-            'Shoulder': ['Normal', 'Dislocation', 'Rotator Cuff Tear', 'Fracture']
-        }
-
-        selected_diagnosis = random.choice(diagnosis_map.get(selected_body_part, ['Normal']))
-
-        tag_map = {
-            'Pneumonia': ['lung', 'infection', 'opacity', 'consolidation'],
-            'Fracture': ['fracture', 'bone', 'break'],
-            'Normal': ['normal', 'clear'],
-            'Pleural Effusion': ['fluid', 'lung', 'pleural'],
-            'Arthritis': ['joint', 'arthritis', 'inflammation']
-        }
+        selected_body_part = random.choice(BODY_PARTS)
+        selected_diagnosis = random.choice(DIAGNOSIS_MAP.get(selected_body_part, ['Normal']))
 
-        relevant_tags = tag_map.get(selected_diagnosis, tags_pool)
+        relevant_tags = TAG_MAP.get(selected_diagnosis, TAGS_POOL)
         selected_tags = random.sample(relevant_tags, min(3, len(relevant_tags)))
 
         try:
-            upload_result = cloudinary.uploader.upload(image_path)
-            cloudinary_url = upload_result.get("secure_url")
+            content_hash = file_hash(image_path)
+            cloudinary_url = uploaded.get(content_hash)
+            if cloudinary_url is None:
+                upload_result = cloudinary.uploader.upload(image_path)
+                cloudinary_url = uploaded[content_hash] = upload_result.get("secure_url")
             
             scan = XRayScan(
                 patient_id=f"P{i+1:05d}",
                 body_part=selected_body_part,
                 scan_date=fake.date_between(start_date="-2y", end_date="today"),
-                institution=random.choice([
-                    'Mayo Clinic', 
-                    'Johns Hopkins', 
-                    'Stanford Medical', 
-                    'Cleveland Clinic',
-                    'Mass General Hospital'
-                ]),
+                institution=random.choice(INSTITUTIONS),
                 description=fake.sentence(nb_words=10),
                 diagnosis=selected_diagnosis,
                 tags=selected_tags,
-                image=cloudinary_url
+                image=cloudinary_url,
+                content_hash=content_hash
             )
             scan.save()
             print(f" Created scan {i+1}: {scan.patient_id} - {selected_body_part} - {selected_diagnosis}")
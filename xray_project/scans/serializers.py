@@ -1,7 +1,65 @@
+from functools import lru_cache
+from django.conf import settings
+from django.db.models import TextField
+from django.db.models.functions import Cast
 from rest_framework import serializers
-from .models import XRayScan
+from .images import RENDITIONS
+from .instrumentation import timing_serializer
+from .models import UploadJob, XRayScan
+from .storage import get_storage
 import json
-import cloudinary.utils
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=settings.SCANS_IMAGE_URL_CACHE_SIZE)
+def stored_image_url(raw, backend):
+    """
+    Delivery URL for a raw stored image value, built by the image storage
+    `backend` (a SCANS_IMAGE_STORAGE path). URLs depend only on these and
+    static configuration, so they are memoized. When no URL can be built
+    the public id is returned, and memoized too: the failure is logged once
+    per value, not once per row.
+    """
+    resource = XRayScan._meta.get_field('image').parse_cloudinary_resource(raw)
+    try:
+        return get_storage(backend).url(resource)
+    except Exception as e:
+        logger.warning(f"Error generating image URL for {resource.public_id}: {e}")
+        return resource.public_id
+
+
+def image_url_for(value):
+    """
+    URL for a stored image value, raw or as read from the model, through
+    the configured image storage; the raw value if none can be built.
+    """
+    if not value:
+        return None
+    raw = XRayScan._meta.get_field('image').get_prep_value(value)
+    return stored_image_url(raw, settings.SCANS_IMAGE_STORAGE)
+
+
+def rendition_urls(renditions):
+    """`<name>_url` for every rendition; None where it is not generated yet."""
+    urls = {}
+    for name in RENDITIONS:
+        raw = (renditions or {}).get(name)
+        urls[f'{name}_url'] = image_url_for(raw)
+    return urls
+
+
+def parse_tags(tags):
+    if isinstance(tags, str):
+        try:
+            return json.loads(tags)
+        except json.JSONDecodeError:
+            return []
+    if tags is None:
+        return []
+    return tags
+
 
 class XRayScanSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
@@ -9,34 +67,31 @@ class XRayScanSerializer(serializers.ModelSerializer):
     class Meta:
         model = XRayScan
         fields = '__all__'
+        read_only_fields = ['renditions', 'tiles', 'content_hash', 'perceptual_hash', 'has_features']
 
     def get_image_url(self, obj):
-        """Get the proper Cloudinary URL"""
-        if obj.image:
-            try:
-                # Use Cloudinary's built-in URL generation
-                url = cloudinary.utils.cloudinary_url(str(obj.image))[0]
-                print(f"🔗 Generated Cloudinary URL for {obj.patient_id}: {url}")
-                return url
-            except Exception as e:
-                print(f"❌ Error generating Cloudinary URL for {obj.patient_id}: {e}")
-                return str(obj.image)
-        return None
+        """Delivery URL from the image storage backend"""
+        return image_url_for(obj.image)
 
     def to_representation(self, instance):
+        with timing_serializer():
+            return self._to_representation(instance)
+
+    def _to_representation(self, instance):
         representation = super().to_representation(instance)
         
         # Handle tags field
-        if isinstance(representation.get('tags'), str):
-            try:
-                representation['tags'] = json.loads(representation['tags'])
-            except json.JSONDecodeError:
-                representation['tags'] = []
-        elif representation.get('tags') is None:
-            representation['tags'] = []
+        representation['tags'] = parse_tags(representation.get('tags'))
         
-        # Use the proper image URL
-        representation['image'] = self.get_image_url(instance)
+        # Use the proper image URL, already built for `image_url`
+        representation['image'] = representation['image_url']
+
+        # Derivative URLs instead of the stored rendition values; the tile
+        # pyramid is described by /api/scans/<id>/tiles/
+        representation.pop('renditions', None)
+        representation.pop('tiles', None)
+        representation.pop('has_features', None)
+        representation.update(rendition_urls(instance.renditions))
         
         return representation
 
@@ -71,4 +126,93 @@ class XRayScanSerializer(serializers.ModelSerializer):
             if hasattr(value, 'size') and value.size > 10 * 1024 * 1024:
                 raise serializers.ValidationError("Image file size must be less than 10MB.")
         
-        return value
\ No newline at end of file
+        return value
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadJob
+        fields = ['id', 'scan', 'status', 'attempts', 'error', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
+class XRayScanListSerializer:
+    """
+    Read-only list rows built straight from `.values()` dicts, without
+    ModelSerializer field machinery. Output matches XRayScanSerializer for
+    the same fields. `fields` selects a sparse fieldset.
+    """
+    field_names = [
+        'id', 'image_url', 'patient_id', 'image', 'body_part', 'scan_date',
+        'institution', 'description', 'diagnosis', 'tags', 'content_hash',
+        'perceptual_hash', 'updated_at',
+    ] + [f'{name}_url' for name in RENDITIONS]
+    # Output fields read from a column of another name.
+    source_columns = {
+        'image_url': 'image',
+        **{f'{name}_url': 'renditions' for name in RENDITIONS},
+    }
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, fields=None):
+        fields = fields or self.field_names
+        unknown = [name for name in fields if name not in self.field_names]
+        if unknown:
+            raise serializers.ValidationError({'fields': [f"Unknown field: {name}" for name in unknown]})
+        self.fields = [name for name in self.field_names if name in fields]
+
+    @classmethod
+    def from_query_params(cls, query_params):
+        requested = query_params.get('fields')
+        if not requested:
+            return cls()
+        return cls([name.strip() for name in requested.split(',') if name.strip()])
+
+    @property
+    def columns(self):
+        """DB columns to select: the requested fields plus the pagination keys."""
+        columns = ['id', 'scan_date']
+        for name in self.fields:
+            column = self.source_columns.get(name, name)
+            if column not in columns:
+                columns.append(column)
+        return columns
+
+    def rows(self, queryset):
+        """
+        `.values()` rows for `queryset`. The image column is read as plain
+        text so CloudinaryField does not build a resource object per row;
+        `stored_image_url` builds each distinct URL once instead.
+        """
+        columns = self.columns
+        if 'image' not in columns:
+            return queryset.values(*columns)
+        columns.remove('image')
+        return queryset.values(*columns, image_raw=Cast('image', TextField()))
+
+    def to_representation(self, row):
+        data = {}
+        image_url = None
+        if 'image' in self.fields or 'image_url' in self.fields:
+            image_url = image_url_for(row['image_raw'])
+        renditions = None
+        if 'renditions' in row:
+            renditions = rendition_urls(row['renditions'])
+        for name in self.fields:
+            if name in ('image', 'image_url'):
+                data[name] = image_url
+            elif self.source_columns.get(name) == 'renditions':
+                data[name] = renditions[name]
+            elif name == 'scan_date':
+                data[name] = row['scan_date'].isoformat()
+            elif name == 'tags':
+                data[name] = parse_tags(row['tags'])
+            elif name == 'updated_at':
+                data[name] = self.datetime_field.to_representation(row['updated_at'])
+            else:
+                data[name] = row[name]
+        return data
+
+    def serialize(self, rows):
+        with timing_serializer():
+            return [self.to_representation(row) for row in rows]
@@ -0,0 +1,47 @@
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import fulltext, images, search_sync, similarity, tags
+from .cache import bump_generation
+from .models import SearchOutbox, XRayScan
+
+
+@receiver(post_save, sender=XRayScan)
+@receiver(post_delete, sender=XRayScan)
+def invalidate_scan_caches(sender, **kwargs):
+    bump_generation()
+
+
+@receiver(post_save, sender=XRayScan)
+def enqueue_search_index(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_sync.enqueue([instance.pk], SearchOutbox.INDEX)
+
+
+@receiver(post_delete, sender=XRayScan)
+def enqueue_search_delete(sender, instance, **kwargs):
+    search_sync.enqueue([instance.pk], SearchOutbox.DELETE)
+
+
+@receiver(post_delete, sender=XRayScan)
+def remove_scan_tiles(sender, instance, **kwargs):
+    scan_id = instance.pk
+    transaction.on_commit(lambda: images.remove_tiles(scan_id))
+
+
+@receiver(post_delete, sender=XRayScan)
+def clear_scan_features(sender, instance, **kwargs):
+    scan_id = instance.pk
+    if instance.has_features:
+        transaction.on_commit(lambda: similarity.get_store().write(scan_id, None))
+
+
+def ensure_fulltext(sender, using, **kwargs):
+    # Migrations that rebuild the scans table on SQLite drop its triggers.
+    fulltext.install(connections[using])
+
+
+def ensure_tag_sync(sender, using, **kwargs):
+    # Dropped with the table's other triggers, as above.
+    tags.install(connections[using])
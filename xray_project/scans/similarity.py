@@ -0,0 +1,166 @@
+"""
+"Looks like this one" search over scan feature vectors.
+
+Each stored scan gets a DIM-long float32 descriptor (see
+`scans.images.describe`), normalised to unit length so a dot product is
+the cosine similarity. Descriptors live in one flat file under
+SCANS_FEATURES_DIR, row `pk` for scan `pk`: rows are written in place with
+`pwrite`, which never truncates, so upload workers and `process_images`
+in any process can write concurrently, and queries read the file through
+a read-only memory map. All-zero rows are scans without a descriptor.
+
+Queries are one vectorised matrix-vector product plus a partial sort.
+Past a few hundred thousand scans, `manage.py build_similarity_index`
+trains an IVF coarse index: k-means centroids plus each row's nearest
+centroid (its list) in a parallel int32 file. A query then scores only
+the rows in its SCANS_SIMILARITY_NPROBE closest lists. Rows written after
+the build are assigned to a list as they are written.
+"""
+import os
+
+import numpy as np
+from django.conf import settings
+
+DIM = 96
+ROW_BYTES = DIM * 4
+UNASSIGNED = -1
+
+
+class FeatureStore:
+    def __init__(self, directory=None):
+        self.directory = directory or settings.SCANS_FEATURES_DIR
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.lists_path = os.path.join(self.directory, 'lists.i32')
+        self.centroids_path = os.path.join(self.directory, 'centroids.npy')
+
+    def write(self, pk, vector):
+        """Store `vector` as scan `pk`'s descriptor; None clears it."""
+        os.makedirs(self.directory, exist_ok=True)
+        if vector is None:
+            vector, assignment = np.zeros(DIM, dtype=np.float32), UNASSIGNED
+        else:
+            vector = np.asarray(vector, dtype=np.float32)
+            centroids = self.centroids()
+            assignment = UNASSIGNED if centroids is None else int(np.argmax(centroids @ vector))
+        _pwrite(self.vectors_path, vector.tobytes(), pk * ROW_BYTES)
+        if assignment != UNASSIGNED or os.path.exists(self.lists_path):
+            _pwrite(self.lists_path, np.int32(assignment).tobytes(), pk * 4)
+
+    def read(self, pk):
+        """Scan `pk`'s descriptor, or None."""
+        matrix = self.matrix()
+        if pk >= len(matrix) or not matrix[pk].any():
+            return None
+        return np.array(matrix[pk])
+
+    def matrix(self):
+        rows = _size(self.vectors_path) // ROW_BYTES
+        if not rows:
+            return np.zeros((0, DIM), dtype=np.float32)
+        return np.memmap(self.vectors_path, dtype=np.float32, mode='r', shape=(rows, DIM))
+
+    def lists(self, rows):
+        """List of each of the first `rows` rows; UNASSIGNED past the file's end."""
+        stored = _size(self.lists_path) // 4
+        if stored >= rows and rows:
+            return np.memmap(self.lists_path, dtype=np.int32, mode='r', shape=(stored,))[:rows]
+        lists = np.full(rows, UNASSIGNED, dtype=np.int32)
+        if stored:
+            lists[:stored] = np.memmap(self.lists_path, dtype=np.int32, mode='r', shape=(stored,))
+        return lists
+
+    def centroids(self):
+        if not os.path.exists(self.centroids_path):
+            return None
+        return np.load(self.centroids_path)
+
+    def search(self, vector, k, exact=False, nprobe=None):
+        """
+        [(pk, cosine similarity)] for the `k` best rows, best first. Uses
+        the IVF index when one has been built, unless `exact`.
+        """
+        matrix = self.matrix()
+        centroids = None if exact else self.centroids()
+        if centroids is None:
+            candidates = None
+            scores = matrix @ vector
+        else:
+            nprobe = min(nprobe or settings.SCANS_SIMILARITY_NPROBE, len(centroids))
+            probes = np.argpartition(centroids @ vector, -nprobe)[-nprobe:]
+            # One spare slot, so UNASSIGNED (-1) rows look up False.
+            probed = np.zeros(len(centroids) + 1, dtype=bool)
+            probed[probes] = True
+            candidates = np.flatnonzero(probed[self.lists(len(matrix))])
+            scores = matrix[candidates] @ vector
+        k = min(k, len(scores))
+        if not k:
+            return []
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        pks = top if candidates is None else candidates[top]
+        return [(int(pk), float(score)) for pk, score in zip(pks, scores[top])]
+
+    def build_index(self, lists, iterations=10, sample=100_000, seed=0, chunk_size=100_000):
+        """
+        Train `lists` centroids with spherical k-means on a sample of the
+        stored descriptors, then assign every row. Returns the number of
+        rows indexed.
+        """
+        matrix = self.matrix()
+        present = np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            start + np.flatnonzero(matrix[start:start + chunk_size].any(axis=1))
+            for start in range(0, len(matrix), chunk_size)
+        ])
+        if not len(present):
+            return 0
+        rng = np.random.default_rng(seed)
+        training = np.array(matrix[np.sort(rng.choice(present, min(sample, len(present)), replace=False))])
+        lists = min(lists, len(training))
+        centroids = training[rng.choice(len(training), lists, replace=False)]
+        for _ in range(iterations):
+            nearest = np.argmax(training @ centroids.T, axis=1)
+            for list_id in range(lists):
+                members = training[nearest == list_id]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[list_id] = centroid / (np.linalg.norm(centroid) or 1)
+
+        assignments = np.full(len(matrix), UNASSIGNED, dtype=np.int32)
+        for start in range(0, len(matrix), chunk_size):
+            chunk = matrix[start:start + chunk_size]
+            nearest = np.argmax(chunk @ centroids.T, axis=1).astype(np.int32)
+            nearest[~chunk.any(axis=1)] = UNASSIGNED
+            assignments[start:start + chunk_size] = nearest
+
+        # Each file is swapped in whole, so queries never read half of one.
+        os.makedirs(self.directory, exist_ok=True)
+        _replace(self.lists_path, assignments.tobytes())
+        with open(f'{self.centroids_path}.tmp', 'wb') as out:
+            np.save(out, centroids.astype(np.float32))
+        os.replace(f'{self.centroids_path}.tmp', self.centroids_path)
+        return len(present)
+
+
+def _pwrite(path, data, offset):
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(descriptor, data, offset)
+    finally:
+        os.close(descriptor)
+
+
+def _replace(path, data):
+    with open(f'{path}.tmp', 'wb') as out:
+        out.write(data)
+    os.replace(f'{path}.tmp', path)
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def get_store():
+    return FeatureStore()
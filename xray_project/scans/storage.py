@@ -0,0 +1,73 @@
+"""
+Pluggable destinations for scan images.
+
+A storage backend has three methods: `save(path)` stores the local file
+at `path` and returns the value to keep in `XRayScan.image`,
+`fetch(resource, path)` copies a stored image (a CloudinaryResource, as
+read from the model) back to a local file, and `url(resource)` returns
+its delivery URL. The backend in use is named by
+`settings.SCANS_IMAGE_STORAGE`.
+"""
+import os
+import shutil
+from urllib.request import urlopen
+
+import cloudinary.uploader
+import cloudinary.utils
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .models import XRayScan
+
+
+class CloudinaryImageStorage:
+    """Uploads to Cloudinary with the same options as the model field."""
+
+    def save(self, path):
+        field = XRayScan._meta.get_field('image')
+        options = {'type': field.type, 'resource_type': field.resource_type}
+        options.update(field.options)
+        resource = cloudinary.uploader.upload_resource(path, **options)
+        return resource.get_prep_value()
+
+    def fetch(self, resource, path):
+        with urlopen(resource.build_url(), timeout=60) as response, open(path, 'wb') as local:
+            shutil.copyfileobj(response, local)
+
+    def url(self, resource):
+        return cloudinary.utils.cloudinary_url(resource.public_id)[0]
+
+
+class LocalImageStorage:
+    """
+    Filesystem stand-in for Cloudinary: copies images under MEDIA_ROOT,
+    delivered from MEDIA_URL. For tests and offline development; set
+    MEDIA_URL to an absolute URL when the frontend has another origin.
+    """
+    folder = 'scans'
+
+    def __init__(self, root=None):
+        self.root = root or settings.MEDIA_ROOT
+
+    def save(self, path):
+        os.makedirs(os.path.join(self.root, self.folder), exist_ok=True)
+        name = os.path.basename(path)
+        shutil.copyfile(path, os.path.join(self.root, self.folder, name))
+        return f'{self.folder}/{name}'
+
+    def fetch(self, resource, path):
+        shutil.copyfile(os.path.join(self.root, self.name(resource)), path)
+
+    def url(self, resource):
+        return settings.MEDIA_URL + self.name(resource)
+
+    def name(self, resource):
+        """Path under the root of a value returned by `save`."""
+        if resource.format:
+            return f'{resource.public_id}.{resource.format}'
+        return resource.public_id
+
+
+def get_storage(backend=None):
+    """An instance of `backend`, by default settings.SCANS_IMAGE_STORAGE."""
+    return import_string(backend or settings.SCANS_IMAGE_STORAGE)()
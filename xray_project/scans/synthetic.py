@@ -0,0 +1,142 @@
+"""
+Synthetic scans for production-size local datasets.
+
+Rows follow the body part -> diagnosis -> tags correlations that
+`scans.seed` uses for its demo data. Faker text is drawn from pools
+generated once, since Faker itself costs tens of microseconds per value,
+and rows go in with bulk_create, one transaction per batch. Images point
+at a handful of sample files stored once, with their renditions and
+hashes, through LocalImageStorage unless another storage is passed;
+files already stored by an earlier run are reused. The benchmark
+commands load their datasets through `generate` as well.
+"""
+import os
+import random
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from faker import Faker
+
+from . import images, uploads
+from .cache import bump_generation
+from .models import XRayScan
+from .storage import LocalImageStorage
+
+BODY_PARTS = ['Chest', 'Knee', 'Arm', 'Hand', 'Spine', 'Hip', 'Shoulder']
+
+DIAGNOSIS_MAP = {
+    'Chest': ['Pneumonia', 'Normal', 'Pleural Effusion', 'Tuberculosis', 'Lung Nodule'],
+    'Knee': ['Normal', 'Arthritis', 'Fracture', 'Torn Meniscus'],
+    'Arm': ['Fracture', 'Normal', 'Dislocation'],
+    'Hand': ['Fracture', 'Normal', 'Arthritis'],
+    'Spine': ['Normal', 'Disc Herniation', 'Scoliosis', 'Fracture'],
+    'Hip': ['Normal', 'Hip Dysplasia', 'Fracture', 'Arthritis'],
+    'Shoulder': ['Normal', 'Dislocation', 'Rotator Cuff Tear', 'Fracture']
+}
+
+TAG_MAP = {
+    'Pneumonia': ['lung', 'infection', 'opacity', 'consolidation'],
+    'Fracture': ['fracture', 'bone', 'break'],
+    'Normal': ['normal', 'clear'],
+    'Pleural Effusion': ['fluid', 'lung', 'pleural'],
+    'Arthritis': ['joint', 'arthritis', 'inflammation']
+}
+
+TAGS_POOL = ['lung', 'infection', 'fracture', 'opacity', 'fluid', 'pneumonia', 'normal', 'consolidation']
+
+INSTITUTIONS = ['Mayo Clinic', 'Johns Hopkins', 'Stanford Medical', 'Cleveland Clinic', 'Mass General Hospital']
+
+SAMPLE_IMAGES_DIR = os.path.join(settings.BASE_DIR, 'sample_xray_images')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def store_sample_images(directory=SAMPLE_IMAGES_DIR, storage=None):
+    """
+    Store every image in `directory` once, with its renditions and hashes,
+    unless a scan already has the same bytes stored. Returns {body part:
+    [field values]}, matching files to body parts by name prefix
+    (`knee1.jpg` -> 'Knee'); '' lists every image.
+    """
+    storage = storage or LocalImageStorage()
+    by_part = {'': []}
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(directory, name)
+        content_hash = images.file_hash(path)
+        stored = uploads.find_stored(content_hash)
+        if stored is not None:
+            values = {
+                'image': stored.image,
+                'renditions': stored.renditions,
+                'content_hash': content_hash,
+                'perceptual_hash': stored.perceptual_hash,
+            }
+        else:
+            values = {
+                'image': storage.save(path),
+                'renditions': images.store_renditions(path, storage),
+                'content_hash': content_hash,
+                'perceptual_hash': images.perceptual_hash(path),
+            }
+        by_part[''].append(values)
+        for part in BODY_PARTS:
+            if name.lower().startswith(part.lower()):
+                by_part.setdefault(part, []).append(values)
+    return by_part
+
+
+class ScanFactory:
+    """Builds unsaved XRayScans; `seed` makes the sequence reproducible."""
+
+    def __init__(self, seed=0, sample_images=None, pool_size=5000, patients=100_000):
+        self.rng = random.Random(seed)
+        fake = Faker()
+        fake.seed_instance(seed)
+        self.descriptions = [fake.sentence(nb_words=10) for _ in range(pool_size)]
+        self.sample_images = sample_images or {}
+        self.patients = patients
+        self.first_date = date.today() - timedelta(days=730)
+
+    def build(self):
+        rng = self.rng
+        body_part = rng.choice(BODY_PARTS)
+        diagnosis = rng.choice(DIAGNOSIS_MAP.get(body_part, ['Normal']))
+        relevant_tags = TAG_MAP.get(diagnosis, TAGS_POOL)
+        scan = XRayScan(
+            patient_id=f'P{rng.randrange(self.patients):07d}',
+            body_part=body_part,
+            scan_date=self.first_date + timedelta(days=rng.randrange(731)),
+            institution=rng.choice(INSTITUTIONS),
+            description=rng.choice(self.descriptions),
+            diagnosis=diagnosis,
+            tags=rng.sample(relevant_tags, min(3, len(relevant_tags))),
+        )
+        candidates = self.sample_images.get(body_part) or self.sample_images.get('')
+        if candidates:
+            for field, value in rng.choice(candidates).items():
+                setattr(scan, field, value)
+        return scan
+
+
+def generate(count, batch_size=10_000, seed=0, sample_images=None, progress=None):
+    """
+    Insert `count` synthetic scans in batches of `batch_size`; `progress`
+    is called with the running total after each batch. Returns the count.
+    """
+    # About four scans per patient, as in a real archive.
+    factory = ScanFactory(seed, sample_images, patients=max(1, count // 4))
+    created = 0
+    while created < count:
+        size = min(batch_size, count - created)
+        batch = [factory.build() for _ in range(size)]
+        with transaction.atomic():
+            XRayScan.objects.bulk_create(batch)
+        created += size
+        if progress:
+            progress(created)
+    if created:
+        # bulk_create sends no signals.
+        bump_generation()
+    return created
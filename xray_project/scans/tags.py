@@ -0,0 +1,221 @@
+"""
+Indexed tag storage: `XRayScan.tags` normalized into Tag / ScanTag rows.
+
+The JSON list on the scan stays the source of truth. On SQLite, triggers
+on the scans table rewrite a scan's ScanTag rows whenever its tags are
+inserted, updated or deleted, so bulk_create, queryset.update() and raw
+SQL writes are covered as well as model saves (as for `scans.fulltext`).
+
+Tag filters resolve through the (tag, scan) unique index, planned from
+per-tag scan counts that further triggers keep on Tag (see
+`filter_scans`). Names are matched exactly after normalization, so "lung"
+does not match "lung nodule". Without the triggers, filters fall back to
+JSON containment.
+"""
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Exists, OuterRef, Q
+
+from .models import ScanTag, Tag, XRayScan
+
+TRIGGER_PREFIX = 'scans_scantag_sync'
+COUNT_TRIGGER_PREFIX = 'scans_tag_count'
+ALL = 'all'
+ANY = 'any'
+MODE_CHOICES = [(ALL, 'All'), (ANY, 'Any')]
+
+_available = {}
+
+
+def normalize(name):
+    """
+    The form tags are indexed and matched in, as the triggers compute it:
+    SQLite's trim() strips spaces only and its lower() is ASCII-only.
+    """
+    return ''.join(char.lower() if char.isascii() else char for char in name.strip(' '))
+
+
+def normalize_all(names):
+    """
+    Distinct normalized names. Each value is one tag, commas included, as
+    the triggers store it; `?tag=a,b` is split by the filter beforehand.
+    """
+    normalized = {normalize(name) for name in names if isinstance(name, str)}
+    normalized.discard('')
+    return sorted(normalized)
+
+
+def _insert_statements(row, source=''):
+    """
+    SQL indexing the tags of `row` (a scans table row alias), read from
+    `source` tables; anything but a JSON array of strings indexes nothing.
+    """
+    tags = Tag._meta.db_table
+    scan_tags = ScanTag._meta.db_table
+    items = (
+        f"{source}json_each(CASE WHEN json_valid({row}.tags) AND json_type({row}.tags) = 'array' "
+        f"THEN {row}.tags ELSE '[]' END) AS item"
+    )
+    name = "lower(trim(item.value))"
+    return [
+        f"INSERT OR IGNORE INTO {tags}(name) "
+        f"SELECT DISTINCT {name} FROM {items} WHERE item.type = 'text' AND {name} != ''",
+        f"INSERT OR IGNORE INTO {scan_tags}(tag_id, scan_id) "
+        f"SELECT {tags}.id, {row}.id FROM {items} JOIN {tags} ON {tags}.name = {name} WHERE item.type = 'text'",
+    ]
+
+
+def _statements():
+    scans = XRayScan._meta.db_table
+    tags = Tag._meta.db_table
+    scan_tags = ScanTag._meta.db_table
+    insert_new = ';\n'.join(_insert_statements('new'))
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_ai AFTER INSERT ON {scans} BEGIN
+            {insert_new};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_ad AFTER DELETE ON {scans} BEGIN
+            DELETE FROM {scan_tags} WHERE scan_id = old.id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {TRIGGER_PREFIX}_au AFTER UPDATE OF tags ON {scans} BEGIN
+            DELETE FROM {scan_tags} WHERE scan_id = old.id;
+            {insert_new};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {COUNT_TRIGGER_PREFIX}_ai AFTER INSERT ON {scan_tags} BEGIN
+            UPDATE {tags} SET scan_count = scan_count + 1 WHERE id = new.tag_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {COUNT_TRIGGER_PREFIX}_ad AFTER DELETE ON {scan_tags} BEGIN
+            UPDATE {tags} SET scan_count = scan_count - 1 WHERE id = old.tag_id;
+        END
+        """,
+    ]
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [name])
+    return cursor.fetchone() is not None
+
+
+def install(conn=None, rebuild=False):
+    """
+    Create the sync triggers if they are missing; with `rebuild`, also
+    re-derive every ScanTag row from the scans' JSON tags.
+
+    Safe to call repeatedly; runs after every migrate, since SQLite drops
+    triggers when a migration rebuilds the scans table. Returns False when
+    the database is not SQLite or the tag tables are not migrated yet.
+    """
+    conn = conn or connection
+    _available.pop(conn.alias, None)
+    if conn.vendor != 'sqlite':
+        return False
+
+    with conn.cursor() as cursor:
+        if not _table_exists(cursor, ScanTag._meta.db_table):
+            return False
+        for sql in _statements():
+            cursor.execute(sql)
+        if rebuild:
+            scans, tags, scan_tags = XRayScan._meta.db_table, Tag._meta.db_table, ScanTag._meta.db_table
+            cursor.execute(f'DELETE FROM {scan_tags}')
+            for sql in _insert_statements(scans, source=f'{scans}, '):
+                cursor.execute(sql)
+            # Counts may have drifted while the triggers were missing.
+            cursor.execute(
+                f'UPDATE {tags} SET scan_count = '
+                f'(SELECT COUNT(*) FROM {scan_tags} WHERE {scan_tags}.tag_id = {tags}.id)'
+            )
+    return True
+
+
+def uninstall(conn=None):
+    conn = conn or connection
+    _available.pop(conn.alias, None)
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for suffix in ('ai', 'ad', 'au'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {TRIGGER_PREFIX}_{suffix}')
+        for suffix in ('ai', 'ad'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {COUNT_TRIGGER_PREFIX}_{suffix}')
+
+
+def is_available(conn=None):
+    conn = conn or connection
+    if conn.vendor != 'sqlite':
+        return False
+    if conn.alias not in _available:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = %s", [f'{TRIGGER_PREFIX}_ai']
+            )
+            _available[conn.alias] = cursor.fetchone() is not None
+    return _available[conn.alias]
+
+
+def filter_scans(queryset, names, mode=ALL):
+    """
+    Restrict `queryset` to scans tagged with all (or any) of `names`.
+
+    Tag counts pick the plan. When the candidate scans are few (the rarest
+    tag for `all`, every tag together for `any`), they are fetched by
+    primary key from the (tag, scan) index and sorted: at most
+    SCANS_TAG_SORT_LIMIT rows. Otherwise the scans are read in list order
+    through their usual index, each probed against the (tag, scan) index,
+    so a page stops as soon as it is full; a common tag matches early.
+    """
+    names = normalize_all(names)
+    if not names:
+        return queryset
+    if not is_available():
+        # Exact list elements, as stored.
+        conditions = [Q(tags__contains=[name]) for name in names]
+        return queryset.filter(reduce(operator.and_ if mode == ALL else operator.or_, conditions))
+
+    counts = dict(Tag.objects.filter(name__in=names, scan_count__gt=0).values_list('id', 'scan_count'))
+    if not counts or mode == ALL and len(counts) < len(names):
+        return queryset.none()
+
+    if mode == ANY:
+        tagged = ScanTag.objects.filter(tag_id__in=counts)
+        if sum(counts.values()) <= settings.SCANS_TAG_SORT_LIMIT:
+            return queryset.filter(id__in=tagged.values('scan_id'))
+        return queryset.filter(Exists(tagged.filter(scan_id=OuterRef('pk'))))
+
+    rarest, *others = sorted(counts, key=counts.get)
+    if counts[rarest] <= settings.SCANS_TAG_SORT_LIMIT:
+        queryset = queryset.filter(id__in=ScanTag.objects.filter(tag_id=rarest).values('scan_id'))
+    else:
+        others.insert(0, rarest)
+    for tag_id in others:
+        queryset = queryset.filter(Exists(ScanTag.objects.filter(tag_id=tag_id, scan_id=OuterRef('pk'))))
+    return queryset
+
+
+def frequencies(queryset=None, limit=100):
+    """
+    [{'value': tag, 'count': scans}] for the most used tags, most used
+    first, over `queryset` or every scan. Unfiltered, these are the
+    trigger-kept counts, read in order from their index.
+    """
+    if queryset is None or not queryset.query.has_filters():
+        rows = Tag.objects.filter(scan_count__gt=0).order_by('-scan_count', 'name')[:limit]
+        return [{'value': tag.name, 'count': tag.scan_count} for tag in rows]
+    rows = (
+        ScanTag.objects.filter(scan__in=queryset.order_by().values('id'))
+        .values('tag__name').annotate(count=Count('scan_id'))
+        .order_by('-count', 'tag__name')[:limit]
+    )
+    return [{'value': row['tag__name'], 'count': row['count']} for row in rows]
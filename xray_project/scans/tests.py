@@ -1,3 +1,1525 @@
-from django.test import TestCase
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
+import numpy as np
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageDraw
+from rest_framework.test import APIClient
 
+from . import (
+    fulltext, images, instrumentation, metrics, near_duplicates, search, search_sync, similarity, synthetic, tags,
+    uploads,
+)
+from .bench import StubCluster, insert_synthetic_scans
+from .cache import get_generation
+from .images import RENDITIONS
+from .management.commands import index_scans as index_scans_command
+from .models import ScanTag, SearchOutbox, Tag, UploadJob, XRayScan
+from .serializers import XRayScanListSerializer, XRayScanSerializer, stored_image_url
+from .storage import LocalImageStorage
+
+
+def make_scan(**overrides):
+    values = {
+        'patient_id': 'P00001',
+        'body_part': 'Chest',
+        'scan_date': datetime.date(2024, 1, 1),
+        'institution': 'Mayo Clinic',
+        'description': 'Routine chest radiograph',
+        'diagnosis': 'Normal',
+        'tags': ['normal', 'clear'],
+    }
+    values.update(overrides)
+    return XRayScan.objects.create(**values)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        start = datetime.date(2024, 1, 1)
+        # Two scans per day so that ties on scan_date are broken by id.
+        for i in range(10):
+            make_scan(patient_id=f'P{i:05d}', scan_date=start + datetime.timedelta(days=i // 2))
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_walks_every_row_newest_first(self):
+        expected = list(
+            XRayScan.objects.order_by('-scan_date', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(self.walk('/api/scans/?cursor=&page_size=3'), expected)
+
+    def test_pages_are_stable_under_inserts(self):
+        first = self.client.get('/api/scans/?cursor=&page_size=4').data
+        # A newer scan arriving mid-walk must not shift later pages.
+        make_scan(patient_id='P99999', scan_date=datetime.date(2030, 1, 1))
+        rest = self.walk(first['next'])
+        seen = [row['id'] for row in first['results']] + rest
+        self.assertEqual(len(seen), 10)
+        self.assertEqual(len(set(seen)), 10)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/scans/?cursor=&page_size=3').data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(
+            [row['id'] for row in back['results']],
+            [row['id'] for row in first['results']],
+        )
+
+    def test_invalid_cursor_is_404(self):
+        response = self.client.get('/api/scans/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_mode_is_unchanged(self):
+        response = self.client.get('/api/scans/')
+        self.assertEqual(response.data['count'], 10)
+
+
+class FacetsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        make_scan(body_part='Chest', diagnosis='Pneumonia', institution='Mayo Clinic')
+        make_scan(body_part='Chest', diagnosis='Normal', institution='Johns Hopkins')
+        make_scan(body_part='Knee', diagnosis='Fracture', institution='Mayo Clinic')
+
+    def test_counts_per_facet_from_one_query(self):
+        # The dataset generation, then the facets.
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/scans/facets/').data
+        self.assertEqual(data['body_part'], [
+            {'value': 'Chest', 'count': 2},
+            {'value': 'Knee', 'count': 1},
+        ])
+        self.assertEqual(data['institution'][0], {'value': 'Mayo Clinic', 'count': 2})
+
+    def test_respects_filters(self):
+        data = self.client.get('/api/scans/facets/?institution=Mayo Clinic').data
+        self.assertEqual(
+            {row['value'] for row in data['diagnosis']}, {'Pneumonia', 'Fracture'}
+        )
+
+    def test_cached_until_a_scan_is_written(self):
+        self.client.get('/api/scans/facets/')
+        # Only the dataset generation is read.
+        with self.assertNumQueries(1):
+            self.client.get('/api/scans/facets/')
+        make_scan(body_part='Hip')
+        data = self.client.get('/api/scans/facets/').data
+        self.assertIn('Hip', [row['value'] for row in data['body_part']])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against SQLite')
+class QueryPlanTests(TestCase):
+    """
+    Runs EXPLAIN QUERY PLAN on every query the viewset issues for the
+    filter, ordering and pagination combinations it supports, and fails if
+    SQLite falls back to a full table scan or a temporary sort.
+
+    Text search is not covered here: `icontains` cannot use a B-tree index.
+    """
+    table = XRayScan._meta.db_table
+    urls = [
+        '/api/scans/',
+        '/api/scans/?page=2&page_size=2',
+        '/api/scans/?cursor=',
+        '/api/scans/?body_part=Chest',
+        '/api/scans/?institution=Mayo Clinic',
+        '/api/scans/?diagnosis=Normal',
+        '/api/scans/?patient_id=P00001',
+        '/api/scans/?body_part=Chest&institution=Mayo Clinic',
+        '/api/scans/?body_part=Chest&diagnosis=Normal',
+        '/api/scans/?institution=Mayo Clinic&diagnosis=Normal',
+        '/api/scans/?body_part=Chest&institution=Mayo Clinic&diagnosis=Normal',
+        '/api/scans/?body_part=Chest&cursor=',
+        '/api/scans/?scan_date_after=2024-01-02&scan_date_before=2024-01-04',
+        '/api/scans/?body_part=Chest&scan_date_after=2024-01-02',
+        '/api/scans/facets/',
+        '/api/scans/facets/?body_part=Chest',
+    ]
+
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(5):
+            make_scan(patient_id=f'P{i:05d}', scan_date=datetime.date(2024, 1, 1 + i))
+        self.scan = XRayScan.objects.first()
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_indexed(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+
+        statements = [q['sql'] for q in ctx.captured_queries if self.table in q['sql']]
+        self.assertTrue(statements, url)
+        for sql in statements:
+            plan = self.plan(sql)
+            for step in plan:
+                self.assertNotRegex(
+                    step, rf'^SCAN {self.table}$', f'table scan for {url}: {sql}\n{plan}'
+                )
+                self.assertNotIn(
+                    'USE TEMP B-TREE', step, f'sort step for {url}: {sql}\n{plan}'
+                )
+
+    def test_list_queries_use_indexes(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assert_indexed(url)
+
+    @override_settings(SCANS_TAG_SORT_LIMIT=0)
+    def test_common_tag_filters_use_indexes(self):
+        # Tags on at most SCANS_TAG_SORT_LIMIT scans (here, all of them
+        # without the override) are fetched by key and sorted instead.
+        for url in [
+            '/api/scans/?tag=normal',
+            '/api/scans/?tag=normal&tag=clear&cursor=',
+            '/api/scans/?tag=normal,clear&tag_mode=any&body_part=Chest',
+        ]:
+            with self.subTest(url=url):
+                self.assert_indexed(url)
+
+    def test_keyset_page_uses_index(self):
+        first = self.client.get('/api/scans/?cursor=&page_size=2').data
+        self.assert_indexed(first['next'])
+
+    def test_detail_uses_primary_key(self):
+        self.assert_indexed(f'/api/scans/{self.scan.pk}/')
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        if not fulltext.is_available():
+            self.skipTest('SQLite FTS5 is not available')
+        self.client = APIClient()
+        self.nodule = make_scan(description='Small nodule in the left lung', diagnosis='Lung Nodule')
+        self.pneumonia = make_scan(
+            description='Patchy consolidation', diagnosis='Pneumonia', tags=['lung', 'infection']
+        )
+        self.knee = make_scan(body_part='Knee', description='Joint space narrowing', diagnosis='Arthritis')
+        # Enough non-matching rows for BM25's IDF term to be meaningful.
+        for _ in range(5):
+            make_scan(body_part='Hand', description='No acute findings')
+
+    def search(self, text):
+        return [row['id'] for row in self.client.get('/api/scans/', {'search': text}).data['results']]
+
+    def test_ranks_matches_with_bm25(self):
+        # "lung" is in the diagnosis and description of one scan but only
+        # a tag of the other.
+        self.assertEqual(self.search('lung'), [self.nodule.id, self.pneumonia.id])
+
+    def test_matches_word_prefixes_and_requires_every_word(self):
+        self.assertEqual(self.search('pneum'), [self.pneumonia.id])
+        self.assertEqual(self.search('lung infection'), [self.pneumonia.id])
+
+    def test_index_follows_updates_deletes_and_bulk_writes(self):
+        XRayScan.objects.filter(pk=self.knee.pk).update(diagnosis='Fracture')
+        self.assertEqual(self.search('fracture'), [self.knee.id])
+        self.knee.delete()
+        self.assertEqual(self.search('fracture'), [])
+        XRayScan.objects.bulk_create([XRayScan(
+            patient_id='P00009', body_part='Hip', scan_date=datetime.date(2024, 2, 1),
+            institution='Stanford Medical', description='', diagnosis='Hip Dysplasia', tags=[],
+        )])
+        self.assertEqual(len(self.search('dysplasia')), 1)
+
+    def test_punctuation_only_query_falls_back_to_icontains(self):
+        self.assertEqual(self.search('%'), [])
+
+
+class SearchOutboxTests(TestCase):
+    def test_writes_are_recorded_in_the_outbox(self):
+        scan = make_scan()
+        scan.diagnosis = 'Pneumonia'
+        scan.save()
+        scan_id = scan.pk
+        scan.delete()
+        self.assertEqual(
+            list(SearchOutbox.objects.order_by('id').values_list('scan_id', 'action')),
+            [(scan_id, 'index'), (scan_id, 'index'), (scan_id, 'delete')],
+        )
+
+    def test_drain_coalesces_rows_into_one_bulk_request(self):
+        kept = make_scan()
+        kept.save()
+        gone = make_scan()
+        gone_id = gone.pk
+        gone.delete()
+
+        with mock.patch('elasticsearch.helpers.bulk', return_value=(2, [])) as bulk:
+            self.assertEqual(search_sync.drain(client=StubCluster()), 4)
+
+        actions = list(bulk.call_args.args[1])
+        self.assertEqual(len(actions), 2)
+        self.assertEqual(actions[0]['_id'], kept.pk)
+        self.assertEqual(actions[0]['_source']['patient_id'], kept.patient_id)
+        self.assertEqual(actions[1], {'_op_type': 'delete', '_index': 'xray_scans', '_id': gone_id})
+        self.assertFalse(SearchOutbox.objects.exists())
+
+    def test_bulk_request_runs_outside_a_transaction_on_claimed_rows(self):
+        make_scan()
+        depth = len(connection.savepoint_ids)
+        seen = {}
+
+        def bulk(client, actions, **kwargs):
+            seen['depth'] = len(connection.savepoint_ids)
+            # Claimed: another drainer finds nothing due.
+            seen['due'] = SearchOutbox.objects.filter(available_at__lte=timezone.now()).count()
+            return len(actions), []
+
+        with mock.patch('elasticsearch.helpers.bulk', bulk):
+            self.assertEqual(search_sync.drain(client=StubCluster()), 1)
+        self.assertEqual(seen, {'depth': depth, 'due': 0})
+        self.assertFalse(SearchOutbox.objects.exists())
+
+    def test_failed_rows_are_retried_with_backoff(self):
+        scan = make_scan()
+        with mock.patch('elasticsearch.helpers.bulk', side_effect=ConnectionError('down')):
+            search_sync.drain(client=StubCluster())
+
+        entry = SearchOutbox.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreater(entry.available_at, entry.created_at)
+        with mock.patch('elasticsearch.helpers.bulk') as bulk:
+            self.assertEqual(search_sync.drain(client=StubCluster()), 0)
+        bulk.assert_not_called()
+        self.assertEqual(entry.scan_id, scan.pk)
+
+
+class IndexRebuildTests(TestCase):
+    def setUp(self):
+        self.cluster = StubCluster()
+        self.scans = [make_scan(patient_id=f'P{i:05d}') for i in range(5)]
+
+    def rebuild(self, version, **options):
+        output = StringIO()
+        with self.cluster.installed(), mock.patch.object(index_scans_command, 'datetime') as clock:
+            clock.now.return_value = datetime.datetime(2024, 1, 1, 0, 0, version)
+            call_command('index_scans', checkpoint_every=2, stdout=output, **options)
+        return output.getvalue()
+
+    def test_builds_a_version_and_swaps_the_alias(self):
+        self.rebuild(1)
+        self.assertEqual(self.cluster.aliases['xray_scans'], {'xray_scans_v20240101000001'})
+        self.assertEqual(self.cluster.source('xray_scans', self.scans[4].pk)['patient_id'], 'P00004')
+        self.assertEqual(self.cluster.meta['xray_scans_v20240101000001'], {
+            'last_indexed_id': self.scans[-1].pk, 'complete': True,
+        })
+
+        self.rebuild(2)
+        self.assertEqual(self.cluster.aliases['xray_scans'], {'xray_scans_v20240101000002'})
+        self.assertNotIn('xray_scans_v20240101000001', self.cluster.documents)
+
+    def test_resume_continues_from_the_checkpoint(self):
+        calls = []
+
+        def interrupt():
+            calls.append(1)
+            # The second segment's bulk request, after the first segment and its catch-up.
+            if len(calls) == 3:
+                raise RuntimeError('bulk request rejected')
+
+        self.rebuild(1)
+        self.cluster.on_bulk = interrupt
+        output = self.rebuild(2)
+        self.assertIn('Error indexing scans: bulk request rejected', output)
+        self.assertEqual(self.cluster.aliases['xray_scans'], {'xray_scans_v20240101000001'})
+        self.assertEqual(self.cluster.meta['xray_scans_v20240101000002'], {
+            'last_indexed_id': self.scans[1].pk, 'complete': False,
+        })
+
+        output = self.rebuild(3, resume=True)
+        self.assertIn(f'Resuming xray_scans_v20240101000002 after scan id {self.scans[1].pk}', output)
+        self.assertIn('Successfully indexed 3 scans', output)
+        self.assertEqual(self.cluster.aliases['xray_scans'], {'xray_scans_v20240101000002'})
+        self.assertEqual(len(self.cluster.documents['xray_scans_v20240101000002']), 5)
+
+    def test_changes_made_mid_rebuild_reach_the_new_index(self):
+        first, second, third, fourth = self.scans[:4]
+        fourth_id = fourth.pk
+        calls = []
+
+        def change_scans():
+            calls.append(1)
+            if len(calls) != 2:
+                return
+            # First segment indexed and caught up; the second was read but
+            # not sent yet.
+            for scan in (first, third):
+                scan.diagnosis = 'Fracture'
+                scan.save()
+            fourth.delete()
+            search_sync.drain(client=self.cluster)
+
+        self.rebuild(1)
+        self.cluster.on_bulk = change_scans
+        self.rebuild(2)
+
+        self.assertEqual(self.cluster.aliases['xray_scans'], {'xray_scans_v20240101000002'})
+        self.assertEqual(self.cluster.source('xray_scans', first.pk)['diagnosis'], 'Fracture')
+        self.assertEqual(self.cluster.source('xray_scans', third.pk)['diagnosis'], 'Fracture')
+        self.assertIsNone(self.cluster.source('xray_scans', fourth_id))
+        self.assertEqual(self.cluster.source('xray_scans', second.pk)['diagnosis'], 'Normal')
+
+    def test_resume_refuses_a_finished_kept_index(self):
+        self.rebuild(1)
+        self.rebuild(2, keep_old=True)
+        self.assertIn('xray_scans_v20240101000001', self.cluster.documents)
+        with self.assertRaisesMessage(CommandError, 'No interrupted rebuild to resume.'):
+            self.rebuild(3, resume=True)
+        self.assertEqual(self.cluster.aliases['xray_scans'], {'xray_scans_v20240101000002'})
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = search.CircuitBreaker(
+            'test', failure_threshold=2, reset_timeout=10, clock=lambda: self.now
+        )
+
+    def test_opens_after_repeated_failures_and_probes_after_timeout(self):
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        # Only one probe while half-open.
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertEqual(metrics.get('search_breaker_state', breaker='test'), 0)
+
+    def test_failed_probe_reopens(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10
+        self.breaker.allow()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_open_breaker_skips_elasticsearch(self):
+        make_scan(diagnosis='Pneumonia')
+        with mock.patch.object(search.breaker, 'allow', return_value=False), \
+                mock.patch('scans.documents.XRayScanDocument.search') as es_search:
+            response = APIClient().get('/api/scans/', {'search': 'pneumonia'})
+        es_search.assert_not_called()
+        self.assertEqual(response.data['count'], 1)
+
+
+class FakeHits(list):
+    def __init__(self, hits, total):
+        super().__init__(hits)
+        self.total = SimpleNamespace(value=total)
+
+
+class ElasticsearchPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.scans = [make_scan(patient_id=f'P{i:05d}') for i in range(5)]
+        self.ranked = [self.scans[i].pk for i in (3, 0, 4, 1, 2)]
+        self.searches = []
+
+    def fake_execute(self, build):
+        body = build().to_dict()
+        self.searches.append(body)
+        start = body.get('from', 0)
+        if 'search_after' in body:
+            start = self.ranked.index(body['search_after'][-1]) + 1
+        hits = [
+            SimpleNamespace(meta=SimpleNamespace(id=str(pk), sort=[1.0, '2024-01-01', pk]))
+            for pk in self.ranked[start:start + body['size']]
+        ]
+        buckets = SimpleNamespace(buckets=[SimpleNamespace(key='Chest', doc_count=len(self.ranked))])
+        aggregations = SimpleNamespace(body_part=buckets, diagnosis=buckets, institution=buckets)
+        return SimpleNamespace(hits=FakeHits(hits, len(self.ranked)), aggregations=aggregations)
+
+    def get(self, url, **params):
+        with mock.patch.object(search, 'execute', self.fake_execute):
+            return self.client.get(url, params)
+
+    @override_settings(SCANS_EXPORT_CHUNK_SIZE=2, SCANS_SEARCH_ID_LIMIT=2)
+    def test_search_export_walks_every_hit(self):
+        response = self.get('/api/scans/export/', search='chest')
+        with mock.patch.object(search, 'execute', self.fake_execute):
+            lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], self.ranked)
+        self.assertEqual(len(self.searches), 3)
+        self.assertEqual(self.searches[1]['search_after'][-1], self.ranked[1])
+        self.assertNotIn('aggs', self.searches[0])
+
+    @override_settings(SCANS_EXPORT_CHUNK_SIZE=2)
+    def test_search_export_failing_midway_is_cut_off(self):
+        def fail_after_first_page(build):
+            return self.fake_execute(build) if not self.searches else None
+
+        with mock.patch.object(search, 'execute', fail_after_first_page):
+            response = self.client.get('/api/scans/export/', {'search': 'chest'})
+            with self.assertRaises(search.SearchUnavailable):
+                b''.join(response.streaming_content)
+
+    def test_page_comes_from_es_in_rank_order_with_es_count(self):
+        # The dataset generation, then the page's rows.
+        with self.assertNumQueries(2):
+            data = self.get('/api/scans/', search='chest', page_size=2).data
+        self.assertEqual([row['id'] for row in data['results']], self.ranked[:2])
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(self.searches[0]['size'], 3)
+        self.assertTrue(self.searches[0]['track_total_hits'])
+
+        data = self.get(data['next']).data
+        self.assertEqual([row['id'] for row in data['results']], self.ranked[2:4])
+        self.assertEqual(self.searches[1]['from'], 2)
+        self.assertIsNotNone(data['previous'])
+
+    def test_cursor_mode_uses_search_after(self):
+        url, seen = '/api/scans/?search=chest&page_size=2&cursor=', []
+        while url:
+            data = self.get(url).data
+            seen.extend(row['id'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(seen, self.ranked)
+        self.assertIn('search_after', self.searches[-1])
+        self.assertFalse(self.searches[-1]['track_total_hits'])
+
+    def test_filters_and_facets_are_part_of_the_es_request(self):
+        data = self.get(
+            '/api/scans/', search='chest', body_part='Chest',
+            scan_date_after='2024-01-01', scan_date_before='2024-06-30',
+        ).data
+        body = self.searches[0]
+        self.assertEqual(body['query']['bool']['filter'], [
+            {'term': {'body_part.raw': 'Chest'}},
+            {'range': {'scan_date': {'gte': '2024-01-01', 'lte': '2024-06-30'}}},
+        ])
+        self.assertEqual(body['aggs']['diagnosis'], {'terms': {'field': 'diagnosis.raw', 'size': 100}})
+        self.assertEqual(data['facets']['body_part'], [{'value': 'Chest', 'count': 5}])
+
+    def test_tag_filters_use_normalized_keywords(self):
+        self.get('/api/scans/', search='chest', tag=['Lung', 'fracture'])
+        self.get('/api/scans/', search='chest', tag='lung,fracture', tag_mode='any')
+        self.assertEqual(self.searches[0]['query']['bool']['filter'], [
+            {'term': {'tag_names': 'fracture'}}, {'term': {'tag_names': 'lung'}},
+        ])
+        self.assertEqual(self.searches[1]['query']['bool']['filter'], [
+            {'terms': {'tag_names': ['fracture', 'lung']}},
+        ])
+
+    def test_invalid_filter_is_rejected_before_querying_es(self):
+        response = self.get('/api/scans/', search='chest', scan_date_after='yesterday')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.searches, [])
+
+    def test_pages_beyond_the_search_window_are_rejected(self):
+        response = self.get('/api/scans/', search='chest', page=11, page_size=1000)
+        self.assertEqual(response.status_code, 404)
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    def indexed(self, scan):
+        return sorted(ScanTag.objects.filter(scan=scan).values_list('tag__name', flat=True))
+
+    def test_index_follows_every_kind_of_write(self):
+        scan = make_scan(tags=['Lung', ' lung nodule', 'lung'])
+        self.assertEqual(self.indexed(scan), ['lung', 'lung nodule'])
+
+        scan.tags = ['fracture']
+        scan.save()
+        self.assertEqual(self.indexed(scan), ['fracture'])
+
+        XRayScan.objects.filter(pk=scan.pk).update(tags=['bone', 'break'])
+        self.assertEqual(self.indexed(scan), ['bone', 'break'])
+
+        [bulk] = XRayScan.objects.bulk_create([XRayScan(
+            patient_id='P00002', body_part='Knee', scan_date=datetime.date(2024, 1, 1),
+            institution='Mayo Clinic', description='', diagnosis='Normal', tags=['normal', 3],
+        )])
+        self.assertEqual(self.indexed(bulk.pk), ['normal'])
+
+        scan.delete()
+        self.assertFalse(ScanTag.objects.filter(scan_id=scan.pk).exists())
+
+    def test_rebuild_backfills_the_index(self):
+        scan = make_scan(tags=['lung', 'opacity'])
+        ScanTag.objects.all().delete()
+        tags.install(rebuild=True)
+        self.assertEqual(self.indexed(scan), ['lung', 'opacity'])
+
+    def test_tag_filters_match_whole_tags(self):
+        lung = make_scan(patient_id='P00001', tags=['lung'])
+        nodule = make_scan(patient_id='P00002', tags=['lung nodule'])
+        both = make_scan(patient_id='P00003', tags=['Lung', 'fracture'])
+
+        def ids(query):
+            response = self.client.get(f'/api/scans/?{query}')
+            self.assertEqual(response.status_code, 200, query)
+            return sorted(row['id'] for row in response.data['results'])
+
+        # Both plans: sorting the few tagged scans, and probing while
+        # reading the list in order.
+        for sort_limit in (20000, 0):
+            with self.subTest(sort_limit=sort_limit), override_settings(SCANS_TAG_SORT_LIMIT=sort_limit):
+                self.assertEqual(ids('tag=lung'), [lung.pk, both.pk])
+                self.assertEqual(ids('tag=lung&tag=fracture'), [both.pk])
+                self.assertEqual(ids('tag=lung,fracture&tag_mode=all'), [both.pk])
+                self.assertEqual(ids('tag[]=fracture&tag[]=lung nodule&tag_mode=any'), [nodule.pk, both.pk])
+                self.assertEqual(ids('tag=lung&tag=missing'), [])
+                self.assertEqual(ids('tag=lung&tag=missing&tag_mode=any'), [lung.pk, both.pk])
+        self.assertEqual(self.client.get('/api/scans/?tag=lung&tag_mode=some').status_code, 400)
+
+    def test_search_documents_index_the_same_names_as_the_triggers(self):
+        from .documents import scan_source
+
+        scan = make_scan(tags=['Lung, Left', ' FLUID ', 'lung'])
+        self.assertEqual(scan_source(scan)['tag_names'], self.indexed(scan))
+        self.assertEqual(self.indexed(scan), ['fluid', 'lung', 'lung, left'])
+
+    def test_tag_counts_follow_writes(self):
+        scan = make_scan(tags=['lung', 'opacity'])
+        make_scan(tags=['lung'])
+        scan.delete()
+        self.assertEqual(dict(Tag.objects.values_list('name', 'scan_count')), {'lung': 1, 'opacity': 0})
+
+    def test_tag_frequencies(self):
+        make_scan(body_part='Chest', tags=['lung', 'opacity'])
+        make_scan(body_part='Chest', tags=['lung'])
+        make_scan(body_part='Knee', tags=['fracture'])
+        self.assertEqual(self.client.get('/api/scans/tags/').data, [
+            {'value': 'lung', 'count': 2}, {'value': 'fracture', 'count': 1}, {'value': 'opacity', 'count': 1},
+        ])
+        self.assertEqual(self.client.get('/api/scans/tags/?body_part=Chest&limit=1').data, [
+            {'value': 'lung', 'count': 2},
+        ])
+        self.assertEqual(self.client.get('/api/scans/tags/?limit=0').status_code, 400)
+
+
+class ImageUrlTests(TestCase):
+    def setUp(self):
+        stored_image_url.cache_clear()
+
+    def test_url_is_built_once_per_distinct_image(self):
+        scans = [make_scan(image='xray_images/a'), make_scan(image='xray_images/a')]
+        with mock.patch(
+            'cloudinary.utils.cloudinary_url', return_value=('https://cdn/a.jpg', {})
+        ) as build:
+            data = XRayScanSerializer(scans, many=True).data
+        build.assert_called_once_with('xray_images/a')
+        self.assertEqual(data[0]['image'], 'https://cdn/a.jpg')
+        self.assertEqual(data[1]['image_url'], 'https://cdn/a.jpg')
+
+    def test_failures_fall_back_once_per_distinct_image(self):
+        scans = [make_scan(image='xray_images/b') for _ in range(3)]
+        with mock.patch('cloudinary.utils.cloudinary_url', side_effect=ValueError('no cloud name')) as build, \
+                self.assertLogs('scans.serializers', 'WARNING') as logs:
+            data = XRayScanListSerializer().serialize(XRayScanListSerializer().rows(XRayScan.objects.all()))
+        build.assert_called_once_with('xray_images/b')
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual({row['image'] for row in data}, {'xray_images/b'})
+
+
+class ListSerializerTests(TestCase):
+    def setUp(self):
+        stored_image_url.cache_clear()
+        self.client = APIClient()
+        self.scan = make_scan(image='xray_images/a', tags=['lung', 'opacity'])
+
+    def test_list_rows_match_the_full_serializer(self):
+        row = self.client.get('/api/scans/').data['results'][0]
+        self.scan.refresh_from_db()
+        self.assertEqual(row, XRayScanSerializer(self.scan).data)
+
+    def test_sparse_fieldset(self):
+        with mock.patch('cloudinary.utils.cloudinary_url', return_value=('https://cdn/a', {})):
+            rows = self.client.get('/api/scans/?fields=id,body_part,image_url').data['results']
+        self.assertEqual(rows, [{'id': self.scan.id, 'image_url': 'https://cdn/a', 'body_part': 'Chest'}])
+        self.assertCountEqual(
+            XRayScanListSerializer(['body_part']).columns, ['id', 'body_part', 'scan_date']
+        )
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get('/api/scans/?fields=id,secret')
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.scan = make_scan()
+
+    def test_list_not_modified_without_touching_the_scans_table(self):
+        response = self.client.get('/api/scans/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/scans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(len(captured), 1)
+        self.assertIn('"scans_datasetgeneration"', captured[0]['sql'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Another query string is another representation.
+        response = self.client.get('/api/scans/?page_size=5', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_etag_changes_on_write(self):
+        etag = self.client.get('/api/scans/')['ETag']
+        make_scan(patient_id='P00002')
+        response = self.client.get('/api/scans/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_list_etag_changes_on_a_write_by_another_process(self):
+        etag = self.client.get('/api/scans/')['ETag']
+        # As a management command or another worker would see it: no cache
+        # in common, only the database.
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE scans_datasetgeneration SET generation = generation + 1')
+        caches['default'].clear()
+        self.assertEqual(self.client.get('/api/scans/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_detail_etag_follows_updated_at(self):
+        url = f'/api/scans/{self.scan.id}/'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.scan.diagnosis = 'Fracture'
+        self.scan.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_detail_is_still_a_404(self):
+        self.assertEqual(self.client.get('/api/scans/999/').status_code, 404)
+
+
+@mock.patch('scans.search.search_scan_ids', return_value=None)
+@mock.patch('scans.search.search_page', return_value=None)
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        metrics.reset()
+        caches['search'].clear()
+        make_scan(patient_id='P00001', diagnosis='Fracture')
+        make_scan(patient_id='P00002', diagnosis='Normal')
+
+    def test_repeated_search_is_served_from_cache(self, search_page, search_scan_ids):
+        first = self.client.get('/api/scans/?search=fracture')
+        # Only the dataset generation is read.
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/scans/?search=fracture')
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(search_page.call_count, 1)
+
+        stats = self.client.get('/api/scans/cache-stats/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_key_covers_filters_and_pagination(self, search_page, search_scan_ids):
+        self.client.get('/api/scans/?search=p0000&page_size=1')
+        self.client.get('/api/scans/?page_size=1&search=p0000')
+        self.client.get('/api/scans/?search=p0000&page_size=1&page=2')
+        self.client.get('/api/scans/?search=p0000&page_size=1&cursor=')
+        self.assertEqual(metrics.get('search_cache_requests_total', result='hit'), 1)
+        self.assertEqual(metrics.get('search_cache_requests_total', result='miss'), 3)
+
+    def test_key_keeps_the_order_of_repeated_values(self, search_page, search_scan_ids):
+        # The last value wins, so these are different queries.
+        first = self.client.get('/api/scans/?search=p0000&diagnosis=Normal&diagnosis=Fracture').data
+        second = self.client.get('/api/scans/?search=p0000&diagnosis=Fracture&diagnosis=Normal').data
+        self.assertEqual([row['diagnosis'] for row in first['results']], ['Fracture'])
+        self.assertEqual([row['diagnosis'] for row in second['results']], ['Normal'])
+        self.assertEqual(metrics.get('search_cache_requests_total', result='hit'), 0)
+
+    def test_writes_invalidate_cached_pages(self, search_page, search_scan_ids):
+        self.assertEqual(len(self.client.get('/api/scans/?search=fracture').data['results']), 1)
+        make_scan(patient_id='P00003', diagnosis='Fracture')
+        self.assertEqual(len(self.client.get('/api/scans/?search=fracture').data['results']), 2)
+
+        XRayScan.objects.filter(patient_id='P00003').delete()
+        self.assertEqual(len(self.client.get('/api/scans/?search=fracture').data['results']), 1)
+        self.assertEqual(metrics.get('search_cache_requests_total', result='hit'), 0)
+
+
+def use_local_uploads(test):
+    """Point uploads at a temporary MEDIA_ROOT and run them inline."""
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root)
+    settings = override_settings(
+        MEDIA_ROOT=media_root,
+        SCANS_UPLOAD_STAGING_DIR=os.path.join(media_root, 'staging'),
+        SCANS_TILES_ROOT=os.path.join(media_root, 'tiles'),
+        SCANS_FEATURES_DIR=os.path.join(media_root, 'features'),
+        SCANS_IMAGE_STORAGE='scans.storage.LocalImageStorage',
+        SCANS_UPLOAD_EAGER=True,
+        SCANS_UPLOAD_RETRY_DELAY=0,
+    )
+    settings.enable()
+    test.addCleanup(settings.disable)
+    return media_root
+
+
+class AsyncUploadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.media_root = use_local_uploads(self)
+
+    def post_scan(self):
+        return self.client.post('/api/scans/', {
+            'patient_id': 'P00009',
+            'body_part': 'Knee',
+            'scan_date': '2024-02-01',
+            'institution': 'Mayo Clinic',
+            'description': 'Lateral knee',
+            'diagnosis': 'Normal',
+            'tags': '["knee"]',
+            'image': SimpleUploadedFile('knee.png', b'not really a png', content_type='image/png'),
+        }, format='multipart')
+
+    def test_create_returns_202_and_stores_image_in_background(self):
+        response = self.post_scan()
+        self.assertEqual(response.status_code, 202)
+        job = UploadJob.objects.get(pk=response.data['upload_job']['id'])
+        self.assertEqual(job.status, UploadJob.DONE)
+        self.assertFalse(os.path.exists(job.staged_path))
+
+        scan = XRayScan.objects.get(pk=response.data['id'])
+        stored = os.path.join(self.media_root, f'{scan.image.public_id}.{scan.image.format}')
+        with open(stored, 'rb') as image:
+            self.assertEqual(image.read(), b'not really a png')
+
+        status = self.client.get(f'/api/uploads/{job.pk}/').data
+        self.assertEqual((status['scan'], status['status'], status['attempts']), (scan.pk, 'done', 1))
+
+    def test_transfer_is_retried_then_marked_failed(self):
+        with mock.patch('scans.storage.LocalImageStorage.save', side_effect=OSError('remote down')):
+            response = self.post_scan()
+        self.assertEqual(response.status_code, 202)
+        job = UploadJob.objects.get(pk=response.data['upload_job']['id'])
+        self.assertEqual((job.status, job.attempts, job.error), (UploadJob.FAILED, 3, 'remote down'))
+        # The staged file is kept for `manage.py process_uploads --failed`.
+        self.assertTrue(os.path.exists(job.staged_path))
+
+        call_command('process_uploads', failed=True, stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (UploadJob.DONE, 1))
+        self.assertFalse(os.path.exists(job.staged_path))
+
+    def test_retry_after_rendition_failure_keeps_the_stored_original(self):
+        renditions = mock.Mock(side_effect=[OSError('disk full'), {}])
+        with mock.patch('scans.storage.LocalImageStorage.save', autospec=True,
+                        side_effect=LocalImageStorage.save) as save, \
+                mock.patch('scans.images.store_renditions', renditions):
+            response = self.post_scan()
+        job = UploadJob.objects.get(pk=response.data['upload_job']['id'])
+        self.assertEqual((job.status, job.attempts), (UploadJob.DONE, 2))
+        self.assertEqual((save.call_count, renditions.call_count), (1, 2))
+
+
+class BatchUploadTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        use_local_uploads(self)
+
+    def image(self, name):
+        return SimpleUploadedFile(name, f'pixels of {name}'.encode(), content_type='image/jpeg')
+
+    def entry(self, image, **overrides):
+        entry = {
+            'image': image, 'patient_id': 'P00100', 'body_part': 'Chest', 'scan_date': '2024-03-01',
+            'institution': 'Stanford', 'description': 'PA view', 'diagnosis': 'Normal', 'tags': ['chest'],
+        }
+        entry.update(overrides)
+        return entry
+
+    def test_json_manifest(self):
+        manifest = [self.entry('a.jpg'), self.entry('b.jpg', patient_id='P00101', tags=['lung', 'fluid'])]
+        with mock.patch('scans.search_sync.enqueue', wraps=search_sync.enqueue) as enqueue:
+            response = self.client.post('/api/scans/batch/', {
+                'manifest': json.dumps(manifest), 'images': [self.image('a.jpg'), self.image('b.jpg')],
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([item['upload_job']['status'] for item in response.data['results']], ['done', 'done'])
+
+        scans = XRayScan.objects.order_by('patient_id')
+        self.assertEqual([scan.tags for scan in scans], [['chest'], ['lung', 'fluid']])
+        self.assertTrue(all(scan.image for scan in scans))
+        enqueue.assert_any_call([item['id'] for item in response.data['results']], SearchOutbox.INDEX)
+
+    def test_csv_manifest(self):
+        manifest = SimpleUploadedFile('study.csv', (
+            'image,patient_id,body_part,scan_date,institution,description,diagnosis,tags\n'
+            'a.jpg,P00200,Knee,2024-03-02,UCLA Medical Center,Lateral,Fracture,knee;fracture\n'
+        ).encode(), content_type='text/csv')
+        response = self.client.post('/api/scans/batch/', {
+            'manifest': manifest, 'images': [self.image('a.jpg')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(XRayScan.objects.get().tags, ['knee', 'fracture'])
+
+    def test_any_invalid_entry_rejects_the_whole_batch(self):
+        manifest = [self.entry('a.jpg'), self.entry('b.jpg', scan_date='not a date'), self.entry('c.jpg')]
+        response = self.client.post('/api/scans/batch/', {
+            'manifest': json.dumps(manifest), 'images': [self.image('a.jpg'), self.image('b.jpg')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['items']), [1, 2])
+        self.assertIn('scan_date', response.data['items'][1])
+        self.assertFalse(XRayScan.objects.exists())
+        self.assertFalse(UploadJob.objects.exists())
+
+    def test_non_string_image_is_a_field_error(self):
+        manifest = [self.entry('a.jpg'), dict(self.entry('b.jpg'), image=['b.jpg']), dict(self.entry('c.jpg'), image=None)]
+        response = self.client.post('/api/scans/batch/', {
+            'manifest': json.dumps(manifest), 'images': [self.image('a.jpg'), self.image('b.jpg')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(sorted(response.data['items']), [1, 2])
+        self.assertIn('image', response.data['items'][1])
+
+    def test_failed_images_are_reported_per_item(self):
+        def save(storage, path):
+            if path.endswith('.png'):
+                raise OSError('remote down')
+            return 'scans/ok'
+
+        with mock.patch('scans.storage.LocalImageStorage.save', save):
+            response = self.client.post('/api/scans/batch/', {
+                'manifest': json.dumps([self.entry('a.jpg'), self.entry('b.png')]),
+                'images': [self.image('a.jpg'), self.image('b.png')],
+            }, format='multipart')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(
+            [item['upload_job']['status'] for item in response.data['results']], ['done', 'failed']
+        )
+
+
+class DeduplicationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.media_root = use_local_uploads(self)
+
+    def post_scan(self, path, patient_id):
+        with open(path, 'rb') as image:
+            return self.client.post('/api/scans/', {
+                'patient_id': patient_id, 'body_part': 'Chest', 'scan_date': '2024-04-01',
+                'institution': 'Stanford', 'description': 'PA', 'diagnosis': 'Normal',
+                'tags': '["chest"]', 'image': image,
+            }, format='multipart')
+
+    def test_identical_upload_reuses_stored_image(self):
+        path = radiograph(size=(400, 300))
+        with mock.patch('scans.storage.LocalImageStorage.save', autospec=True,
+                        side_effect=LocalImageStorage.save) as save:
+            first = self.post_scan(path, 'P00500')
+            transfers = save.call_count
+            with self.captureOnCommitCallbacks(execute=True):
+                second = self.post_scan(path, 'P00501')
+        self.assertEqual((first.status_code, second.status_code), (202, 201))
+        self.assertIsNone(second.data['upload_job'])
+        self.assertEqual(save.call_count, transfers)
+        self.assertFalse(os.listdir(os.path.join(self.media_root, 'staging')))
+
+        original, duplicate = XRayScan.objects.get(pk=first.data['id']), XRayScan.objects.get(pk=second.data['id'])
+        with open(path, 'rb') as image:
+            self.assertEqual(duplicate.content_hash, hashlib.sha256(image.read()).hexdigest())
+        self.assertEqual(duplicate.content_hash, original.content_hash)
+        self.assertEqual(str(duplicate.image), str(original.image))
+        self.assertEqual(duplicate.renditions, original.renditions)
+        # The duplicate gets its own links to the pyramid, served under its id.
+        self.assertEqual(duplicate.tiles, original.tiles)
+        self.assertTrue(os.path.isfile(images.tiles_path(duplicate.pk, duplicate.tiles['version'], '0', '0_0.jpg')))
+
+    def test_image_update_is_staged_and_resets_derived_fields(self):
+        first, second = radiograph(size=(400, 300)), radiograph(size=(360, 280))
+        scan = XRayScan.objects.get(pk=self.post_scan(first, 'P00900').data['id'])
+        old_hash, old_tiles = scan.content_hash, images.tiles_path(scan.pk, scan.tiles['version'])
+
+        with open(second, 'rb') as image, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/scans/{scan.pk}/', {'image': image}, format='multipart')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['upload_job']['status'], 'done')
+        scan.refresh_from_db()
+        with open(second, 'rb') as image:
+            self.assertEqual(scan.content_hash, hashlib.sha256(image.read()).hexdigest())
+        self.assertEqual(scan.perceptual_hash, images.perceptual_hash(second))
+        self.assertEqual(scan.tiles['width'], 360)
+        self.assertEqual(response.data['image_url'], f'/media/{scan.image.public_id}.{scan.image.format}')
+        self.assertFalse(os.path.exists(old_tiles))
+        # The old bytes are no longer linked to this scan.
+        self.assertIsNone(uploads.find_stored(old_hash))
+
+        # Metadata-only updates leave the image alone.
+        response = self.client.patch(f'/api/scans/{scan.pk}/', {'diagnosis': 'Fracture'}, format='json')
+        self.assertEqual((response.status_code, response.data['diagnosis']), (200, 'Fracture'))
+        self.assertEqual(XRayScan.objects.get(pk=scan.pk).content_hash, scan.content_hash)
+
+    def test_batch_links_known_images_without_jobs(self):
+        known = radiograph(size=(300, 300))
+        self.post_scan(known, 'P00600')
+        entry = {
+            'body_part': 'Chest', 'scan_date': '2024-03-01', 'institution': 'Stanford',
+            'description': 'PA view', 'diagnosis': 'Normal', 'tags': ['chest'],
+        }
+        manifest = [dict(entry, image='a.png', patient_id='P00601'), dict(entry, image='b.png', patient_id='P00602')]
+        with open(known, 'rb') as image:
+            response = self.client.post('/api/scans/batch/', {
+                'manifest': json.dumps(manifest),
+                'images': [
+                    SimpleUploadedFile('a.png', image.read(), content_type='image/png'),
+                    SimpleUploadedFile('b.png', b'new bytes', content_type='image/png'),
+                ],
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        linked, uploaded = response.data['results']
+        self.assertIsNone(linked['upload_job'])
+        self.assertEqual(uploaded['upload_job']['status'], 'done')
+        self.assertEqual(UploadJob.objects.count(), 2)
+
+    def test_process_images_backfills_content_hash(self):
+        path = radiograph(size=(200, 200))
+        scan = make_scan(image=LocalImageStorage().save(path))
+        call_command('process_images', steps='content_hash', workers=1, stdout=StringIO())
+        scan.refresh_from_db()
+        self.assertEqual(scan.content_hash, images.file_hash(path))
+
+
+def radiograph(name='chest.png', size=(2000, 1500)):
+    image = Image.linear_gradient('L').resize(size)
+    path = os.path.join(tempfile.mkdtemp(), name)
+    image.save(path)
+    return path
+
+
+class RenditionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.media_root = use_local_uploads(self)
+
+    def stored_size(self, value):
+        with Image.open(os.path.join(self.media_root, value)) as image:
+            return image.format, image.size
+
+    def test_upload_generates_renditions(self):
+        path = radiograph()
+        with open(path, 'rb') as image:
+            response = self.client.post('/api/scans/', {
+                'patient_id': 'P00300', 'body_part': 'Chest', 'scan_date': '2024-04-01',
+                'institution': 'Stanford', 'description': 'PA', 'diagnosis': 'Normal',
+                'tags': '["chest"]', 'image': image,
+            }, format='multipart')
+        self.assertEqual(response.status_code, 202)
+
+        scan = XRayScan.objects.get(pk=response.data['id'])
+        self.assertEqual(set(scan.renditions), set(RENDITIONS))
+        self.assertEqual(self.stored_size(scan.renditions['preview']), ('JPEG', (1024, 768)))
+        self.assertEqual(self.stored_size(scan.renditions['thumbnail_webp']), ('WEBP', (256, 192)))
+
+        # Delivered by the storage that holds them, here from MEDIA_URL.
+        detail = self.client.get(f'/api/scans/{scan.pk}/').data
+        row = self.client.get('/api/scans/?fields=id,thumbnail_url,preview_webp_url').data['results'][0]
+        self.assertNotIn('renditions', detail)
+        self.assertEqual(detail['image_url'], f'/media/{scan.image.public_id}.{scan.image.format}')
+        self.assertEqual(detail['thumbnail_url'], '/media/' + scan.renditions['thumbnail'])
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, scan.renditions['thumbnail'])))
+        self.assertEqual(row['thumbnail_url'], detail['thumbnail_url'])
+        self.assertEqual(row['preview_webp_url'], detail['preview_webp_url'])
+
+    def test_process_images_backfills_existing_scans(self):
+        value = LocalImageStorage().save(radiograph('old.png', size=(600, 800)))
+        scan = make_scan(image=value)
+        make_scan(patient_id='P00002')  # no image: skipped
+
+        call_command('process_images', workers=1, stdout=StringIO(), stderr=StringIO())
+        scan.refresh_from_db()
+        self.assertEqual(self.stored_size(scan.renditions['preview']), ('JPEG', (600, 800)))
+        self.assertEqual(self.stored_size(scan.renditions['thumbnail']), ('JPEG', (192, 256)))
+
+        with mock.patch('scans.images.store_renditions') as store:
+            call_command('process_images', workers=1, stdout=StringIO())
+        store.assert_not_called()
+
+
+class TilePyramidTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.media_root = use_local_uploads(self)
+        tile_settings = override_settings(SCANS_TILE_SIZE=254, SCANS_TILE_OVERLAP=1)
+        tile_settings.enable()
+        self.addCleanup(tile_settings.disable)
+
+    def test_pyramid_levels_and_tiles(self):
+        scan = make_scan()
+        tiles = images.build_tiles(scan.pk, radiograph(size=(600, 300)))
+        self.assertEqual((tiles['width'], tiles['height'], tiles['max_level']), (600, 300, 10))
+
+        level_dir = images.tiles_path(scan.pk, tiles['version'], '10')
+        self.assertEqual(sorted(os.listdir(level_dir)), ['0_0.jpg', '0_1.jpg', '1_0.jpg', '1_1.jpg', '2_0.jpg', '2_1.jpg'])
+        with Image.open(os.path.join(level_dir, '1_0.jpg')) as tile:
+            # An inner tile: 254px plus one overlap pixel on each inner edge.
+            self.assertEqual(tile.size, (256, 255))
+        with Image.open(images.tiles_path(scan.pk, tiles['version'], '0', '0_0.jpg')) as tile:
+            self.assertEqual(tile.size, (1, 1))
+
+    def test_tile_endpoints(self):
+        scan = make_scan()
+        self.assertEqual(self.client.get(f'/api/scans/{scan.pk}/tiles/').status_code, 404)
+        self.assertEqual(self.client.get('/api/scans/abc/tiles/').status_code, 404)
+
+        scan.tiles = images.build_tiles(scan.pk, radiograph(size=(300, 300)))
+        scan.save()
+        descriptor = self.client.get(f'/api/scans/{scan.pk}/tiles/').data
+        self.assertEqual(descriptor['max_level'], 9)
+        url = descriptor['url'].format(level=9, col=1, row=0)
+        self.assertTrue(url.endswith(f'/api/scans/{scan.pk}/tiles/{scan.tiles["version"]}/9/1_0.jpg'))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(descriptor['url'].format(level=9, col=5, row=5)).status_code, 404)
+
+    def test_upload_builds_pyramid_and_delete_removes_it(self):
+        with open(radiograph(size=(520, 400)), 'rb') as image:
+            response = self.client.post('/api/scans/', {
+                'patient_id': 'P00400', 'body_part': 'Arm', 'scan_date': '2024-05-01',
+                'institution': 'Stanford', 'description': 'AP', 'diagnosis': 'Normal',
+                'tags': '["arm"]', 'image': image,
+            }, format='multipart')
+        scan = XRayScan.objects.get(pk=response.data['id'])
+        self.assertEqual(scan.tiles['width'], 520)
+        root = images.tiles_path(scan.pk, scan.tiles['version'])
+        self.assertTrue(os.path.isdir(root))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/scans/{scan.pk}/')
+        self.assertFalse(os.path.exists(root))
+
+
+def shapes(seed, size=(800, 600)):
+    """A grayscale image of overlapping ellipses, distinct per seed."""
+    rng = random.Random(seed)
+    image = Image.new('L', size)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randint(80, 300), y + rng.randint(80, 300)), fill=rng.randint(40, 255))
+    return image
+
+
+class NearDuplicateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        near_duplicates.get_index().reset()
+        self.addCleanup(near_duplicates.get_index().reset)
+
+    def test_hash_survives_rescaling_and_recompression(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        original = shapes(1)
+        original.save(os.path.join(directory, 'original.png'))
+        original.resize((400, 300)).save(os.path.join(directory, 'reexport.jpg'), quality=40)
+        shapes(2).save(os.path.join(directory, 'other.png'))
+
+        original, reexport, other = (
+            int(images.perceptual_hash(os.path.join(directory, name)), 16)
+            for name in ('original.png', 'reexport.jpg', 'other.png')
+        )
+        self.assertLessEqual(near_duplicates.hamming(original, reexport), 4)
+        self.assertGreater(near_duplicates.hamming(original, other), 16)
+
+    def test_multi_index_search_matches_a_full_scan(self):
+        rng = random.Random(3)
+        values = [rng.getrandbits(64) for _ in range(2000)]
+        # Plant copies a few bits away from the first hashes.
+        values += [value ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for value in values[:50]]
+        index = near_duplicates.MultiIndexHash()
+        for item, value in enumerate(values):
+            index.add(value, item)
+        for query in values[:20]:
+            for radius in (0, 3, 10):
+                expected = sorted(
+                    (near_duplicates.hamming(query, value), item) for item, value in enumerate(values)
+                    if near_duplicates.hamming(query, value) <= radius
+                )
+                self.assertEqual(sorted(index.search(query, radius)), expected)
+
+    def test_endpoint_ranks_by_distance_and_tracks_changes(self):
+        scan = make_scan(perceptual_hash='ffff0000ffff0000')
+        close = make_scan(patient_id='P00002', perceptual_hash='ffff0000ffff0001')
+        closer = make_scan(patient_id='P00003', perceptual_hash='ffff0000ffff0000')
+        make_scan(patient_id='P00004', perceptual_hash='0000ffff0000ffff')
+        url = f'/api/scans/{scan.pk}/near-duplicates/'
+
+        response = self.client.get(url, {'fields': 'id,patient_id'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [
+            {'id': closer.pk, 'patient_id': 'P00003', 'distance': 0},
+            {'id': close.pk, 'patient_id': 'P00002', 'distance': 1},
+        ])
+
+        # Later writes are picked up without rebuilding the index.
+        added = make_scan(patient_id='P00005', perceptual_hash='ffff0000ffff0003')
+        closer.delete()
+        close.perceptual_hash = '0000000000000000'
+        close.save()
+        ids = [row['id'] for row in self.client.get(url).data['results']]
+        self.assertEqual(ids, [added.pk])
+
+    def test_refresh_reads_changes_by_index_and_catches_late_commits(self):
+        scan = make_scan(perceptual_hash='ffff0000ffff0000')
+        index = near_duplicates.get_index()
+        index.refresh()
+        # Stamped before that refresh, committed after it.
+        late = make_scan(patient_id='P00002', perceptual_hash='ffff0000ffff0001')
+        XRayScan.objects.filter(pk=late.pk).update(updated_at=timezone.now() - datetime.timedelta(seconds=30))
+
+        with CaptureQueriesContext(connection) as captured:
+            found = index.search(int(scan.perceptual_hash, 16), 2)
+        self.assertIn((1, late.pk), found)
+        sql = next(query['sql'] for query in captured if 'perceptual_hash' in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertNotIn(f'SCAN {XRayScan._meta.db_table}', plan)
+
+    def test_list_actions_on_different_scans_have_different_etags(self):
+        first = make_scan(perceptual_hash='ffff0000ffff0000')
+        second = make_scan(patient_id='P00002', perceptual_hash='0000ffff0000ffff')
+        etag = self.client.get(f'/api/scans/{first.pk}/near-duplicates/')['ETag']
+        self.assertEqual(self.client.get(f'/api/scans/{second.pk}/near-duplicates/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get('/api/scans/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_endpoint_errors(self):
+        scan = make_scan()
+        self.assertEqual(self.client.get(f'/api/scans/{scan.pk}/near-duplicates/').status_code, 404)
+        self.assertEqual(self.client.get('/api/scans/abc/near-duplicates/').status_code, 404)
+        scan.perceptual_hash = '0123456789abcdef'
+        scan.save()
+        response = self.client.get(f'/api/scans/{scan.pk}/near-duplicates/', {'distance': 40})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('distance', response.data)
+
+    def test_upload_computes_hash(self):
+        use_local_uploads(self)
+        path = os.path.join(tempfile.mkdtemp(), 'shapes.png')
+        shapes(1).save(path)
+        with open(path, 'rb') as image:
+            response = self.client.post('/api/scans/', {
+                'patient_id': 'P00700', 'body_part': 'Chest', 'scan_date': '2024-04-01',
+                'institution': 'Stanford', 'description': 'PA', 'diagnosis': 'Normal',
+                'tags': '["chest"]', 'image': image,
+            }, format='multipart')
+        self.assertEqual(XRayScan.objects.get(pk=response.data['id']).perceptual_hash, images.perceptual_hash(path))
+
+
+class SimilarityTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.media_root = use_local_uploads(self)
+
+    def upload(self, image, patient_id):
+        path = os.path.join(tempfile.mkdtemp(dir=self.media_root), f'{patient_id}.png')
+        image.save(path)
+        with open(path, 'rb') as upload:
+            response = self.client.post('/api/scans/', {
+                'patient_id': patient_id, 'body_part': 'Chest', 'scan_date': '2024-04-01',
+                'institution': 'Stanford', 'description': 'PA', 'diagnosis': 'Normal',
+                'tags': '["chest"]', 'image': upload,
+            }, format='multipart')
+        return XRayScan.objects.get(pk=response.data['id'])
+
+    def test_endpoint_ranks_lookalikes_first(self):
+        scan = self.upload(shapes(1), 'P00800')
+        other = self.upload(shapes(2), 'P00801')
+        rescaled = self.upload(shapes(1).resize((400, 300)).point(lambda value: value * 0.9), 'P00802')
+        self.assertTrue(scan.has_features)
+
+        response = self.client.get(f'/api/scans/{scan.pk}/similar/', {'fields': 'id', 'k': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['index'], 'exact')
+        results = response.data['results']
+        self.assertEqual([row['id'] for row in results], [rescaled.pk, other.pk])
+        self.assertGreater(results[0]['score'], 0.9)
+        self.assertGreater(results[0]['score'], results[1]['score'])
+
+        rescaled_id = rescaled.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            rescaled.delete()
+        self.assertIsNone(similarity.get_store().read(rescaled_id))
+        ids = [row['id'] for row in self.client.get(f'/api/scans/{scan.pk}/similar/').data['results']]
+        self.assertEqual(ids, [other.pk])
+
+    def test_endpoint_errors(self):
+        scan = make_scan()
+        self.assertEqual(self.client.get(f'/api/scans/{scan.pk}/similar/').status_code, 404)
+        self.assertEqual(self.client.get('/api/scans/abc/similar/').status_code, 404)
+        scan = self.upload(shapes(1), 'P00803')
+        self.assertEqual(self.client.get(f'/api/scans/{scan.pk}/similar/', {'k': 0}).status_code, 400)
+
+    def test_ivf_index_agrees_with_exact_search(self):
+        rng = np.random.default_rng(4)
+        centres = rng.normal(size=(20, similarity.DIM))
+        vectors = centres[rng.integers(20, size=3000)] + rng.normal(scale=0.3, size=(3000, similarity.DIM))
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        store = similarity.get_store()
+        for pk, vector in enumerate(vectors, start=1):
+            store.write(pk, vector)
+
+        queries = vectors[:50]
+        exact = [store.search(query, 10, exact=True) for query in queries]
+        generation = get_generation()
+        call_command('build_similarity_index', lists=40, stdout=StringIO())
+        self.assertEqual(len(store.centroids()), 40)
+        # Cached /similar/ responses are retired with the old index.
+        self.assertNotEqual(get_generation(), generation)
+        recall = np.mean([
+            len({pk for pk, _ in store.search(query, 10, nprobe=8)} & {pk for pk, _ in expected}) / 10
+            for query, expected in zip(queries, exact)
+        ])
+        self.assertGreater(recall, 0.9)
+
+        # Rows written after the build are assigned to a list.
+        store.write(5000, vectors[0])
+        self.assertIn(5000, [pk for pk, _ in store.search(vectors[0], 3, nprobe=8)])
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        metrics.reset()
+
+    def test_histograms_render_in_prometheus_text_format(self):
+        for value in (0.5, 2, 2, 7):
+            metrics.observe('job_seconds', value, buckets=(1, 2, 5), queue='a "b"')
+        metrics.inc('jobs_total', queue='a')
+        lines = metrics.render().splitlines()
+        self.assertIn('# TYPE job_seconds histogram', lines)
+        self.assertIn('job_seconds_bucket{queue="a \\"b\\"",le="1.0"} 1', lines)
+        self.assertIn('job_seconds_bucket{queue="a \\"b\\"",le="2.0"} 3', lines)
+        self.assertIn('job_seconds_bucket{queue="a \\"b\\"",le="+Inf"} 4', lines)
+        self.assertIn('job_seconds_sum{queue="a \\"b\\""} 11.5', lines)
+        self.assertIn('job_seconds_count{queue="a \\"b\\""} 4', lines)
+        self.assertIn('# TYPE jobs_total counter', lines)
+        self.assertIn('jobs_total{queue="a"} 1.0', lines)
+
+    def test_workers_are_added_up_through_the_metrics_dir(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(SCANS_METRICS_DIR=directory):
+            metrics.inc('jobs_total', 3, queue='a')
+            metrics.observe('job_seconds', 2, buckets=(1, 5))
+            metrics.set_gauge('breaker_state', 1)
+            # What another worker would have written.
+            with mock.patch('os.getpid', return_value=1):
+                metrics.flush()
+            metrics.inc('jobs_total', queue='a')
+            lines = self.client.get('/metrics').content.decode().splitlines()
+        self.assertIn('jobs_total{queue="a"} 7.0', lines)
+        self.assertIn('job_seconds_bucket{le="5.0"} 2', lines)
+        self.assertIn('breaker_state{pid="1"} 1.0', lines)
+        self.assertIn(f'breaker_state{{pid="{os.getpid()}"}} 1.0', lines)
+
+    def test_concurrent_flushes_never_collide(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        errors = []
+
+        def record(thread):
+            try:
+                for _ in range(200):
+                    metrics.inc('jobs_total', queue=str(thread))
+                    metrics.flush()
+            except Exception as e:
+                errors.append(e)
+
+        with override_settings(SCANS_METRICS_DIR=directory), mock.patch.object(metrics, 'FLUSH_INTERVAL', 0):
+            workers = [threading.Thread(target=record, args=(thread,)) for thread in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual(errors, [])
+            self.assertEqual(sorted(os.listdir(directory)), [f'{os.getpid()}.json'])
+            self.assertEqual(metrics.total('jobs_total', queue='3'), 200)
+
+    def test_metrics_are_only_served_to_allowed_addresses(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 403)
+        with override_settings(SCANS_METRICS_ALLOWED_IPS=['10.0.0.0/8']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+    def test_requests_are_measured_per_endpoint(self):
+        make_scan()
+        self.client.get('/api/scans/')
+        self.client.get('/api/scans/?page=2')
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode().splitlines()
+        self.assertIn('http_requests_total{endpoint="xrayscan-list",method="GET",status="200"} 1.0', lines)
+        self.assertIn('http_requests_total{endpoint="xrayscan-list",method="GET",status="404"} 1.0', lines)
+        self.assertIn('http_request_duration_seconds_count{endpoint="xrayscan-list",method="GET"} 2', lines)
+        self.assertIn('http_request_serializer_duration_seconds_count{endpoint="xrayscan-list"} 1', lines)
+        db_queries = metrics.snapshot()['histograms'][('http_request_db_queries', (('endpoint', 'xrayscan-list'),))]
+        self.assertEqual(db_queries['count'], 2)
+        self.assertGreater(db_queries['sum'], 0)
+        self.assertEqual(metrics.snapshot()['histograms'][
+            ('http_response_size_bytes', (('endpoint', 'xrayscan-list'),))
+        ]['count'], 2)
+
+    def test_elasticsearch_calls_are_timed_and_captured(self):
+        sent = SimpleNamespace(execute=lambda: 'response', to_dict=lambda: {'query': {'match_all': {}}})
+        with mock.patch.object(search.breaker, 'allow', return_value=True), \
+                instrumentation.tracking(capture=True) as stats:
+            self.assertEqual(search.execute(lambda: sent), 'response')
+        self.assertEqual(stats.es_calls, 1)
+        self.assertEqual([(kind, body) for kind, body, _ in stats.queries], [('es', {'query': {'match_all': {}}})])
+        self.assertEqual(metrics.snapshot()['histograms'][('search_request_duration_seconds', ())]['count'], 1)
+
+    @override_settings(SCANS_SLOW_REQUEST_MS=0.001)
+    def test_slow_requests_are_logged_with_their_queries(self):
+        make_scan()
+        with self.assertLogs('scans.middleware', 'WARNING') as logs:
+            self.client.get('/api/scans/?body_part=Chest')
+        self.assertIn('GET /api/scans/?body_part=Chest -> 200', logs.output[0])
+        self.assertIn('[sql', logs.output[0])
+        self.assertIn('"body_part" = ', logs.output[0])
+        self.assertEqual(metrics.get('http_slow_requests_total', endpoint='xrayscan-list'), 1)
+
+    def test_slow_request_log_is_off_by_default(self):
+        with self.assertNoLogs('scans.middleware', 'WARNING'):
+            self.client.get('/api/scans/')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(5):
+            make_scan(patient_id=f'P{i:05d}', body_part='Knee' if i % 2 else 'Chest', tags=['t', str(i)])
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_matches_list_rows(self):
+        response = self.client.get('/api/scans/export/?body_part=Knee')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = [json.loads(line) for line in self.content(response).decode().splitlines()]
+        self.assertEqual(rows, self.client.get('/api/scans/?body_part=Knee').json()['results'])
+
+    def test_csv_with_sparse_fields(self):
+        response = self.client.get('/api/scans/export/?output=csv&fields=patient_id,tags&search=P00003')
+        lines = self.content(response).decode().splitlines()
+        self.assertEqual(lines, ['patient_id,tags', 'P00003,"[""t"", ""3""]"'])
+
+    def test_gzip_on_the_fly(self):
+        response = self.client.get('/api/scans/export/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        lines = gzip.decompress(self.content(response)).decode().splitlines()
+        self.assertEqual(len(lines), 5)
+
+    def test_unknown_output_is_rejected(self):
+        self.assertEqual(self.client.get('/api/scans/export/?output=xml').status_code, 400)
+
+
+class SyntheticDataTests(TestCase):
+    def setUp(self):
+        self.media_root = use_local_uploads(self)
+        self.images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir)
+        Image.linear_gradient('L').save(os.path.join(self.images_dir, 'knee1.png'))
+        Image.radial_gradient('L').save(os.path.join(self.images_dir, 'chest1.png'))
+
+    def test_generates_correlated_rows_in_batches(self):
+        with CaptureQueriesContext(connection) as captured:
+            call_command('generate_scans', count=250, batch_size=50, images_dir=self.images_dir,
+                         stdout=StringIO())
+        inserts = [query for query in captured if query['sql'].startswith('INSERT INTO "scans_xrayscan"')]
+        self.assertEqual(len(inserts), 5)
+        self.assertEqual(XRayScan.objects.count(), 250)
+
+        stored = {name: images.file_hash(os.path.join(self.images_dir, name)) for name in ('knee1.png', 'chest1.png')}
+        for scan in XRayScan.objects.all():
+            self.assertIn(scan.diagnosis, synthetic.DIAGNOSIS_MAP[scan.body_part])
+            self.assertLessEqual(set(scan.tags), set(synthetic.TAG_MAP.get(scan.diagnosis, synthetic.TAGS_POOL)))
+            self.assertIn(scan.content_hash, stored.values())
+            if scan.body_part in ('Knee', 'Chest'):
+                self.assertEqual(scan.content_hash, stored[f'{scan.body_part.lower()}1.png'])
+            self.assertEqual(set(scan.renditions), set(RENDITIONS))
+        # Two shared files, stored once each.
+        self.assertEqual(XRayScan.objects.values('image').distinct().count(), 2)
+        self.assertLessEqual({'knee1.png', 'chest1.png'}, set(os.listdir(os.path.join(self.media_root, 'scans'))))
+        # Delivered by the storage that holds them.
+        row = APIClient().get('/api/scans/?fields=id,image_url').data['results'][0]
+        self.assertRegex(row['image_url'], r'^/media/scans/(knee|chest)1\.png$')
+
+    def test_later_runs_reuse_stored_images(self):
+        call_command('generate_scans', count=10, images_dir=self.images_dir, stdout=StringIO())
+        with mock.patch('scans.storage.LocalImageStorage.save') as save:
+            call_command('generate_scans', count=10, images_dir=self.images_dir, stdout=StringIO())
+        save.assert_not_called()
+        self.assertEqual(len({scan.image.public_id for scan in XRayScan.objects.all()}), 2)
+
+    def test_remote_storage_needs_upload_flag(self):
+        with override_settings(SCANS_IMAGE_STORAGE='scans.storage.CloudinaryImageStorage'), \
+                mock.patch('scans.storage.CloudinaryImageStorage.save') as save:
+            with self.assertRaises(CommandError):
+                call_command('generate_scans', count=10, images_dir=self.images_dir, stdout=StringIO())
+            call_command('generate_scans', count=10, no_images=True, stdout=StringIO())
+        save.assert_not_called()
+        self.assertEqual(XRayScan.objects.count(), 10)
+
+    def test_benchmark_datasets_come_from_the_same_generator(self):
+        insert_synthetic_scans(100, batch_size=40, seed=1, images=3)
+        self.assertEqual(XRayScan.objects.count(), 100)
+        for scan in XRayScan.objects.all():
+            self.assertIn(scan.diagnosis, synthetic.DIAGNOSIS_MAP[scan.body_part])
+        self.assertEqual(XRayScan.objects.values('image').distinct().count(), 3)
+
+    def test_same_seed_same_rows(self):
+        first = [synthetic.ScanFactory(seed=3).build() for _ in range(20)]
+        second = [synthetic.ScanFactory(seed=3).build() for _ in range(20)]
+        fields = ['patient_id', 'body_part', 'scan_date', 'description', 'diagnosis', 'tags']
+        self.assertEqual(
+            [[getattr(scan, field) for field in fields] for scan in first],
+            [[getattr(scan, field) for field in fields] for scan in second],
+        )
@@ -0,0 +1,249 @@
+"""
+Asynchronous scan image uploads.
+
+`create` stages the uploaded file on local disk and records an UploadJob;
+`submit` hands the job to a process-wide thread pool once the transaction
+commits, so request workers never wait on the remote transfer. The worker
+also renders the derivative renditions and the DeepZoom tile pyramid
+from the staged file. Failed
+transfers are retried with exponential backoff; jobs that exhaust their
+attempts are left `failed` with the staged file kept, for
+`manage.py process_uploads` to pick up.
+
+Files are hashed (SHA-256) while they are staged. When a stored scan
+already has the same bytes, the new scan links to its image, renditions
+and tiles instead of transferring and rendering them again.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import images, metrics, similarity
+from .cache import bump_generation
+from .models import UploadJob, XRayScan
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SCANS_UPLOAD_WORKERS, thread_name_prefix='scan-upload'
+            )
+        return _executor
+
+
+def stage(uploaded_file):
+    """
+    Write an uploaded file under the staging directory, hashing it on the
+    way; returns its path and SHA-256 hex digest.
+    """
+    os.makedirs(settings.SCANS_UPLOAD_STAGING_DIR, exist_ok=True)
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    path = os.path.join(settings.SCANS_UPLOAD_STAGING_DIR, f'{uuid.uuid4().hex}{extension}')
+    digest = hashlib.sha256()
+    with open(path, 'wb') as staged:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            staged.write(chunk)
+    return path, digest.hexdigest()
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def stored_with_hashes(content_hashes):
+    """{content_hash: earliest scan whose image with those bytes is stored}."""
+    content_hashes = {content_hash for content_hash in content_hashes if content_hash}
+    if not content_hashes:
+        return {}
+    scans = (
+        XRayScan.objects.filter(content_hash__in=content_hashes)
+        .exclude(image__isnull=True).exclude(image='')
+        .order_by('id').only(
+            'id', 'image', 'renditions', 'tiles', 'content_hash', 'perceptual_hash', 'has_features',
+        )
+    )
+    stored = {}
+    for scan in scans:
+        stored.setdefault(scan.content_hash, scan)
+    return stored
+
+
+def find_stored(content_hash):
+    return stored_with_hashes([content_hash]).get(content_hash)
+
+
+def link_stored(scan, stored):
+    """
+    Point `scan` at the image, renditions and tiles already kept for
+    `stored`. The tiles are shared once the transaction commits, so a
+    rollback leaves no pyramid behind for a scan that was never saved.
+    """
+    scan.image = stored.image
+    scan.renditions = stored.renditions
+    scan.perceptual_hash = stored.perceptual_hash
+    scan_id, source_id, tiles = scan.pk, stored.pk, stored.tiles
+    transaction.on_commit(lambda: share_stored_tiles(scan_id, source_id, tiles))
+    store = similarity.get_store()
+    vector = store.read(stored.pk) if stored.has_features else None
+    if vector is not None:
+        # After the commit too, and so after `forget_image` cleanups.
+        transaction.on_commit(lambda: store.write(scan_id, vector))
+    scan.has_features = vector is not None
+    scan.save(update_fields=[
+        'image', 'renditions', 'perceptual_hash', 'has_features', 'updated_at',
+    ])
+    metrics.inc('upload_dedup_total')
+    logger.info(f"Scan {scan.pk} reuses the stored image of scan {stored.pk}")
+
+
+# The image-derived fields of a scan whose image is not stored yet.
+UNSTORED = {'image': None, 'renditions': {}, 'tiles': None, 'perceptual_hash': '', 'has_features': False}
+
+
+def forget_image(scan):
+    """
+    Before `scan` gets a new image: drop its unfinished upload jobs and,
+    once the transaction commits, the tile pyramids, feature vector and
+    staged files that belong to the image it had.
+    """
+    superseded = UploadJob.objects.filter(scan=scan).exclude(status=UploadJob.DONE)
+    staged_paths = list(superseded.values_list('staged_path', flat=True))
+    superseded.delete()
+    scan_id = scan.pk
+
+    def clean_up():
+        # Whatever the new image has produced by now is kept.
+        current = XRayScan.objects.filter(pk=scan_id).values('tiles', 'has_features').first() or {}
+        images.remove_tiles(scan_id, keep=(current.get('tiles') or {}).get('version'))
+        if not current.get('has_features'):
+            similarity.get_store().write(scan_id, None)
+        for path in staged_paths:
+            discard(path)
+
+    transaction.on_commit(clean_up)
+
+
+def share_stored_tiles(scan_id, source_id, tiles):
+    tiles = images.share_tiles(tiles, source_id, scan_id)
+    if tiles is not None and XRayScan.objects.filter(pk=scan_id).update(tiles=tiles, updated_at=timezone.now()):
+        bump_generation()
+
+
+def submit(job):
+    """Queue `job` for transfer after the current transaction commits."""
+    if settings.SCANS_UPLOAD_EAGER:
+        run(job.pk)
+        return
+    transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.pk))
+
+
+def run_all(job_ids):
+    """Run jobs concurrently on the pool and wait for them; returns them in order."""
+    if settings.SCANS_UPLOAD_EAGER:
+        return [run(job_id) for job_id in job_ids]
+    executor = get_executor()
+    futures = [executor.submit(_run_in_worker, job_id) for job_id in job_ids]
+    return [future.result() for future in futures]
+
+
+def _run_in_worker(job_id):
+    try:
+        return run(job_id)
+    except Exception:
+        logger.exception(f"Upload job {job_id} crashed")
+    finally:
+        # Pool threads open their own connections; don't leak them.
+        connections.close_all()
+
+
+def run(job_id):
+    """Transfer one job's staged file, retrying until it succeeds or gives up."""
+    try:
+        job = UploadJob.objects.select_related('scan').get(pk=job_id)
+    except UploadJob.DoesNotExist:
+        logger.info(f"Upload job {job_id} is gone; its scan was deleted")
+        return None
+
+    storage = get_storage()
+    value = None
+    while True:
+        job.attempts += 1
+        job.status = UploadJob.RUNNING
+        job.save(update_fields=['attempts', 'status', 'updated_at'])
+        try:
+            # An identical file may have been stored since this job was
+            # queued. Once the original is stored, retries only redo what
+            # failed after it.
+            if value is None:
+                stored = find_stored(job.scan.content_hash)
+                if stored is not None:
+                    link_stored(job.scan, stored)
+                    return _finish(job)
+                value = storage.save(job.staged_path)
+            renditions = images.store_renditions(job.staged_path, storage)
+            break
+        except Exception as e:
+            job.error = str(e)
+            if job.attempts >= settings.SCANS_UPLOAD_MAX_ATTEMPTS:
+                logger.error(f"❌ Upload job {job.pk} failed after {job.attempts} attempts: {e}")
+                job.status = UploadJob.FAILED
+                job.save(update_fields=['error', 'status', 'updated_at'])
+                metrics.inc('upload_jobs_total', status='failed')
+                return job
+            logger.warning(f"Upload job {job.pk} attempt {job.attempts} failed: {e}")
+            job.save(update_fields=['error', 'updated_at'])
+            time.sleep(settings.SCANS_UPLOAD_RETRY_DELAY * 2 ** (job.attempts - 1))
+
+    if not UploadJob.objects.filter(pk=job.pk).exists():
+        # The scan got another image meanwhile (see forget_image).
+        logger.info(f"Upload job {job.pk} was superseded; not storing its image")
+        return None
+    scan = job.scan
+    scan.image = value
+    scan.renditions = renditions
+    scan.perceptual_hash = images.perceptual_hash(job.staged_path)
+    vector = images.describe(job.staged_path)
+    if vector is not None:
+        similarity.get_store().write(scan.pk, vector)
+    scan.has_features = vector is not None
+    try:
+        scan.tiles = images.build_tiles(scan.pk, job.staged_path)
+    except Exception as e:
+        # The viewer falls back to the preview; process_images can retry.
+        logger.warning(f"Tiling scan {scan.pk} failed: {e}")
+        scan.tiles = None
+    # Only the image: the metadata may have been edited meanwhile.
+    scan.save(update_fields=[
+        'image', 'renditions', 'perceptual_hash', 'has_features', 'tiles', 'updated_at',
+    ])
+    logger.info(f"✅ Upload job {job.pk} stored image for scan {scan.pk}")
+    return _finish(job)
+
+
+def _finish(job):
+    job.status = UploadJob.DONE
+    job.error = ''
+    job.save(update_fields=['status', 'error', 'updated_at'])
+    discard(job.staged_path)
+    metrics.inc('upload_jobs_total', status='done')
+    return job
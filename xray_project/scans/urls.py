@@ -1,10 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import XRayScanViewSet
+from .views import UploadJobViewSet, XRayScanViewSet, scan_tile
 
 router = DefaultRouter()
 router.register(r'scans', XRayScanViewSet)
+router.register(r'uploads', UploadJobViewSet)
 
 urlpatterns = [
+    path(
+        'scans/<int:pk>/tiles/<slug:version>/<int:level>/<int:col>_<int:row>.jpg',
+        scan_tile, name='scan-tile',
+    ),
     path('', include(router.urls)),
 ]
@@ -1,30 +1,210 @@
-from rest_framework import viewsets, filters, status
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from .models import XRayScan
-from .serializers import XRayScanSerializer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition, require_safe
+from . import (
+    export, fulltext, images, manifests, metrics, near_duplicates, search, search_sync, similarity, tags, uploads,
+)
+from .cache import bump_generation, get_search_response, get_state, set_search_response, versioned_key
+from .facets import compute_facets
+from .filters import XRayScanFilter
+from .models import SearchOutbox, UploadJob, XRayScan
+from .pagination import ScanPagination
+from .serializers import UploadJobSerializer, XRayScanListSerializer, XRayScanSerializer
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q as DjangoQ, Case, When
+from django.db.models import Q as DjangoQ
+from datetime import datetime, timezone
+import hashlib
+import ipaddress
 import logging
 import traceback
 
 logger = logging.getLogger(__name__)
 
-class LargeResultsSetPagination(PageNumberPagination):
-    page_size = 1000
-    page_size_query_param = 'page_size'
-    max_page_size = 10000
+
+def _etag(request, *parts):
+    # Representations differ by renderer, so the Accept header is included.
+    parts += (request.META.get('HTTP_ACCEPT', ''),)
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def _dataset_state(request):
+    # Shared by the ETag and Last-Modified callbacks and the cache keys:
+    # one primary key lookup per request.
+    if not hasattr(request, '_dataset_state'):
+        request._dataset_state = get_state()
+    return request._dataset_state
+
+
+def scan_list_etag(request, *args, **kwargs):
+    # Built from the dataset generation only: a matching request is
+    # answered with a 304 without touching the scans table. The path tells
+    # apart the list actions and the per-scan ones (near_duplicates,
+    # similar) that share this callback.
+    generation, _ = _dataset_state(request)
+    return _etag(request, generation, request.path, request.META.get('QUERY_STRING', ''))
+
+
+def scan_list_last_modified(request, *args, **kwargs):
+    _, modified_at = _dataset_state(request)
+    return datetime.fromtimestamp(modified_at, tz=timezone.utc)
+
+
+def _scan_updated_at(request, pk):
+    # Shared by the ETag and Last-Modified callbacks: one indexed pk lookup.
+    if not hasattr(request, '_scan_updated_at'):
+        try:
+            updated_at = XRayScan.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        except (TypeError, ValueError):
+            updated_at = None
+        request._scan_updated_at = updated_at
+    return request._scan_updated_at
+
+
+def _scan_id(pk):
+    # For actions that look the scan up themselves: as get_object() does,
+    # a pk that is not a number is a 404 rather than a ValueError.
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        raise Http404('No such scan.')
+
+
+def scan_detail_etag(request, pk=None, *args, **kwargs):
+    updated_at = _scan_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return _etag(request, pk, updated_at.isoformat())
+
+
+def scan_detail_last_modified(request, pk=None, *args, **kwargs):
+    return _scan_updated_at(request, pk)
+
+
+scan_list_condition = method_decorator(
+    condition(etag_func=scan_list_etag, last_modified_func=scan_list_last_modified)
+)
+scan_detail_condition = method_decorator(
+    condition(etag_func=scan_detail_etag, last_modified_func=scan_detail_last_modified)
+)
+
 
 class XRayScanViewSet(viewsets.ModelViewSet):
-    queryset = XRayScan.objects.all().order_by('-scan_date')
+    queryset = XRayScan.objects.all().order_by('-scan_date', '-id')
     serializer_class = XRayScanSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ['body_part', 'institution', 'diagnosis']
-    search_fields = ['description', 'diagnosis', 'tags']
+    pagination_class = ScanPagination
+    search_unavailable = False
+    # `search` is handled in get_queryset (Elasticsearch, then FTS5, then
+    # icontains); SearchFilter would AND a second, unindexed LIKE on top.
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = XRayScanFilter
 
     def get_serializer_context(self):
         return {'request': self.request}
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            # Clients may keep a copy but must revalidate it before reuse.
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    # Writes run in a transaction so the search outbox row recorded by the
+    # post_save/post_delete signals commits or rolls back with the scan.
+    def perform_create(self, serializer):
+        """
+        Save the metadata and stage the image locally; the transfer to the
+        image storage runs on the upload worker pool. Returns the scan and
+        its UploadJob, or None for the job when the same bytes are already
+        stored and the scan reuses them.
+        """
+        staged_path, content_hash = uploads.stage(serializer.validated_data.pop('image'))
+        stored = uploads.find_stored(content_hash)
+        try:
+            with transaction.atomic():
+                instance = serializer.save(image=None, content_hash=content_hash)
+                if stored is not None:
+                    uploads.link_stored(instance, stored)
+                    job = None
+                else:
+                    job = UploadJob.objects.create(scan=instance, staged_path=staged_path)
+        except Exception:
+            uploads.discard(staged_path)
+            raise
+        if job is None:
+            uploads.discard(staged_path)
+            return instance, None
+        uploads.submit(job)
+        return instance, job
+
+    def perform_update(self, serializer):
+        """
+        Save the changes. A new image is staged, deduplicated and
+        transferred as on create, and the fields derived from the old image
+        are reset meanwhile. Returns its UploadJob, or None when there is
+        nothing to transfer.
+        """
+        image = serializer.validated_data.pop('image', None)
+        if image is None:
+            with transaction.atomic():
+                serializer.save()
+            return None
+
+        staged_path, content_hash = uploads.stage(image)
+        current = serializer.instance
+        if content_hash == current.content_hash and current.image:
+            # The same bytes again: everything derived from them still holds.
+            uploads.discard(staged_path)
+            with transaction.atomic():
+                serializer.save()
+            return None
+        stored = uploads.find_stored(content_hash)
+        try:
+            with transaction.atomic():
+                uploads.forget_image(current)
+                instance = serializer.save(content_hash=content_hash, **uploads.UNSTORED)
+                if stored is not None:
+                    uploads.link_stored(instance, stored)
+                    job = None
+                else:
+                    job = UploadJob.objects.create(scan=instance, staged_path=staged_path)
+        except Exception:
+            uploads.discard(staged_path)
+            raise
+        if job is None:
+            uploads.discard(staged_path)
+            return None
+        uploads.submit(job)
+        return job
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(self.get_object(), data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        job = self.perform_update(serializer)
+        if job is None:
+            return Response(self.get_serializer(serializer.instance).data)
+        # As on create: the new image is stored in the background.
+        job.refresh_from_db()
+        serializer.instance.refresh_from_db()
+        response_data = self.get_serializer(serializer.instance).data
+        response_data['upload_job'] = UploadJobSerializer(job).data
+        return Response(response_data, status=status.HTTP_202_ACCEPTED)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
     def create(self, request, *args, **kwargs):
         try:
             logger.info(f" Upload request received")
@@ -52,15 +232,22 @@ class XRayScanViewSet(viewsets.ModelViewSet):
             
             logger.info("✅ Validation passed, saving instance...")
             
-            # Save the instance
-            instance = serializer.save()
-            logger.info(f"✅ Upload successful for scan ID: {instance.id}")
-            logger.info(f"   Image URL: {instance.image}")
+            # Save the instance; the image upload continues in the background
+            instance, job = self.perform_create(serializer)
+            if job is None:
+                # Known bytes: the scan already points at the stored image.
+                logger.info(f"✅ Scan ID {instance.id} created from an already stored image")
+                response_data = self.get_serializer(instance).data
+                response_data['upload_job'] = None
+                return Response(response_data, status=status.HTTP_201_CREATED)
+            logger.info(f"✅ Upload accepted for scan ID: {instance.id}, job {job.id}")
             
+            job.refresh_from_db()
             response_data = serializer.data
+            response_data['upload_job'] = UploadJobSerializer(job).data
             logger.info(f"✅ Returning response: {response_data}")
             
-            return Response(response_data, status=status.HTTP_201_CREATED)            
+            return Response(response_data, status=status.HTTP_202_ACCEPTED)            
             
         except Exception as e:
             logger.error(f"❌ Upload failed with exception: {str(e)}")
@@ -70,35 +257,368 @@ class XRayScanViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    def get_queryset(self):
-        base_queryset = super().get_queryset()
-        search_query = self.request.query_params.get('search')
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Create many scans from a `manifest` (JSON or CSV) and the `images`
+        it names. Every entry is validated before anything is written; rows
+        go in with one bulk_create and the images are uploaded concurrently
+        on the bounded upload pool, except those whose bytes are already
+        stored, which are linked without a job. Returns one result per
+        manifest entry, 201 when every image was stored and 207 otherwise.
+        """
+        manifest = request.FILES.get('manifest') or request.data.get('manifest')
+        if not manifest:
+            return Response({'manifest': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        rows = manifests.read_manifest(manifest)
+        items = manifests.validate_items(rows, request.FILES.getlist('images'), self.get_serializer_context())
+        logger.info(f" Batch upload of {len(items)} scans received")
+
+        staged = []
+        try:
+            for item in items:
+                staged.append(uploads.stage(item.validated_data.pop('image')))
+            stored = uploads.stored_with_hashes(content_hash for _, content_hash in staged)
+            with transaction.atomic():
+                scans = XRayScan.objects.bulk_create([
+                    XRayScan(content_hash=content_hash, **item.validated_data)
+                    for item, (_, content_hash) in zip(items, staged)
+                ])
+                jobs = {}
+                for scan, (path, content_hash) in zip(scans, staged):
+                    if content_hash in stored:
+                        uploads.link_stored(scan, stored[content_hash])
+                    else:
+                        jobs[scan.pk] = UploadJob(scan=scan, staged_path=path)
+                UploadJob.objects.bulk_create(jobs.values())
+                # bulk_create sends no signals: queue the index writes here.
+                search_sync.enqueue([scan.pk for scan in scans], SearchOutbox.INDEX)
+        except Exception:
+            for path, _ in staged:
+                uploads.discard(path)
+            raise
+        bump_generation()
+        for scan, (path, _) in zip(scans, staged):
+            if scan.pk not in jobs:
+                uploads.discard(path)
 
+        uploads.run_all([job.pk for job in jobs.values()])
+        finished = UploadJob.objects.in_bulk([job.pk for job in jobs.values()])
+        results = []
+        for index, scan in enumerate(scans):
+            job = finished[jobs[scan.pk].pk] if scan.pk in jobs else None
+            results.append({
+                'index': index,
+                'id': scan.pk,
+                'patient_id': scan.patient_id,
+                'upload_job': UploadJobSerializer(job).data if job else None,
+            })
+        failed = sum(job.status != UploadJob.DONE for job in finished.values())
+        logger.info(f"✅ Batch upload stored {len(results) - failed} images, {failed} failed")
+        return Response(
+            {'created': len(results), 'failed': failed, 'results': results},
+            status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED,
+        )
+
+    @scan_detail_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @scan_list_condition
+    def list(self, request, *args, **kwargs):
+        """
+        Lists are read with `.values()` and rendered by the lightweight
+        XRayScanListSerializer; `?fields=a,b` selects a sparse fieldset.
+        Detail, create and update keep the full XRayScanSerializer.
+        """
+        row_serializer = XRayScanListSerializer.from_query_params(request.query_params)
+        search_query = request.query_params.get('search')
         if not search_query:
-            return base_queryset
+            return self.list_rows(row_serializer)
+
+        # Search pages are cached under the dataset generation, so any scan
+        # write retires them. Links in the data are absolute, hence the host.
+        key = versioned_key(
+            f'search:{request.scheme}://{request.get_host()}', request.query_params,
+            generation=_dataset_state(request)[0],
+        )
+        data = get_search_response(key)
+        if data is not None:
+            return Response(data)
 
+        response = self.list_search_results(search_query, row_serializer)
+        if response is None:
+            # ES is down; don't ask it again from get_queryset.
+            self.search_unavailable = True
+            response = self.list_rows(row_serializer)
+        set_search_response(key, response.data)
+        return response
+
+    def list_rows(self, row_serializer):
+        queryset = row_serializer.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(row_serializer.serialize(page))
+
+    def list_search_results(self, search_query, row_serializer):
+        """
+        Page search results inside Elasticsearch and hydrate just that page
+        with one `id__in` query, keeping ES's rank order. Filters are
+        applied by ES, and facet counts for the filtered hits come back in
+        the same round trip. Returns None when ES is unavailable.
+        """
+        filterset = self.filterset_class(self.request.query_params, queryset=XRayScan.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+
+        size, offset, search_after, count = self.paginator.get_search_window(self.request)
+        page = search.search_page(
+            search_query, size, offset=offset, search_after=search_after, count=count,
+            filters=filterset.form.cleaned_data,
+        )
+        if page is None:
+            return None
+
+        rows = {
+            row['id']: row
+            for row in row_serializer.rows(XRayScan.objects.filter(id__in=page.ids))
+        }
+        # Hits deleted from the DB but not yet from the index are skipped.
+        data = row_serializer.serialize(rows[pk] for pk in page.ids if pk in rows)
+        return self.paginator.get_search_response(data, page)
+
+    def search_export_rows(self, search_query, row_serializer):
+        """
+        Every search hit as a list row, in rank order, hydrated one
+        Elasticsearch page at a time. None when ES is unavailable; if it
+        fails mid-export the stream is cut off with an error rather than
+        ending early as if complete.
+        """
+        filterset = self.filterset_class(self.request.query_params, queryset=XRayScan.objects.all())
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        pages = search.search_id_pages(
+            search_query, settings.SCANS_EXPORT_CHUNK_SIZE, filters=filterset.form.cleaned_data,
+        )
+        if pages is None:
+            return None
+
+        def rows():
+            for ids in pages:
+                found = {row['id']: row for row in row_serializer.rows(XRayScan.objects.filter(id__in=ids))}
+                # Hits deleted from the DB but not yet from the index are skipped.
+                yield from (found[pk] for pk in ids if pk in found)
+
+        return rows()
+
+    @action(detail=False, methods=['get'])
+    @scan_list_condition
+    def facets(self, request):
+        """Distinct body_part / diagnosis / institution values with counts."""
+        key = versioned_key(
+            'facets', request.query_params, exclude=('page', 'page_size', 'cursor'),
+            generation=_dataset_state(request)[0],
+        )
+        data = cache.get(key)
+        if data is None:
+            data = compute_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(key, data, settings.SCANS_FACETS_CACHE_TIMEOUT)
+        return Response(data)
+
+    @action(detail=False, methods=['get'], url_path='tags')
+    @scan_list_condition
+    def tag_frequencies(self, request):
+        """
+        The `?limit=` most used tags with their scan counts, most used
+        first, over the scans matching the list's filters.
+        """
         try:
-            from .documents import XRayScanDocument
-            from elasticsearch_dsl import Q
+            limit = int(request.query_params.get('limit', settings.SCANS_TAGS_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= settings.SCANS_TAGS_MAX_LIMIT:
+            raise ValidationError({'limit': [f'Must be an integer from 1 to {settings.SCANS_TAGS_MAX_LIMIT}.']})
 
-            q = Q('multi_match', query=search_query, fields=[
-                'description', 'diagnosis', 'tags', 'body_part', 'institution', 'patient_id'
-            ], fuzziness='auto')
+        key = versioned_key(
+            'tags', request.query_params, exclude=('page', 'page_size', 'cursor'),
+            generation=_dataset_state(request)[0],
+        )
+        data = cache.get(key)
+        if data is None:
+            data = tags.frequencies(self.filter_queryset(self.get_queryset()), limit=limit)
+            cache.set(key, data, settings.SCANS_FACETS_CACHE_TIMEOUT)
+        return Response(data)
 
-            search = XRayScanDocument.search().query(q)
-            results = search.execute()
-            ids = [int(hit.meta.id) for hit in results if hit.meta.id.isdigit()]
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream every matching scan as NDJSON (default) or CSV with
+        `?output=csv`, honouring the list's filters, `search` and `fields`.
+        Rows are read through a server-side cursor, or for a search page
+        by page from Elasticsearch as in the list's cursor mode, so memory
+        stays flat however large the export; gzip is applied on the fly
+        when the client accepts it.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in export.FORMATS:
+            raise ValidationError({'output': [f"Choose one of: {', '.join(export.FORMATS)}"]})
+        row_serializer = XRayScanListSerializer.from_query_params(request.query_params)
+        rows = None
+        search_query = request.query_params.get('search')
+        if search_query:
+            rows = self.search_export_rows(search_query, row_serializer)
+            # ES is down; don't ask it again from get_queryset.
+            self.search_unavailable = rows is None
+        if rows is None:
+            queryset = row_serializer.rows(self.filter_queryset(self.get_queryset()))
+            rows = queryset.iterator(chunk_size=settings.SCANS_EXPORT_CHUNK_SIZE)
+
+        gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+        content_type, extension = export.FORMATS[output]
+        response = StreamingHttpResponse(
+            export.encode(
+                (row_serializer.to_representation(row) for row in rows),
+                output, row_serializer.fields, gzip=gzip,
+            ),
+            content_type=content_type,
+        )
+        filename = f'scans-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{extension}'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if gzip:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        logger.info(f" Export started: {output}, gzip={gzip}")
+        return response
+
+    @action(detail=True, methods=['get'])
+    def tiles(self, request, pk=None):
+        """
+        DeepZoom descriptor for the scan's tile pyramid, with a `url`
+        template for its tiles. 404 until the pyramid has been built.
+        """
+        pk = _scan_id(pk)
+        tiles = XRayScan.objects.filter(pk=pk).values_list('tiles', flat=True).first()
+        if not tiles:
+            raise Http404('No tile pyramid for this scan yet.')
+        template = reverse('scan-tile', kwargs={
+            'pk': pk, 'version': tiles['version'], 'level': 0, 'col': 0, 'row': 0,
+        })
+        # Turn the reversed example into a {level}/{col}_{row} template.
+        prefix = request.build_absolute_uri(template.rsplit('/', 2)[0])
+        return Response({**tiles, 'url': prefix + '/{level}/{col}_{row}.' + tiles['format']})
+
+    @action(detail=True, methods=['get'], url_path='near-duplicates')
+    @scan_list_condition
+    def near_duplicates(self, request, pk=None):
+        """
+        Other scans whose perceptual hash is within `?distance=` bits of this
+        one's (default SCANS_NEAR_DUPLICATE_DISTANCE), nearest first, as list
+        rows with their `distance`; `fields` works as on the list. 404 until
+        the scan's hash has been computed.
+        """
+        pk = _scan_id(pk)
+        value = XRayScan.objects.filter(pk=pk).values_list('perceptual_hash', flat=True).first()
+        if not value:
+            raise Http404('No perceptual hash for this scan yet.')
+        try:
+            radius = int(request.query_params.get('distance', settings.SCANS_NEAR_DUPLICATE_DISTANCE))
+        except ValueError:
+            radius = -1
+        if not 0 <= radius <= settings.SCANS_NEAR_DUPLICATE_MAX_DISTANCE:
+            raise ValidationError({'distance': [
+                f'Must be an integer from 0 to {settings.SCANS_NEAR_DUPLICATE_MAX_DISTANCE}.'
+            ]})
+
+        index = near_duplicates.get_index()
+        matches = [
+            (distance, match) for distance, match in index.search(int(value, 16), radius)
+            if match != pk
+        ][:settings.SCANS_NEAR_DUPLICATE_LIMIT]
+        row_serializer = XRayScanListSerializer.from_query_params(request.query_params)
+        rows = {
+            row['id']: row
+            for row in row_serializer.rows(XRayScan.objects.filter(id__in=[match for _, match in matches]))
+        }
+        # Scans deleted since the index last saw them.
+        index.discard([match for _, match in matches if match not in rows])
+        return Response({
+            'distance': radius,
+            'results': [
+                {**row_serializer.to_representation(rows[match]), 'distance': distance}
+                for distance, match in matches if match in rows
+            ],
+        })
+
+    @action(detail=True, methods=['get'])
+    @scan_list_condition
+    def similar(self, request, pk=None):
+        """
+        The `?k=` scans whose images look most like this one's, by cosine
+        similarity of their feature vectors, best first, as list rows with
+        their `score`; `fields` works as on the list. Uses the IVF index
+        when built; `?exact=1` compares against every scan. 404 until the
+        scan's features have been extracted.
+        """
+        pk = _scan_id(pk)
+        store = similarity.get_store()
+        vector = store.read(pk) if XRayScan.objects.filter(pk=pk, has_features=True).exists() else None
+        if vector is None:
+            raise Http404('No features for this scan yet.')
+        try:
+            k = int(request.query_params.get('k', settings.SCANS_SIMILAR_LIMIT))
+        except ValueError:
+            k = 0
+        if not 1 <= k <= settings.SCANS_SIMILAR_MAX_LIMIT:
+            raise ValidationError({'k': [f'Must be an integer from 1 to {settings.SCANS_SIMILAR_MAX_LIMIT}.']})
+        exact = request.query_params.get('exact') in ('1', 'true')
+
+        # One extra for the scan itself.
+        matches = [
+            (match, score) for match, score in store.search(vector, k + 1, exact=exact) if match != pk
+        ][:k]
+        row_serializer = XRayScanListSerializer.from_query_params(request.query_params)
+        rows = {
+            row['id']: row
+            for row in row_serializer.rows(
+                XRayScan.objects.filter(id__in=[match for match, _ in matches], has_features=True)
+            )
+        }
+        return Response({
+            'index': 'exact' if exact or store.centroids() is None else 'ivf',
+            'results': [
+                {**row_serializer.to_representation(rows[match]), 'score': round(score, 4)}
+                for match, score in matches if match in rows
+            ],
+        })
 
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """Search response cache hits and misses, over every worker when SCANS_METRICS_DIR is set."""
+        hits = metrics.total('search_cache_requests_total', result='hit')
+        misses = metrics.total('search_cache_requests_total', result='miss')
+        total = hits + misses
+        return Response({
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / total if total else None,
+        })
+
+    def get_queryset(self):
+        base_queryset = super().get_queryset()
+        search_query = self.request.query_params.get('search')
+
+        if not search_query:
+            return base_queryset
+
+        if not self.search_unavailable:
+            ids = search.search_scan_ids(search_query)
             if ids:
-                preserved_order = Case(
-                    *[When(id=id, then=pos) for pos, id in enumerate(ids)]
-                )
-                return base_queryset.filter(id__in=ids).order_by(preserved_order)
+                return base_queryset.filter(id__in=ids)
 
-        except Exception as e:
-            logger.warning(f"⚠️ Elasticsearch search failed: {e}")
+        # fallback to the local full-text index, then to a plain DB query
+        ranked = fulltext.search(base_queryset, search_query)
+        if ranked is not None:
+            return ranked
 
-        # fallback to DB query
         return base_queryset.filter(
             DjangoQ(description__icontains=search_query) |
             DjangoQ(diagnosis__icontains=search_query) |
@@ -106,4 +626,50 @@ class XRayScanViewSet(viewsets.ModelViewSet):
             DjangoQ(body_part__icontains=search_query) |
             DjangoQ(institution__icontains=search_query) |
             DjangoQ(patient_id__icontains=search_query)
-        )
\ No newline at end of file
+        )
+
+@require_safe
+def scan_tile(request, pk, version, level, col, row):
+    """
+    One tile of a scan's DeepZoom pyramid, straight from disk. The URL
+    carries the pyramid version, so the tile is immutable and cached for
+    SCANS_TILE_CACHE_SECONDS.
+    """
+    path = images.tiles_path(pk, version, str(level), f'{col}_{row}.jpg')
+    try:
+        response = FileResponse(open(path, 'rb'), content_type='image/jpeg')
+    except FileNotFoundError:
+        raise Http404('No such tile.')
+    response['Cache-Control'] = f'public, max-age={settings.SCANS_TILE_CACHE_SECONDS}, immutable'
+    return response
+
+
+def _metrics_allowed(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False) for network in settings.SCANS_METRICS_ALLOWED_IPS
+    )
+
+
+@require_safe
+@never_cache
+def prometheus_metrics(request):
+    """
+    Metrics (see scans.metrics) for Prometheus to scrape, from every
+    worker when SCANS_METRICS_DIR is set. Only for the addresses in
+    SCANS_METRICS_ALLOWED_IPS.
+    """
+    if not _metrics_allowed(request.META.get('REMOTE_ADDR', '')):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class UploadJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status of background image uploads started by scan create."""
+    queryset = UploadJob.objects.all().order_by('-id')
+    serializer_class = UploadJobSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['scan', 'status']
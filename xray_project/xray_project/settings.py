@@ -44,6 +44,8 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack.
+    'scans.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -82,7 +84,55 @@ DATABASES = {
     }
 }
 
+# Cache
+# Cached facets and search pages are keyed by the dataset generation, which
+# lives in the database (scans.cache), so a process-local backend never
+# serves another worker's stale entries; a shared backend (Redis, the
+# database cache) only raises the hit rate across gunicorn workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'xray-scans'),
+    },
+    # Search response pages. LocMemCache evicts least recently used entries
+    # past MAX_ENTRIES; writes retire entries through the dataset
+    # generation, so TIMEOUT only bounds staleness of ES results.
+    'search': {
+        'BACKEND': os.getenv('SEARCH_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('SEARCH_CACHE_LOCATION', 'xray-scans-search'),
+        'TIMEOUT': int(os.getenv('SEARCH_CACHE_TIMEOUT', 60)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1000)),
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+SCANS_FACETS_CACHE_TIMEOUT = int(os.getenv('SCANS_FACETS_CACHE_TIMEOUT', 300))
+# Tag filters matching at most this many scans fetch and sort them; larger
+# ones probe the tag index while reading scans in list order.
+SCANS_TAG_SORT_LIMIT = int(os.getenv('SCANS_TAG_SORT_LIMIT', 20000))
+# Tags listed by /api/scans/tags/ unless ?limit= says otherwise.
+SCANS_TAGS_LIMIT = 100
+SCANS_TAGS_MAX_LIMIT = 1000
+# Rows fetched per server-side cursor round trip by /api/scans/export/.
+SCANS_EXPORT_CHUNK_SIZE = int(os.getenv('SCANS_EXPORT_CHUNK_SIZE', 2000))
+
 # eslastic
+# One shared client per process (pooled connections per node). Timeouts are
+# kept tight because search has a database fallback; bulk jobs raise them
+# per call with client.options().
+SCANS_SEARCH_TIMEOUT = float(os.getenv('ES_TIMEOUT', 0.5))
+SCANS_SEARCH_BREAKER_THRESHOLD = int(os.getenv('ES_BREAKER_THRESHOLD', 5))
+SCANS_SEARCH_BREAKER_RESET = float(os.getenv('ES_BREAKER_RESET', 30))
+SCANS_INDEXING_TIMEOUT = float(os.getenv('ES_INDEXING_TIMEOUT', 60))
+# Documents are kept in sync by the search outbox (manage.py sync_search),
+# not by django_elasticsearch_dsl's synchronous signal processor.
+ELASTICSEARCH_DSL_AUTOSYNC = False
+ELASTICSEARCH_DSL_AUTO_REFRESH = False
+# Most hits fetched when a search result set is filtered in SQL.
+SCANS_SEARCH_ID_LIMIT = int(os.getenv('ES_SEARCH_ID_LIMIT', 10000))
+
 ELASTICSEARCH_DSL = {
     'default': {
         'hosts': os.getenv("ES_HOST", "https://localhost:9200"),
@@ -91,6 +141,10 @@ ELASTICSEARCH_DSL = {
             os.getenv("ES_PASS", "your-password")
         ),
         'verify_certs': False,
+        'request_timeout': SCANS_SEARCH_TIMEOUT,
+        'max_retries': 0,
+        'retry_on_timeout': False,
+        'connections_per_node': int(os.getenv('ES_CONNECTIONS_PER_NODE', 10)),
     },
 }
 
@@ -114,6 +168,7 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 # Cloudinary Media files
 MEDIA_URL = '/media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
 CLOUDINARY_STORAGE = {
@@ -122,6 +177,57 @@ CLOUDINARY_STORAGE = {
     'API_SECRET': os.getenv('CLOUDINARY_API_SECRET')
 }
 
+# Scan uploads: create stages the file locally and returns 202; a worker
+# pool moves it to the image storage backend, retrying with backoff.
+# SCANS_IMAGE_STORAGE=scans.storage.LocalImageStorage keeps images on disk.
+SCANS_IMAGE_STORAGE = os.getenv('SCANS_IMAGE_STORAGE', 'scans.storage.CloudinaryImageStorage')
+SCANS_UPLOAD_STAGING_DIR = os.getenv('SCANS_UPLOAD_STAGING_DIR', os.path.join(MEDIA_ROOT, 'staging'))
+SCANS_UPLOAD_WORKERS = int(os.getenv('SCANS_UPLOAD_WORKERS', 4))
+SCANS_UPLOAD_MAX_ATTEMPTS = int(os.getenv('SCANS_UPLOAD_MAX_ATTEMPTS', 3))
+SCANS_UPLOAD_RETRY_DELAY = float(os.getenv('SCANS_UPLOAD_RETRY_DELAY', 1.0))
+# Run transfers inline instead of on the pool (tests, debugging).
+SCANS_UPLOAD_EAGER = os.getenv('SCANS_UPLOAD_EAGER', 'False') == 'True'
+SCANS_BATCH_MAX_ITEMS = int(os.getenv('SCANS_BATCH_MAX_ITEMS', 500))
+
+# DeepZoom tile pyramids, built by the upload workers and served by
+# /api/scans/<id>/tiles/...; tile URLs are versioned and cached for a year.
+SCANS_TILES_ROOT = os.getenv('SCANS_TILES_ROOT', os.path.join(MEDIA_ROOT, 'tiles'))
+SCANS_TILE_SIZE = int(os.getenv('SCANS_TILE_SIZE', 254))
+SCANS_TILE_OVERLAP = int(os.getenv('SCANS_TILE_OVERLAP', 1))
+SCANS_TILE_CACHE_SECONDS = 365 * 24 * 3600
+
+# /api/scans/<id>/near-duplicates/: Hamming radius over the 64-bit dHash.
+# Lookups stay sub-linear only for small radii, hence the cap.
+SCANS_NEAR_DUPLICATE_DISTANCE = int(os.getenv('SCANS_NEAR_DUPLICATE_DISTANCE', 10))
+SCANS_NEAR_DUPLICATE_MAX_DISTANCE = 16
+SCANS_NEAR_DUPLICATE_LIMIT = int(os.getenv('SCANS_NEAR_DUPLICATE_LIMIT', 100))
+
+# /api/scans/<id>/similar/: feature vectors memory-mapped from this
+# directory; once `manage.py build_similarity_index` has run, queries scan
+# only the SCANS_SIMILARITY_NPROBE nearest IVF lists.
+SCANS_FEATURES_DIR = os.getenv('SCANS_FEATURES_DIR', os.path.join(MEDIA_ROOT, 'features'))
+SCANS_SIMILARITY_NPROBE = int(os.getenv('SCANS_SIMILARITY_NPROBE', 8))
+SCANS_SIMILAR_LIMIT = 20
+SCANS_SIMILAR_MAX_LIMIT = 100
+
+# Requests slower than this many ms are logged with their SQL and
+# Elasticsearch queries; 0 turns the slow-request log off.
+SCANS_SLOW_REQUEST_MS = float(os.getenv('SCANS_SLOW_REQUEST_MS', 0))
+
+# /metrics (see scans.metrics). With more than one worker process, set
+# SCANS_METRICS_DIR to a directory the workers share and empty it on
+# every start; unset, a scrape only sees the worker that answers it.
+# Scrapes are answered for the comma-separated addresses or networks in
+# SCANS_METRICS_ALLOWED_IPS only (matched against REMOTE_ADDR).
+SCANS_METRICS_DIR = os.getenv('SCANS_METRICS_DIR', '')
+SCANS_METRICS_ALLOWED_IPS = [
+    network.strip() for network in os.getenv('SCANS_METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+    if network.strip()
+]
+
+# Delivery URLs memoized by the scan serializers
+SCANS_IMAGE_URL_CACHE_SIZE = int(os.getenv('SCANS_IMAGE_URL_CACHE_SIZE', 8192))
+
 # CORS for frontend on Render/Netlify/etc
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
@@ -184,6 +290,8 @@ REST_FRAMEWORK = {
 FILE_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50 * 1024 * 1024  # 50MB
 FILE_UPLOAD_PERMISSIONS = 0o644
+# A batch upload carries one file per scan plus its manifest.
+DATA_UPLOAD_MAX_NUMBER_FILES = SCANS_BATCH_MAX_ITEMS + 1
 
 LOGGING = {
     'version': 1,
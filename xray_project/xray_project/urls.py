@@ -2,10 +2,12 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from scans.views import prometheus_metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('scans.urls')),
+    path('metrics', prometheus_metrics, name='metrics'),
 ]
 
 